@@ -0,0 +1,141 @@
+"""Агент рабочего узла: запускает, останавливает и обновляет ботов на своей машине по командам backend.
+
+Агент использует те же docker-операции, что и backend на одном хосте
+(utils.start_local, upgrade.apply_upgrade), а исходники бота получает
+архивом в запросе и кладёт в свой BOTS_DIR. Чтобы бот мог переехать на
+другой узел вместе с базой, нужен TENANT_STORAGE=shared и общий для всех
+узлов TENANT_DATA_DIR (NFS и т. п.) по одному и тому же пути.
+
+    AGENT_TOKEN=... python -m app.backend.agent --port 9101
+
+После запуска узел добавляется в кластер командой
+python -m app.backend.nodes add <node_id> http://<host>:9101 (см. nodes.py).
+"""
+import re
+import hmac
+import argparse
+from pathlib import Path
+from typing import Literal, Optional
+
+import uvicorn
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from app.backend.cluster import AGENT_TOKEN, unpack_dir
+from app.backend.quotas import TenantQuota, host_capacity
+from app.backend.upgrade import apply_upgrade
+from app.backend.utils import (
+    BOTS_DIR, ExportError, read_bot_metrics, remove_local, run_docker, start_local, stop_local, stream_export
+)
+
+AGENT_PORT = 9101
+# bot_id генерирует backend (uuid4()[:8]); всё остальное — попытка выйти за пределы BOTS_DIR
+BOT_ID_RE = re.compile(r"^[0-9a-f-]+$")
+
+
+def check_token(x_agent_token: Optional[str] = Header(None)):
+    if not AGENT_TOKEN or not hmac.compare_digest((x_agent_token or "").encode(), AGENT_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Неверный токен агента")
+
+
+def _bot_path(bot_id: str, suffix: str = "") -> Path:
+    if not BOT_ID_RE.match(bot_id):
+        raise HTTPException(status_code=400, detail="Некорректный bot_id")
+    return Path(BOTS_DIR) / f"{bot_id}{suffix}"
+
+
+app = FastAPI(dependencies=[Depends(check_token)])
+
+
+class StartRequest(BaseModel):
+    bundle: str
+    cpus: float
+    memory_mb: int
+    updates_per_sec: float
+
+
+class UpgradeRequest(StartRequest):
+    version: str
+
+
+class StopRequest(BaseModel):
+    remove: bool = False
+
+
+@app.get("/health")
+async def health():
+    capacity = host_capacity()
+    _, names = await run_docker("ps", "--filter", "name=^bot_", "--format", "{{.Names}}")
+    return {
+        "capacity": {"cpus": capacity.cpus, "memory_mb": capacity.memory_mb},
+        "running": [name[len("bot_"):] for name in names.split()],
+    }
+
+
+@app.post("/tenants/{bot_id}/start")
+async def start_tenant(bot_id: str, request: StartRequest):
+    bot_path = _bot_path(bot_id)
+    unpack_dir(request.bundle, bot_path)
+    quota = TenantQuota(request.cpus, request.memory_mb, request.updates_per_sec)
+    try:
+        return await start_local(bot_id, bot_path, quota)
+    except Exception as e:
+        # Не оставляем полузапущенный контейнер: backend повторит запуск здесь или на другом узле
+        await remove_local(bot_id, bot_path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/tenants/{bot_id}/stop")
+async def stop_tenant(bot_id: str, request: StopRequest):
+    _bot_path(bot_id)
+    await stop_local(bot_id, remove=request.remove)
+    return {"bot_id": bot_id, "stopped": True}
+
+
+@app.delete("/tenants/{bot_id}")
+async def remove_tenant(bot_id: str):
+    await remove_local(bot_id, _bot_path(bot_id))
+    return {"bot_id": bot_id, "removed": True}
+
+
+@app.post("/tenants/{bot_id}/upgrade")
+async def upgrade_tenant(bot_id: str, request: UpgradeRequest):
+    staged = _bot_path(bot_id, ".next")
+    unpack_dir(request.bundle, staged)
+    tenant = {"bot_id": bot_id, "cpus": request.cpus, "memory_mb": request.memory_mb,
+              "updates_per_sec": request.updates_per_sec}
+    status, error = await apply_upgrade(tenant, staged, request.version)
+    return {"status": status, "error": error}
+
+
+@app.get("/tenants/{bot_id}/metrics")
+async def tenant_metrics(bot_id: str):
+    _bot_path(bot_id)
+    return {"metrics": await read_bot_metrics(bot_id)}
+
+
+@app.get("/tenants/{bot_id}/export/{table}")
+async def tenant_export(bot_id: str, table: Literal["users", "slots", "bookings"],
+                        fmt: Literal["csv", "jsonl"] = "csv"):
+    _bot_path(bot_id)
+    try:
+        chunks = await stream_export(bot_id, table, fmt)
+    except ExportError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(chunks, media_type="application/gzip")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Агент рабочего узла")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=AGENT_PORT)
+    args = parser.parse_args()
+    # Агент собирает и запускает присланный код — без общего секрета его нельзя открывать в сеть
+    if not AGENT_TOKEN:
+        parser.error("задайте AGENT_TOKEN — общий секрет backend и агентов")
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Онлайн-бэкапы баз ботов и subscriptions.db.
+
+Снимок делается через backup API SQLite порциями по BACKUP_PAGES страниц с паузой
+BACKUP_SLEEP между ними, поэтому бот не останавливается и не голодает по записи.
+Архивы хранятся сжатыми и адресуются по sha256 содержимого: одинаковые снимки
+(бот за день ничего не записал) занимают место один раз. Для каждого бота
+остаются последние BACKUP_KEEP снимков.
+
+    python -m app.backend.backup run               # снять все активные боты и подписки
+    python -m app.backend.backup list <bot_id>
+    python -m app.backend.backup restore <bot_id> [backup_id]
+
+В режиме TENANT_STORAGE=pooled данные всех ботов — один файл: он снимается
+целиком под id _pool и восстанавливается тоже только целиком (это откатывает
+всех ботов сразу). Отдельный бот при остановке данных не теряет — его строки
+остаются в общей базе.
+"""
+import os
+import sys
+import gzip
+import shutil
+import asyncio
+import hashlib
+import sqlite3
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import aiosqlite
+
+from app.backend.utils import run_docker
+from app.shared.subscription_db import SUBSCRIPTIONS_DB, init_db
+from app.shared.tenant_registry import list_tenants
+from app.shared.tenant_store import POOL_ID, pool_db_path, pooled_storage, shared_storage, tenant_db_path
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "app/backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))
+BACKUP_SLEEP = float(os.getenv("BACKUP_SLEEP", "0.05"))
+BACKUP_CONCURRENCY = int(os.getenv("BACKUP_CONCURRENCY", "2"))
+
+# Имя, под которым в архиве лежит сама subscriptions.db
+SUBSCRIPTIONS_ID = "_subscriptions"
+CONTAINER_SNAPSHOT = "/tmp/snapshot.db"
+CONTAINER_DB_PATH = "os.getenv('DB_PATH', 'bot_database.db')"
+
+# Выполняется внутри контейнера: backup API из базы бота в файл/из файла в базу
+_SNAPSHOT_SCRIPT = (
+    "import os, sqlite3, sys; "
+    f"src = sqlite3.connect({CONTAINER_DB_PATH}); dst = sqlite3.connect(sys.argv[1]); "
+    "src.backup(dst, pages=int(sys.argv[2]), sleep=float(sys.argv[3])); dst.close(); src.close()"
+)
+_RESTORE_SCRIPT = (
+    "import os, sqlite3, sys; "
+    f"src = sqlite3.connect(sys.argv[1]); dst = sqlite3.connect({CONTAINER_DB_PATH}); "
+    "src.backup(dst); dst.close(); src.close(); os.remove(sys.argv[1])"
+)
+
+
+class BackupError(RuntimeError):
+    pass
+
+
+def _objects_dir() -> Path:
+    path = Path(BACKUP_DIR) / "objects"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _backup_file(source: Path, target: Path):
+    """Согласованная копия живой базы: backup API с паузами между порциями страниц."""
+    src = sqlite3.connect(source, timeout=30)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _restore_file(snapshot: Path, target: Path):
+    target.parent.mkdir(parents=True, exist_ok=True)
+    src = sqlite3.connect(snapshot)
+    dst = sqlite3.connect(target, timeout=30)
+    try:
+        # Пишем через backup API, а не копированием файла: открытые соединения бота увидят новую базу целиком
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _archive(snapshot: Path) -> tuple:
+    digest = hashlib.sha256()
+    with open(snapshot, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+    target = _objects_dir() / f"{sha256}.db.gz"
+    if not target.exists():
+        partial = target.with_suffix(".tmp")
+        with open(snapshot, "rb") as src, gzip.open(partial, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        partial.replace(target)
+    return sha256, target.stat().st_size
+
+
+def _unarchive(sha256: str, target: Path):
+    with gzip.open(_objects_dir() / f"{sha256}.db.gz", "rb") as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+
+async def _snapshot_container(bot_id: str, target: Path):
+    container = f"bot_{bot_id}"
+    code, _ = await run_docker("exec", container, "python", "-c", _SNAPSHOT_SCRIPT,
+                               CONTAINER_SNAPSHOT, str(BACKUP_PAGES), str(BACKUP_SLEEP))
+    if code != 0:
+        raise BackupError(f"Не удалось снять базу в контейнере {container}")
+    code, _ = await run_docker("cp", f"{container}:{CONTAINER_SNAPSHOT}", str(target))
+    await run_docker("exec", container, "rm", "-f", CONTAINER_SNAPSHOT)
+    if code != 0 or not target.exists():
+        raise BackupError(f"Не удалось скопировать снимок из контейнера {container}")
+
+
+async def backup_tenant(bot_id: str) -> Optional[int]:
+    """Снимает базу бота (subscriptions.db для SUBSCRIPTIONS_ID, общую базу для POOL_ID) и возвращает id бэкапа.
+
+    None — режим pooled: у бота нет своего файла, его данные снимаются вместе с общей базой.
+    """
+    if pooled_storage() and bot_id not in (SUBSCRIPTIONS_ID, POOL_ID):
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = Path(tmp) / "snapshot.db"
+        if bot_id == SUBSCRIPTIONS_ID:
+            await asyncio.to_thread(_backup_file, Path(SUBSCRIPTIONS_DB), snapshot)
+        elif bot_id == POOL_ID:
+            source = pool_db_path()
+            if not source.exists():
+                raise BackupError(f"Общая база ботов не найдена: {source}")
+            await asyncio.to_thread(_backup_file, source, snapshot)
+        elif shared_storage():
+            source = tenant_db_path(bot_id)
+            if not source.exists():
+                raise BackupError(f"База бота {bot_id} не найдена: {source}")
+            await asyncio.to_thread(_backup_file, source, snapshot)
+        else:
+            await _snapshot_container(bot_id, snapshot)
+        sha256, size = await asyncio.to_thread(_archive, snapshot)
+
+    async with aiosqlite.connect(SUBSCRIPTIONS_DB) as db:
+        cursor = await db.execute(
+            "INSERT INTO backups (bot_id, sha256, size, created_at) VALUES (?, ?, ?, ?)",
+            (bot_id, sha256, size, datetime.now().isoformat(timespec="seconds"))
+        )
+        await db.commit()
+        return cursor.lastrowid
+
+
+async def list_backups(bot_id: str) -> List[dict]:
+    async with aiosqlite.connect(SUBSCRIPTIONS_DB) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(
+            "SELECT id, sha256, size, created_at FROM backups WHERE bot_id = ? ORDER BY id DESC", (bot_id,)
+        )
+        return [dict(row) for row in await cursor.fetchall()]
+
+
+async def restore_tenant(bot_id: str, backup_id: Optional[int] = None) -> dict:
+    """Восстанавливает базу бота из бэкапа (по умолчанию — последнего)."""
+    if pooled_storage() and bot_id not in (SUBSCRIPTIONS_ID, POOL_ID):
+        raise BackupError(f"В режиме pooled база у ботов общая, восстанавливается только целиком: restore {POOL_ID}")
+    backups = await list_backups(bot_id)
+    if backup_id is not None:
+        backups = [b for b in backups if b["id"] == backup_id]
+    if not backups:
+        raise BackupError(f"Нет бэкапа для бота {bot_id}")
+    backup = backups[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = Path(tmp) / "restore.db"
+        await asyncio.to_thread(_unarchive, backup["sha256"], snapshot)
+        if bot_id == SUBSCRIPTIONS_ID:
+            await asyncio.to_thread(_restore_file, snapshot, Path(SUBSCRIPTIONS_DB))
+        elif bot_id == POOL_ID:
+            await asyncio.to_thread(_restore_file, snapshot, pool_db_path())
+        elif shared_storage():
+            await asyncio.to_thread(_restore_file, snapshot, tenant_db_path(bot_id))
+        else:
+            container = f"bot_{bot_id}"
+            code, _ = await run_docker("cp", str(snapshot), f"{container}:{CONTAINER_SNAPSHOT}")
+            if code == 0:
+                code, _ = await run_docker("exec", container, "python", "-c", _RESTORE_SCRIPT, CONTAINER_SNAPSHOT)
+            if code != 0:
+                raise BackupError(f"Контейнер {container} недоступен, восстановить базу не удалось")
+    return backup
+
+
+async def prune(keep: int = BACKUP_KEEP) -> int:
+    """Удаляет старые записи сверх keep на бота и архивы, на которые больше никто не ссылается."""
+    async with aiosqlite.connect(SUBSCRIPTIONS_DB) as db:
+        await db.execute("""
+            DELETE FROM backups WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY bot_id ORDER BY id DESC) AS rn FROM backups
+                ) WHERE rn > ?
+            )
+        """, (keep,))
+        await db.commit()
+        cursor = await db.execute("SELECT DISTINCT sha256 FROM backups")
+        referenced = {row[0] for row in await cursor.fetchall()}
+
+    removed = 0
+    for path in _objects_dir().glob("*.db.gz"):
+        if path.name.split(".")[0] not in referenced:
+            path.unlink()
+            removed += 1
+    return removed
+
+
+async def backup_all() -> dict:
+    if pooled_storage():
+        bot_ids = [SUBSCRIPTIONS_ID, POOL_ID]
+    else:
+        bot_ids = [SUBSCRIPTIONS_ID] + [t["bot_id"] for t in await list_tenants(status="active")]
+    semaphore = asyncio.Semaphore(BACKUP_CONCURRENCY)
+    failed = []
+
+    async def one(bot_id: str):
+        async with semaphore:
+            try:
+                await backup_tenant(bot_id)
+            except Exception as e:
+                print(f"⚠️ Бэкап {bot_id} не удался: {e}")
+                failed.append(bot_id)
+
+    await asyncio.gather(*(one(bot_id) for bot_id in bot_ids))
+    removed = await prune()
+    print(f"💾 Бэкапы: {len(bot_ids) - len(failed)} из {len(bot_ids)}, удалено старых архивов: {removed}")
+    return {"total": len(bot_ids), "failed": failed, "pruned": removed}
+
+
+async def _cli(args: List[str]):
+    await init_db()
+    if args[:1] == ["run"]:
+        await backup_all()
+    elif args[:1] == ["list"] and len(args) == 2:
+        for backup in await list_backups(args[1]):
+            print(f"{backup['id']}\t{backup['created_at']}\t{backup['size']}\t{backup['sha256'][:12]}")
+    elif args[:1] == ["restore"] and len(args) in (2, 3):
+        backup = await restore_tenant(args[1], int(args[2]) if len(args) == 3 else None)
+        print(f"✅ {args[1]} восстановлен из бэкапа #{backup['id']} от {backup['created_at']}")
+    else:
+        sys.exit(__doc__)
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli(sys.argv[1:]))
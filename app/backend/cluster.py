@@ -0,0 +1,216 @@
+"""Размещение ботов по рабочим узлам.
+
+Без зарегистрированных узлов всё работает как раньше — боты запускаются на
+хосте backend. Узел — машина с агентом (app/backend/agent.py), который по
+HTTP собирает и запускает контейнеры у себя. Узлы и то, какой бот где
+работает, хранятся в реестре (таблицы nodes и placements).
+
+Узел для бота выбирается по кольцу консистентного хэширования: у каждого
+узла на кольце weight × RING_VNODES точек (вес по умолчанию — память узла
+в ГБ), бот достаётся первому узлу по часовой стрелке от хэша bot_id. Если
+квота бота на этом узле уже не помещается, берётся следующий узел кольца.
+Новый узел забирает себе только часть кольца, поэтому при перебалансировке
+(app/backend/nodes.py) переезжают лишь боты, попавшие на его участки.
+
+Backend держит у себя исходники и .env каждого бота (BOTS_DIR) и отправляет
+их агенту архивом при запуске, переезде и обновлении. При TENANT_STORAGE=pooled
+узлы не используются: общая база SQLite работает только на одном хосте.
+"""
+import io
+import os
+import base64
+import bisect
+import asyncio
+import hashlib
+import tarfile
+import shutil
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+import aiohttp
+
+from app.backend.quotas import CapacityError, TenantQuota
+from app.shared.tenant_registry import list_nodes, set_placement
+from app.shared.tenant_store import pooled_storage
+
+# Общий секрет backend и агентов, передаётся в заголовке X-Agent-Token
+AGENT_TOKEN = os.getenv("AGENT_TOKEN", "")
+# Сборка образа на узле идёт внутри запроса, поэтому таймаут большой
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "600"))
+RING_VNODES = int(os.getenv("RING_VNODES", "64"))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+class AgentError(RuntimeError):
+    pass
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, weights: Dict[str, float], vnodes: int = RING_VNODES):
+        points = sorted(
+            (_hash(f"{node_id}#{i}"), node_id)
+            for node_id, weight in weights.items()
+            for i in range(max(1, round(weight * vnodes)))
+        )
+        self._keys = [key for key, _ in points]
+        self._nodes = [node_id for _, node_id in points]
+        self._count = len(weights)
+
+    def candidates(self, key: str) -> Iterator[str]:
+        """Узлы в порядке обхода кольца от ключа, каждый по разу: первый — владелец ключа."""
+        if not self._nodes:
+            return
+        start = bisect.bisect(self._keys, _hash(key))
+        seen = set()
+        for i in range(len(self._nodes)):
+            node_id = self._nodes[(start + i) % len(self._nodes)]
+            if node_id not in seen:
+                seen.add(node_id)
+                yield node_id
+                if len(seen) == self._count:
+                    return
+
+
+def node_weight(memory_mb: int) -> float:
+    return round(memory_mb / 1024, 2)
+
+
+def free_resources(nodes: List[dict]) -> Dict[str, List[float]]:
+    return {
+        n["node_id"]: [n["cpus"] - n["committed_cpus"], n["memory_mb"] - n["committed_memory_mb"]]
+        for n in nodes
+    }
+
+
+def choose_node(ring: HashRing, bot_id: str, quota: TenantQuota,
+                free: Dict[str, List[float]]) -> Optional[str]:
+    """Первый узел кольца, на котором квота помещается; свободные ресурсы узла уменьшаются."""
+    for node_id in ring.candidates(bot_id):
+        cpus, memory_mb = free[node_id]
+        if quota.cpus <= cpus and quota.memory_mb <= memory_mb:
+            free[node_id] = [cpus - quota.cpus, memory_mb - quota.memory_mb]
+            return node_id
+    return None
+
+
+_place_lock = asyncio.Lock()
+
+
+async def place(bot_id: str, quota: TenantQuota) -> Optional[dict]:
+    """Выбирает узел и записывает размещение; None — узлов нет, бот запускается на этом хосте."""
+    if pooled_storage():
+        return None
+    async with _place_lock:
+        nodes = await list_nodes(status="active")
+        if not nodes:
+            return None
+        ring = HashRing({n["node_id"]: n["weight"] for n in nodes})
+        node_id = choose_node(ring, bot_id, quota, free_resources(nodes))
+        if node_id is None:
+            raise CapacityError("Ни на одном узле не хватает ресурсов, попробуйте создать бота позже")
+        # Запись до запуска: параллельное размещение уже видит квоту бота на этом узле
+        await set_placement(bot_id, node_id)
+        return next(n for n in nodes if n["node_id"] == node_id)
+
+
+def pack_dir(path: Path) -> str:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        tar.add(path, arcname=".", filter=lambda info: None if "__pycache__" in info.name else info)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def unpack_dir(bundle: str, target: Path):
+    shutil.rmtree(target, ignore_errors=True)
+    target.mkdir(parents=True)
+    with tarfile.open(fileobj=io.BytesIO(base64.b64decode(bundle)), mode="r:gz") as tar:
+        tar.extractall(target, filter="data")
+
+
+def _session(timeout: float) -> aiohttp.ClientSession:
+    headers = {"X-Agent-Token": AGENT_TOKEN} if AGENT_TOKEN else {}
+    return aiohttp.ClientSession(headers=headers, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def call_agent(url: str, method: str, path: str, payload: Optional[dict] = None,
+                     timeout: float = AGENT_TIMEOUT) -> dict:
+    try:
+        async with _session(timeout) as session:
+            async with session.request(method, url.rstrip("/") + path, json=payload) as response:
+                data = await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        raise AgentError(f"Агент {url} недоступен: {e!r}")
+    if response.status >= 400:
+        detail = data.get("detail") if isinstance(data, dict) else data
+        raise AgentError(f"Агент {url}: {detail or response.status}")
+    return data
+
+
+async def node_health(url: str) -> dict:
+    return await call_agent(url, "GET", "/health", timeout=10)
+
+
+def _quota_payload(quota: TenantQuota) -> dict:
+    return {"cpus": quota.cpus, "memory_mb": quota.memory_mb, "updates_per_sec": quota.updates_per_sec}
+
+
+async def start_on_node(node: dict, bot_id: str, bot_path: Path, quota: TenantQuota) -> dict:
+    """Отправляет исходники бота агенту, тот собирает образ и ждёт готовности; возвращает тайминги старта."""
+    bundle = await asyncio.to_thread(pack_dir, bot_path)
+    return await call_agent(node["url"], "POST", f"/tenants/{bot_id}/start",
+                            {"bundle": bundle, **_quota_payload(quota)})
+
+
+async def stop_on_node(node: dict, bot_id: str, remove: bool = False):
+    await call_agent(node["url"], "POST", f"/tenants/{bot_id}/stop", {"remove": remove})
+
+
+async def remove_from_node(node: dict, bot_id: str):
+    """Удаляет с узла контейнер, образ и исходники бота."""
+    await call_agent(node["url"], "DELETE", f"/tenants/{bot_id}")
+
+
+async def upgrade_on_node(node: dict, tenant: dict, staged: Path, version: str) -> dict:
+    """Обновление на узле тем же сценарием, что и локально (upgrade.apply_upgrade): {"status", "error"}."""
+    bundle = await asyncio.to_thread(pack_dir, staged)
+    quota = TenantQuota(tenant["cpus"], tenant["memory_mb"], tenant["updates_per_sec"])
+    return await call_agent(node["url"], "POST", f"/tenants/{tenant['bot_id']}/upgrade",
+                            {"bundle": bundle, "version": version, **_quota_payload(quota)})
+
+
+async def metrics_on_node(node: dict, bot_id: str) -> Optional[dict]:
+    return (await call_agent(node["url"], "GET", f"/tenants/{bot_id}/metrics", timeout=10)).get("metrics")
+
+
+async def export_from_node(node: dict, bot_id: str, table: str, fmt: str) -> AsyncIterator[bytes]:
+    """Открывает выгрузку на узле; ошибка агента поднимается AgentError до первого байта, пока можно ответить кодом."""
+    session = _session(AGENT_TIMEOUT)
+    url = f"{node['url'].rstrip('/')}/tenants/{bot_id}/export/{table}"
+    try:
+        response = await session.get(url, params={"fmt": fmt})
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        await session.close()
+        raise AgentError(f"Агент {node['url']} недоступен: {e!r}")
+    if response.status >= 400:
+        try:
+            data = await response.json(content_type=None)
+        except ValueError:
+            data = None
+        response.release()
+        await session.close()
+        detail = data.get("detail") if isinstance(data, dict) else data
+        raise AgentError(f"Агент {node['url']}: {detail or response.status}")
+
+    async def chunks() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in response.content.iter_chunked(EXPORT_CHUNK_SIZE):
+                yield chunk
+        finally:
+            response.release()
+            await session.close()
+
+    return chunks()
@@ -1,3 +1,6 @@
+import asyncio
+
 from app.shared.subscription_db import init_db
-init_db()
-print("БД инициализирована!")
+
+before, after = asyncio.run(init_db())
+print(f"БД инициализирована! Версия схемы: {before} -> {after}")
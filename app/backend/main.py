@@ -1,18 +1,194 @@
 import os
-from fastapi import FastAPI, HTTPException
+from collections import Counter
+from typing import Dict, Literal, Optional
+from datetime import datetime, timedelta
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
+from app.backend.cluster import AgentError, export_from_node, metrics_on_node
 from app.backend.models import BotRequest
-from app.backend.utils import create_bot_instance
-from app.shared.subscription_db import get_expired_bots
+from app.backend.provisioning import jobs as provisioning_jobs, start_job
+from app.backend.quotas import admission, container_stats
+from app.backend.subscription_checker import SubscriptionScheduler
+from app.backend.utils import ExportError, read_bot_metrics, stream_export
+from app.shared.bot_api import (
+    InvalidTokenError, TelegramUnavailableError, close_shared_session, token_hash, validate_token
+)
+from app.shared.subscription_db import get_expired_bots, init_db
+from app.shared.tenant_registry import find_tenant_by_token, get_placement, get_tenant, list_nodes, list_tenants
+from app.shared.tenant_store import query_tenants, shared_storage
 
 load_dotenv()
 
+# Проверка подписок фоновой задачей; при нескольких воркерах действует один — держатель аренды
+SUBSCRIPTION_SCHEDULER = os.getenv("SUBSCRIPTION_SCHEDULER", "1") == "1"
+
 app = FastAPI()
+subscription_scheduler = SubscriptionScheduler()
+
+
+@app.on_event("startup")
+async def on_startup():
+    # Схема проверяется один раз при старте, а не в каждом запросе
+    await init_db()
+    if SUBSCRIPTION_SCHEDULER:
+        await subscription_scheduler.start()
+
 
-@app.post("/create_bot/")
+@app.on_event("shutdown")
+async def on_shutdown():
+    await subscription_scheduler.stop()
+    await close_shared_session()
+
+
+@app.post("/create_bot/", status_code=202)
 async def create_bot(bot_data: BotRequest):
+    # Быстрые проверки — сразу ответом, долгая сборка — фоновой задачей с потоком событий
+    try:
+        me = await validate_token(bot_data.bot_token)
+    except InvalidTokenError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TelegramUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if await find_tenant_by_token(token_hash(bot_data.bot_token)):
+        raise HTTPException(status_code=409, detail="Бот с этим токеном уже запущен")
+    job = start_job(bot_data)
+    return {"status": "accepted", "job_id": job.job_id, "username": me.username,
+            "events": f"/create_bot/{job.job_id}/events"}
+
+
+@app.get("/create_bot/{job_id}/events")
+async def create_bot_events(job_id: str, last_event_id: Optional[int] = Header(None)):
+    job = provisioning_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return StreamingResponse(
+        job.stream(-1 if last_event_id is None else last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _tenant_usage(tenant: dict, stats: dict) -> dict:
+    return {
+        "bot_id": tenant["bot_id"],
+        "plan": tenant["plan"],
+        "status": tenant["status"],
+        "limits": {
+            "cpus": tenant["cpus"],
+            "memory_mb": tenant["memory_mb"],
+            "updates_per_sec": tenant["updates_per_sec"],
+        },
+        "usage": stats.get(tenant["bot_id"]),
+    }
+
+
+@app.get("/tenants/usage")
+async def tenants_usage():
+    tenants = await list_tenants(status="active")
+    stats = await container_stats()
+    return {
+        "host": await admission.usage(),
+        "tenants": [_tenant_usage(t, stats) for t in tenants],
+    }
+
+
+@app.get("/cluster/nodes")
+async def cluster_nodes():
+    return {"nodes": await list_nodes()}
+
+
+# По строке на тенанта: в общей базе (pooled) это один проход по всем, в отдельных базах — по одной строке с каждой
+TENANT_REPORT_SQL = """
+    SELECT u.tenant_id, u.users, u.registered,
+           COALESCE(b.upcoming_bookings, 0) AS upcoming_bookings, COALESCE(b.paid_bookings, 0) AS paid_bookings
+    FROM (
+        SELECT tenant_id, COUNT(*) AS users, COALESCE(SUM(registered = 1), 0) AS registered
+        FROM users GROUP BY tenant_id
+    ) u
+    LEFT JOIN (
+        SELECT tenant_id, SUM(status != 'cancelled' AND slot_at >= ?) AS upcoming_bookings,
+               SUM(status = 'paid') AS paid_bookings
+        FROM bookings GROUP BY tenant_id
+    ) b ON b.tenant_id = u.tenant_id
+"""
+
+
+@app.get("/tenants/report")
+async def tenants_report():
+    if not shared_storage():
+        raise HTTPException(status_code=409,
+                            detail="Отчёт доступен только при TENANT_STORAGE=shared или pooled")
+    rows = await query_tenants(TENANT_REPORT_SQL, (datetime.now().strftime("%Y-%m-%d"),))
+    totals = {key: sum(row[key] for row in rows) for key in ("users", "registered", "upcoming_bookings", "paid_bookings")}
+    return {"tenants": rows, "totals": totals}
+
+
+# Только дневные счётчики, которые бот ведёт сам (daily_stats): стоимость — дни × метрики, а не строки
+TENANT_STATS_SQL = "SELECT tenant_id, day, metric, count FROM daily_stats WHERE day >= ?"
+
+
+@app.get("/tenants/stats")
+async def tenants_stats(days: int = Query(30, ge=1, le=366)):
+    if not shared_storage():
+        raise HTTPException(status_code=409,
+                            detail="Статистика доступна только при TENANT_STORAGE=shared или pooled")
+    since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    rows = await query_tenants(TENANT_STATS_SQL, (since,))
+    tenants: Dict[str, Counter] = {}
+    daily: Dict[str, Counter] = {}
+    for row in rows:
+        tenants.setdefault(row["tenant_id"], Counter())[row["metric"]] += row["count"]
+        daily.setdefault(row["day"], Counter())[row["metric"]] += row["count"]
+    return {
+        "since": since,
+        "tenants": [{"tenant_id": bot_id, **counts} for bot_id, counts in sorted(tenants.items())],
+        "daily": [{"day": day, **counts} for day, counts in sorted(daily.items())],
+        "totals": dict(sum(tenants.values(), Counter())),
+    }
+
+
+@app.get("/tenants/{bot_id}/usage")
+async def tenant_usage(bot_id: str):
+    tenant = await get_tenant(bot_id)
+    if not tenant:
+        raise HTTPException(status_code=404, detail="Бот не найден")
+    stats = await container_stats(bot_id)
+    return _tenant_usage(tenant, stats)
+
+
+@app.get("/tenants/{bot_id}/metrics")
+async def tenant_metrics(bot_id: str):
+    tenant = await get_tenant(bot_id)
+    if not tenant or tenant["status"] != "active":
+        raise HTTPException(status_code=404, detail="Бот не найден")
+    placement = await get_placement(bot_id)
+    try:
+        metrics = await metrics_on_node(placement, bot_id) if placement else await read_bot_metrics(bot_id)
+    except AgentError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if metrics is None:
+        raise HTTPException(status_code=503, detail="Бот ещё не отчитался о метриках")
+    return {"bot_id": bot_id, **metrics}
+
+
+@app.get("/tenants/{bot_id}/export/{table}")
+async def tenant_export(bot_id: str, table: Literal["users", "slots", "bookings"],
+                        fmt: Literal["csv", "jsonl"] = "csv"):
+    tenant = await get_tenant(bot_id)
+    if not tenant or tenant["status"] != "active":
+        raise HTTPException(status_code=404, detail="Бот не найден")
+    placement = await get_placement(bot_id)
     try:
-        bot_id = await create_bot_instance(bot_data)
-        return {"status": "ok", "bot_id": bot_id}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        if placement:
+            chunks = await export_from_node(placement, bot_id, table, fmt)
+        else:
+            chunks = await stream_export(bot_id, table, fmt)
+    except (AgentError, ExportError) as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    filename = f"{bot_id}_{table}_{datetime.now():%Y%m%d_%H%M}.{fmt}.gz"
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
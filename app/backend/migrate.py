@@ -0,0 +1,47 @@
+"""Применение миграций из backend.
+
+    python -m app.backend.migrate subscriptions   # общая БД backend
+    python -m app.backend.migrate tenants         # все базы ботов (TENANT_STORAGE=shared или pooled)
+
+В режиме TENANT_STORAGE=container базы недоступны с хоста — бот применяет
+миграции сам при старте, новые миграции приезжают вместе с обновлением образа.
+В режиме pooled база одна на всех, и миграция — одна операция над ней.
+"""
+import sys
+import asyncio
+from typing import List
+
+from app.shared.migrations import migrate_many
+from app.shared.subscription_db import init_db
+from app.shared.tenant_store import list_tenant_dbs, pooled_storage, shared_storage
+from app.template_bot.schema import MIGRATIONS as TENANT_MIGRATIONS, POOL_MIGRATIONS
+
+MIGRATE_CONCURRENCY = 16
+
+
+async def migrate_tenants() -> dict:
+    paths = list_tenant_dbs()
+    migrations = POOL_MIGRATIONS if pooled_storage() else TENANT_MIGRATIONS
+    results = await migrate_many(paths, migrations, concurrency=MIGRATE_CONCURRENCY)
+    failed = {bot_id: result for bot_id, result in results.items() if isinstance(result, str)}
+    upgraded = sum(1 for result in results.values() if isinstance(result, tuple) and result[0] != result[1])
+    for bot_id, error in failed.items():
+        print(f"⚠️ Миграция базы {bot_id} не удалась: {error}")
+    print(f"🗄 Баз ботов: {len(paths)}, обновлено: {upgraded}, ошибок: {len(failed)}")
+    return {"total": len(paths), "upgraded": upgraded, "failed": failed}
+
+
+async def _cli(args: List[str]):
+    if args == ["subscriptions"]:
+        before, after = await init_db()
+        print(f"🗄 subscriptions.db: версия {before} -> {after}")
+    elif args == ["tenants"]:
+        if not shared_storage():
+            sys.exit("Базы ботов лежат в контейнерах (TENANT_STORAGE=container), они мигрируют при старте бота")
+        await migrate_tenants()
+    else:
+        sys.exit(__doc__)
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli(sys.argv[1:]))
@@ -1,5 +1,8 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
 class BotRequest(BaseModel):
     bot_token: str
     admin_id: int
+    plan: Literal["trial", "1_month", "3_months", "12_months"] = "trial"
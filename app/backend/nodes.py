@@ -0,0 +1,157 @@
+"""Управление рабочими узлами и перебалансировка ботов.
+
+    python -m app.backend.nodes add <node_id> <url> [--weight W] [--cpus N --memory-mb M] [--no-rebalance]
+    python -m app.backend.nodes list
+    python -m app.backend.nodes drain <node_id>
+    python -m app.backend.nodes rebalance [--dry-run]
+
+Ёмкость нового узла берётся из /health его агента, вес по умолчанию — память
+в ГБ. После добавления (или вывода узла командой drain) размещение всех
+активных ботов пересчитывается по кольцу (cluster.py), и переезжают только те,
+чей узел изменился; боты, запущенные на хосте backend до появления узлов,
+тоже переезжают на узлы. Переезд: бот останавливается (offset и база
+сохраняются), убирается со старого узла и собирается на новом; если старый
+узел не убрал бота или новый не поднял его, бот возвращается на старое место.
+Пока образ собирается, бот не отвечает, апдейты ждут в Telegram. Базу
+переносить не нужно только при TENANT_STORAGE=shared с общим для узлов
+каталогом, поэтому без него rebalance лишь показывает план.
+"""
+import asyncio
+import argparse
+from pathlib import Path
+from typing import List, Optional
+
+from app.backend.cluster import (
+    AgentError, HashRing, choose_node, node_health, node_weight, remove_from_node, start_on_node, stop_on_node
+)
+from app.backend.quotas import TenantQuota
+from app.backend.utils import BOTS_DIR, run_docker, start_local, stop_local
+from app.shared.subscription_db import init_db
+from app.shared.tenant_registry import (
+    list_nodes, list_placements, list_tenants, register_node, set_node_status, set_placement
+)
+from app.shared.tenant_store import pooled_storage, shared_storage
+
+
+async def plan_moves() -> List[dict]:
+    """Куда должен переехать каждый бот, чей узел по кольцу сменился."""
+    nodes = {n["node_id"]: n for n in await list_nodes()}
+    active = {node_id: n for node_id, n in nodes.items() if n["status"] == "active"}
+    if not active:
+        return []
+    ring = HashRing({node_id: n["weight"] for node_id, n in active.items()})
+    free = {node_id: [n["cpus"], n["memory_mb"]] for node_id, n in active.items()}
+    placements = await list_placements()
+
+    moves = []
+    # Старые боты раньше: при нехватке места двигать приходится новых
+    for tenant in await list_tenants(status="active"):
+        bot_id = tenant["bot_id"]
+        quota = TenantQuota(tenant["cpus"], tenant["memory_mb"], tenant["updates_per_sec"])
+        current = placements.get(bot_id)
+        target = choose_node(ring, bot_id, quota, free)
+        if target is None:
+            print(f"⚠️ {bot_id}: ни на одном узле нет места, остаётся на {current or 'хосте backend'}")
+        elif target != current:
+            moves.append({"tenant": tenant, "source": nodes.get(current), "target": active[target]})
+    return moves
+
+
+async def move_tenant(tenant: dict, source: Optional[dict], target: dict):
+    bot_id = tenant["bot_id"]
+    bot_path = Path(BOTS_DIR) / bot_id
+    quota = TenantQuota(tenant["cpus"], tenant["memory_mb"], tenant["updates_per_sec"])
+
+    try:
+        # Сначала останавливаем: два экземпляра с одним токеном не должны опрашивать Telegram одновременно.
+        # Остановка и уборка внутри try: если сорвётся уборка после остановки, бот не останется нигде
+        if source:
+            await stop_on_node(source, bot_id)
+            await remove_from_node(source, bot_id)
+        else:
+            await stop_local(bot_id, remove=True)
+            await run_docker("rmi", f"bot_{bot_id}")
+        await start_on_node(target, bot_id, bot_path, quota)
+    except AgentError:
+        if source:
+            await start_on_node(source, bot_id, bot_path, quota)
+        else:
+            await start_local(bot_id, bot_path, quota)
+        raise
+    await set_placement(bot_id, target["node_id"])
+
+
+async def rebalance(dry_run: bool = False) -> dict:
+    moves = await plan_moves()
+    for move in moves:
+        source = move["source"]["node_id"] if move["source"] else "хост backend"
+        print(f"  {move['tenant']['bot_id']}: {source} → {move['target']['node_id']}")
+    print(f"🔀 К переезду: {len(moves)}")
+    if dry_run or not moves:
+        return {"planned": len(moves), "moved": 0, "failed": []}
+    if not shared_storage() or pooled_storage():
+        print("⛔ Переезд с базой возможен только при TENANT_STORAGE=shared, боты оставлены на местах")
+        return {"planned": len(moves), "moved": 0, "failed": []}
+
+    moved, failed = 0, []
+    # По одному: каждый переезд — простой бота, пусть он будет у одного бота за раз
+    for move in moves:
+        bot_id = move["tenant"]["bot_id"]
+        try:
+            await move_tenant(move["tenant"], move["source"], move["target"])
+            moved += 1
+        except Exception as e:
+            print(f"❌ {bot_id}: переезд не удался: {e}")
+            failed.append(bot_id)
+    print(f"🔀 Перенесено {moved} из {len(moves)}, ошибок: {len(failed)}")
+    return {"planned": len(moves), "moved": moved, "failed": failed}
+
+
+async def add_node(node_id: str, url: str, weight: Optional[float] = None, cpus: Optional[float] = None,
+                   memory_mb: Optional[int] = None):
+    capacity = (await node_health(url))["capacity"]
+    cpus = cpus or capacity["cpus"]
+    memory_mb = memory_mb or capacity["memory_mb"]
+    weight = weight or node_weight(memory_mb)
+    await register_node(node_id, url, cpus, memory_mb, weight)
+    print(f"➕ Узел {node_id}: {cpus} CPU, {memory_mb} МБ, вес {weight}")
+
+
+async def print_nodes():
+    placements = await list_placements()
+    tenants = await list_tenants(status="active")
+    print(f"Ботов на хосте backend: {sum(1 for t in tenants if t['bot_id'] not in placements)}")
+    for n in await list_nodes():
+        print(f"{n['node_id']:<12} {n['status']:<9} вес {n['weight']:<6} ботов {n['tenants']:<4} "
+              f"CPU {n['committed_cpus']:.2f}/{n['cpus']}  память {n['committed_memory_mb']}/{n['memory_mb']} МБ"
+              f"  {n['url']}")
+
+
+async def _cli():
+    parser = argparse.ArgumentParser(description="Рабочие узлы и размещение ботов")
+    parser.add_argument("command", choices=["add", "list", "drain", "rebalance"])
+    parser.add_argument("node_id", nargs="?")
+    parser.add_argument("url", nargs="?")
+    parser.add_argument("--weight", type=float)
+    parser.add_argument("--cpus", type=float)
+    parser.add_argument("--memory-mb", type=int)
+    parser.add_argument("--no-rebalance", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    if args.command in ("add", "drain") and not args.node_id or args.command == "add" and not args.url:
+        parser.error("укажите node_id (и url для add)")
+
+    await init_db()
+    if args.command == "list":
+        await print_nodes()
+        return
+    if args.command == "add":
+        await add_node(args.node_id, args.url, args.weight, args.cpus, args.memory_mb)
+    elif args.command == "drain":
+        await set_node_status(args.node_id, "draining")
+    if args.command == "rebalance" or not args.no_rebalance:
+        await rebalance(args.dry_run)
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli())
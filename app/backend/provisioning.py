@@ -0,0 +1,71 @@
+"""Фоновое создание ботов с потоком прогресса для веб-приложения.
+
+POST /create_bot/ только проверяет токен и ставит задачу, а этапы
+(validated → image_ready → container_started → online → done; бот на рабочем
+узле вместо image_ready и container_started сообщает placed) клиент читает
+из GET /create_bot/{job_id}/events как Server-Sent Events. Запрос не висит
+всю сборку образа, а переподключение продолжает поток с Last-Event-ID.
+"""
+import json
+import asyncio
+from uuid import uuid4
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.backend.models import BotRequest
+from app.backend.utils import create_bot_instance
+
+JOB_TTL = 600
+HEARTBEAT_INTERVAL = 15
+
+
+class ProvisioningJob:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.events: List[dict] = []
+        self.finished = False
+        self.task: Optional[asyncio.Task] = None
+        # Заменяется на новый при каждом событии: ждущие потоки держат ссылку на старый
+        self._changed = asyncio.Event()
+
+    def emit(self, stage: str, **data):
+        self.events.append({"stage": stage, **data})
+        if stage in ("done", "failed"):
+            self.finished = True
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def stream(self, last_event_id: int = -1) -> AsyncIterator[str]:
+        sent = last_event_id + 1
+        while True:
+            changed = self._changed
+            while sent < len(self.events):
+                yield f"id: {sent}\nevent: progress\ndata: {json.dumps(self.events[sent], ensure_ascii=False)}\n\n"
+                sent += 1
+            if self.finished:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                # Комментарий SSE: не даёт прокси закрыть молчащее соединение
+                yield ": ping\n\n"
+
+
+jobs: Dict[str, ProvisioningJob] = {}
+
+
+def start_job(bot_data: BotRequest) -> ProvisioningJob:
+    job = ProvisioningJob(uuid4().hex)
+    jobs[job.job_id] = job
+    job.task = asyncio.create_task(_run(job, bot_data))
+    return job
+
+
+async def _run(job: ProvisioningJob, bot_data: BotRequest):
+    try:
+        result = await create_bot_instance(bot_data, progress=job.emit)
+        job.emit("done", **result)
+    except Exception as e:
+        print(f"❌ Создание бота (задача {job.job_id}) не удалось: {e}")
+        job.emit("failed", detail=str(e))
+    # Завершённую задачу держим, пока клиент может переподключиться
+    asyncio.get_running_loop().call_later(JOB_TTL, jobs.pop, job.job_id, None)
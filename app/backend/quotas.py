@@ -0,0 +1,146 @@
+import os
+import json
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.shared.tenant_registry import get_cluster_capacity, get_committed_resources
+from app.shared.tenant_store import pooled_storage
+
+
+@dataclass(frozen=True)
+class TenantQuota:
+    cpus: float
+    memory_mb: int
+    updates_per_sec: float
+
+
+# Лимиты по тарифам. Ключи совпадают со ссылками на оплату в subscription_checker
+PLANS: Dict[str, TenantQuota] = {
+    "trial": TenantQuota(cpus=0.25, memory_mb=128, updates_per_sec=5),
+    "1_month": TenantQuota(cpus=0.5, memory_mb=192, updates_per_sec=15),
+    "3_months": TenantQuota(cpus=0.5, memory_mb=256, updates_per_sec=20),
+    "12_months": TenantQuota(cpus=1.0, memory_mb=384, updates_per_sec=30),
+}
+
+# Сколько секунд запрос ждёт в очереди, если хост заполнен (0 — сразу отказ)
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "0"))
+ADMISSION_POLL_INTERVAL = float(os.getenv("ADMISSION_POLL_INTERVAL", "5"))
+
+
+class CapacityError(Exception):
+    pass
+
+
+def get_plan_quota(plan: str) -> TenantQuota:
+    if plan not in PLANS:
+        raise ValueError(f"Неизвестный тариф: {plan}")
+    return PLANS[plan]
+
+
+def _host_memory_mb() -> int:
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+
+
+def host_capacity() -> TenantQuota:
+    """Ёмкость хоста под ботов за вычетом резерва под backend и систему."""
+    cpus = float(os.getenv("HOST_CPUS", os.cpu_count() or 1))
+    memory_mb = int(os.getenv("HOST_MEMORY_MB", _host_memory_mb()))
+    reserved_memory_mb = int(os.getenv("HOST_RESERVED_MEMORY_MB", "512"))
+    overcommit = float(os.getenv("CPU_OVERCOMMIT", "1.0"))
+    return TenantQuota(
+        cpus=cpus * overcommit,
+        memory_mb=max(memory_mb - reserved_memory_mb, 0),
+        updates_per_sec=0,
+    )
+
+
+class AdmissionController:
+    """Проверяет, что новый тенант помещается на хост (или рабочие узлы), до сборки образа.
+
+    Учитывает уже запущенных тенантов из реестра и тех, что сейчас собираются.
+    """
+
+    def __init__(self, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 poll_interval: float = ADMISSION_POLL_INTERVAL):
+        self.queue_timeout = queue_timeout
+        self.poll_interval = poll_interval
+        self._pending: Dict[str, TenantQuota] = {}
+        self._lock = asyncio.Lock()
+
+    async def usage(self) -> dict:
+        # С рабочими узлами ёмкость — их сумма, и против неё считаются только размещённые на узлах боты:
+        # оставшиеся на хосте backend до перебалансировки узлы не занимают. На какой узел встанет бот, решает cluster.place
+        # При общей базе (pooled) боты всегда на хосте backend, узлы не в счёт
+        nodes = None if pooled_storage() else await get_cluster_capacity()
+        capacity = TenantQuota(nodes[0], nodes[1], 0) if nodes else host_capacity()
+        cpus, memory_mb = await get_committed_resources(placed_only=bool(nodes))
+        cpus += sum(q.cpus for q in self._pending.values())
+        memory_mb += sum(q.memory_mb for q in self._pending.values())
+        return {
+            "capacity": {"cpus": capacity.cpus, "memory_mb": capacity.memory_mb},
+            "committed": {"cpus": round(cpus, 3), "memory_mb": memory_mb},
+            "pending": len(self._pending),
+        }
+
+    async def _try_reserve(self, bot_id: str, quota: TenantQuota) -> bool:
+        async with self._lock:
+            usage = await self.usage()
+            capacity, committed = usage["capacity"], usage["committed"]
+            if (committed["cpus"] + quota.cpus > capacity["cpus"]
+                    or committed["memory_mb"] + quota.memory_mb > capacity["memory_mb"]):
+                return False
+            self._pending[bot_id] = quota
+            return True
+
+    async def admit(self, bot_id: str, quota: TenantQuota):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        while not await self._try_reserve(bot_id, quota):
+            if loop.time() >= deadline:
+                raise CapacityError("Сервер заполнен, попробуйте создать бота позже")
+            await asyncio.sleep(min(self.poll_interval, max(deadline - loop.time(), 0)))
+
+    def release(self, bot_id: str):
+        self._pending.pop(bot_id, None)
+
+
+admission = AdmissionController()
+
+
+def _parse_size_mb(value: str) -> float:
+    units = {"B": 1 / (1024 * 1024), "KiB": 1 / 1024, "kB": 1 / 1024, "MiB": 1, "MB": 1,
+             "GiB": 1024, "GB": 1024}
+    value = value.strip()
+    for unit in sorted(units, key=len, reverse=True):
+        if value.endswith(unit):
+            return float(value[:-len(unit)]) * units[unit]
+    return 0.0
+
+
+async def container_stats(bot_id: Optional[str] = None) -> Dict[str, dict]:
+    """Текущее потребление контейнеров ботов по данным `docker stats`."""
+    args = ["docker", "stats", "--no-stream", "--format", "{{json .}}"]
+    if bot_id:
+        args.append(f"bot_{bot_id}")
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    stdout, _ = await proc.communicate()
+
+    stats = {}
+    for line in stdout.decode().splitlines():
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue
+        name = row.get("Name", "")
+        if not name.startswith("bot_"):
+            continue
+        used, _, limit = row.get("MemUsage", "").partition("/")
+        stats[name[len("bot_"):]] = {
+            "cpu_percent": float(row.get("CPUPerc", "0%").rstrip("%") or 0),
+            "memory_mb": round(_parse_size_mb(used), 1),
+            "memory_limit_mb": round(_parse_size_mb(limit), 1),
+        }
+    return stats
@@ -1,13 +1,46 @@
-import aiosqlite
+"""Проверка подписок: за сутки до конца пробного срока — предупреждение, после — остановка бота.
+
+Работает постоянно: фоновой задачей внутри backend (SUBSCRIPTION_SCHEDULER=1,
+см. main.py) или отдельным демоном; проход — раз в SUBSCRIPTION_CHECK_INTERVAL
+секунд на одном и том же соединении с базой.
+
+    python -m app.backend.subscription_checker [--once]
+
+Действует только держатель аренды subscription_checker (таблица leases): её
+берут перед проходом и продлевают перед каждой остановкой бота, поэтому
+воркеры backend, демон и ручной --once не остановят один бот дважды. Бот не
+останавливается, пока админу не ушло предупреждение хотя бы WARNING_HOURS
+назад. Уведомления прохода копятся и рассылаются в конце пачкой —
+параллельно, через общую сессию Bot API.
+"""
+import os
+import time
+import socket
 import asyncio
+import argparse
 from datetime import datetime, timedelta
-import subprocess
+from pathlib import Path
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+import aiosqlite
 from aiogram import Bot, types
 from dotenv import dotenv_values
-from pathlib import Path
 
-DB_PATH = "/root/telegram-bot-builder/app/shared/subscriptions.db"
-BOTS_DIR = "/root/telegram-bot-builder/app/bots_storage"
+from app.backend.backup import backup_tenant
+from app.backend.cluster import stop_on_node
+from app.backend.utils import BOTS_DIR, stop_local
+from app.shared.bot_api import close_shared_session, shared_session
+from app.shared.subscription_db import SUBSCRIPTIONS_DB, init_db
+from app.shared.tenant_registry import get_placement, set_tenant_status
+
+TRIAL_DAYS = 3
+WARNING_HOURS = 24
+SUBSCRIPTION_CHECK_INTERVAL = float(os.getenv("SUBSCRIPTION_CHECK_INTERVAL", "300"))
+# Аренда переживает пропущенный проход, но после падения владельца освобождается сама
+SUBSCRIPTION_LEASE_TTL = float(os.getenv("SUBSCRIPTION_LEASE_TTL", "900"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+LEASE_NAME = "subscription_checker"
 
 # Заглушки вместо реальных ссылок ЮKassa
 LINKS = {
@@ -16,69 +49,200 @@ LINKS = {
     "12_months": "https://example.com/pay/12months"
 }
 
-async def get_token_for_bot(bot_id: str) -> str:
-    env_path = Path(f"{BOTS_DIR}/{bot_id}/.env")
-    config = dotenv_values(env_path)
-    return config.get("BOT_TOKEN", "")
-
-async def get_admin_id_for_bot(bot_id: str) -> int:
-    env_path = Path(f"{BOTS_DIR}/{bot_id}/.env")
-    config = dotenv_values(env_path)
-    return int(config.get("ADMIN_IDS", "0"))
-
-async def check_subscriptions():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                bot_id TEXT PRIMARY KEY,
-                created_at TEXT,
-                active INTEGER,
-                paid INTEGER
-            )
-        """)
-        cursor = await db.execute("SELECT bot_id, created_at, paid, active FROM subscriptions")
-        bots = await cursor.fetchall()
-
-        for bot_id, created_at, paid, active in bots:
-            if not paid and active:
-                created_time = datetime.fromisoformat(created_at)
-                if datetime.now() - created_time >= timedelta(days=3):
-                    print(f"⛔ Отключаю бот {bot_id} — срок подписки истёк")
-
-                    # Останавливаем и удаляем контейнер
-                    subprocess.run(["docker", "stop", f"bot_{bot_id}"])
-                    subprocess.run(["docker", "rm", f"bot_{bot_id}"])
-
-                    # Обновляем БД
-                    await db.execute("UPDATE subscriptions SET active = 0 WHERE bot_id = ?", (bot_id,))
-                    await db.commit()
-
-                    # Уведомляем администратора
+WARNING_TEXT = (
+    "⏳ *Пробный период бота заканчивается.*\n\n"
+    "Меньше чем через сутки бот будет *остановлен*, если не оплатить подписку.\n\n"
+    "Продлить можно, выбрав один из вариантов ниже:"
+)
+STOPPED_TEXT = (
+    "⛔ *Подписка бота истекла.*\n\n"
+    "Ваш бот был *остановлен*, потому что вы не оплатили подписку.\n\n"
+    "Вы можете продлить его, выбрав один из вариантов ниже:"
+)
+
+
+def _bot_env(bot_id: str) -> Tuple[str, List[int]]:
+    config = dotenv_values(Path(BOTS_DIR) / bot_id / ".env")
+    admin_ids = [int(x) for x in (config.get("ADMIN_IDS") or "").split(",") if x.strip().isdigit()]
+    return config.get("BOT_TOKEN", ""), admin_ids
+
+
+def _renew_keyboard() -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="Продлить на 1 месяц", url=LINKS["1_month"])],
+        [types.InlineKeyboardButton(text="На 3 месяца", url=LINKS["3_months"])],
+        [types.InlineKeyboardButton(text="На 12 месяцев", url=LINKS["12_months"])]
+    ])
+
+
+class SubscriptionScheduler:
+    def __init__(self, interval: float = SUBSCRIPTION_CHECK_INTERVAL, lease_ttl: float = SUBSCRIPTION_LEASE_TTL):
+        self.interval = interval
+        self.lease_ttl = lease_ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+        self.conn: Optional[aiosqlite.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def open(self):
+        self.conn = await aiosqlite.connect(SUBSCRIPTIONS_DB)
+
+    async def start(self):
+        await self.open()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.conn:
+            # Отдаём аренду сразу, а не через lease_ttl: другой экземпляр подхватит проверку без паузы
+            await self.conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (LEASE_NAME, self.holder))
+            await self.conn.commit()
+            await self.conn.close()
+            self.conn = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"❌ Проверка подписок не удалась: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def hold_lease(self) -> bool:
+        """Берёт или продлевает аренду; False — сейчас действует другой экземпляр."""
+        now = time.time()
+        await self.conn.execute("""
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        """, (LEASE_NAME, self.holder, now + self.lease_ttl, now))
+        await self.conn.commit()
+        cursor = await self.conn.execute("SELECT holder FROM leases WHERE name = ?", (LEASE_NAME,))
+        return (await cursor.fetchone())[0] == self.holder
+
+    async def sweep(self) -> dict:
+        if not await self.hold_lease():
+            return {"leader": False}
+
+        now = datetime.now()
+        expired_before = (now - timedelta(days=TRIAL_DAYS)).isoformat()
+        warned_before = (now - timedelta(hours=WARNING_HOURS)).isoformat()
+        # Активные неоплаченные, у которых срок кончается в ближайшие сутки или уже кончился, —
+        # по частичному индексу idx_subscriptions_unpaid
+        cursor = await self.conn.execute(
+            "SELECT bot_id, created_at, warned_at FROM subscriptions WHERE active = 1 AND paid = 0 AND created_at <= ?",
+            ((now - timedelta(days=TRIAL_DAYS) + timedelta(hours=WARNING_HOURS)).isoformat(),)
+        )
+        rows = await cursor.fetchall()
+        to_warn = [bot_id for bot_id, _, warned_at in rows if warned_at is None]
+        to_stop = [
+            bot_id for bot_id, created_at, warned_at in rows
+            if created_at <= expired_before and warned_at is not None and warned_at <= warned_before
+        ]
+
+        stopped = []
+        for bot_id in to_stop:
+            # Бэкапы и остановки долгие: если аренду за это время перехватили, дальше действует другой экземпляр
+            if not await self.hold_lease():
+                break
+            if await self._stop_bot(bot_id):
+                stopped.append(bot_id)
+
+        notified = await self._notify([(bot_id, WARNING_TEXT) for bot_id in to_warn]
+                                      + [(bot_id, STOPPED_TEXT) for bot_id in stopped])
+        if to_warn:
+            await self.conn.executemany("UPDATE subscriptions SET warned_at = ? WHERE bot_id = ?",
+                                        [(now.isoformat(), bot_id) for bot_id in to_warn])
+            await self.conn.commit()
+        if to_warn or to_stop:
+            print(f"🔔 Подписки: предупреждено {len(to_warn)}, остановлено {len(stopped)} из {len(to_stop)}, "
+                  f"уведомлений {notified}")
+        return {"leader": True, "warned": len(to_warn), "stopped": len(stopped), "notified": notified}
+
+    async def _stop_bot(self, bot_id: str) -> bool:
+        print(f"⛔ Отключаю бот {bot_id} — срок подписки истёк")
+
+        # Снимаем базу бота, пока контейнер ещё работает — из бэкапа её можно вернуть при продлении
+        try:
+            await backup_tenant(bot_id)
+            backed_up = True
+        except Exception as e:
+            print(f"⚠️ Не удалось сделать бэкап бота {bot_id}: {e}")
+            backed_up = False
+
+        # Останавливаем контейнер там, где он работает; без бэкапа не удаляем, чтобы не потерять данные
+        placement = await get_placement(bot_id)
+        try:
+            if placement:
+                await stop_on_node(placement, bot_id, remove=backed_up)
+            else:
+                await stop_local(bot_id, remove=backed_up)
+        except Exception as e:
+            print(f"⚠️ Не удалось остановить бот {bot_id}: {e}")
+            return False
+
+        await self.conn.execute("UPDATE subscriptions SET active = 0 WHERE bot_id = ?", (bot_id,))
+        await self.conn.commit()
+        # Освобождаем квоту тенанта на хосте
+        await set_tenant_status(bot_id, "stopped")
+        return True
+
+    async def _notify(self, notices: List[Tuple[str, str]]) -> int:
+        """Рассылает уведомления прохода админам от имени их ботов; возвращает число отправленных."""
+        semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+        keyboard = _renew_keyboard()
+
+        async def one(bot_id: str, text: str) -> int:
+            token, admin_ids = _bot_env(bot_id)
+            if not token:
+                return 0
+            bot = Bot(token=token, session=shared_session())
+            sent = 0
+            async with semaphore:
+                for admin_id in admin_ids:
                     try:
-                        bot_token = await get_token_for_bot(bot_id)
-                        admin_id = await get_admin_id_for_bot(bot_id)
-
-                        if bot_token and admin_id:
-                            bot = Bot(token=bot_token)
-
-                            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                                [types.InlineKeyboardButton(text="Продлить на 1 месяц", url=LINKS["1_month"])],
-                                [types.InlineKeyboardButton(text="На 3 месяца", url=LINKS["3_months"])],
-                                [types.InlineKeyboardButton(text="На 12 месяцев", url=LINKS["12_months"])]
-                            ])
-
-                            await bot.send_message(
-                                chat_id=admin_id,
-                                text=(
-                                    "⛔ *Подписка бота истекла.*\n\n"
-                                    "Ваш бот был *остановлен*, потому что вы не оплатили подписку.\n\n"
-                                    "Вы можете продлить его, выбрав один из вариантов ниже:"
-                                ),
-                                reply_markup=keyboard,
-                                parse_mode="Markdown"
-                            )
+                        await bot.send_message(admin_id, text, reply_markup=keyboard, parse_mode="Markdown")
+                        sent += 1
                     except Exception as e:
                         print(f"Не удалось уведомить администратора бота {bot_id}: {e}")
+            return sent
+
+        return sum(await asyncio.gather(*(one(bot_id, text) for bot_id, text in notices)))
+
+
+async def check_subscriptions() -> dict:
+    """Один проход вне службы — для ручного запуска и бенчмарка."""
+    scheduler = SubscriptionScheduler()
+    await scheduler.open()
+    try:
+        return await scheduler.sweep()
+    finally:
+        await scheduler.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Проверка подписок ботов")
+    parser.add_argument("--once", action="store_true", help="один проход вместо постоянной работы")
+    args = parser.parse_args()
+
+    await init_db()
+    try:
+        if args.once:
+            print(await check_subscriptions())
+            return
+        scheduler = SubscriptionScheduler()
+        await scheduler.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await scheduler.stop()
+    finally:
+        await close_shared_session()
+
 
 if __name__ == "__main__":
-    asyncio.run(check_subscriptions())
+    asyncio.run(main())
@@ -0,0 +1,216 @@
+"""Rolling upgrade ботов на текущую версию шаблона.
+
+Боты обновляются пачками параллельно, первая пачка — один бот (канарейка).
+Для каждого бота:
+
+1. новые исходники собираются рядом (bots_storage/<id>.next) с тем же .env,
+   старый образ помечается тегом :rollback, новый образ собирается, пока
+   старый контейнер продолжает работать;
+2. старый контейнер останавливается и переименовывается в bot_<id>_rollback,
+   его база переносится в новый контейнер (в режимах TENANT_STORAGE=shared и pooled
+   база и так лежит на хосте), новый контейнер запускается;
+3. бот должен отчитаться о готовности за UPGRADE_READY_TIMEOUT, иначе новый
+   контейнер удаляется, а старый возвращается на место.
+
+Ход обновления пишется в реестр тенантов (upgrade_status, template_version),
+поэтому прерванный прогон можно просто запустить ещё раз — обновлённые боты
+пропускаются. Боты на рабочих узлах обновляет агент узла тем же сценарием
+(apply_upgrade), исходники ему отправляются архивом.
+
+    python -m app.backend.upgrade run [--batch 5] [--max-failures 1] [--only id1,id2]
+    python -m app.backend.upgrade status
+"""
+import os
+import shutil
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from app.backend.cluster import upgrade_on_node
+from app.backend.quotas import TenantQuota
+from app.backend.utils import (
+    BOTS_DIR, copy_template, docker_container_args, run_docker, template_version, wait_until_ready
+)
+from app.shared.subscription_db import init_db
+from app.shared.tenant_registry import get_placement, list_tenants, set_upgrade_status
+from app.shared.tenant_store import shared_storage
+
+UPGRADE_BATCH_SIZE = int(os.getenv("UPGRADE_BATCH_SIZE", "5"))
+UPGRADE_MAX_FAILURES = int(os.getenv("UPGRADE_MAX_FAILURES", "1"))
+UPGRADE_READY_TIMEOUT = float(os.getenv("UPGRADE_READY_TIMEOUT", "60"))
+# База бота внутри контейнера в режиме TENANT_STORAGE=container (DB_PATH из .env.template)
+CONTAINER_DB_FILES = ("bot_database.db", "bot_database.db-wal")
+
+
+class UpgradeError(RuntimeError):
+    pass
+
+
+async def _docker(*args: str, error: str):
+    code, _ = await run_docker(*args)
+    if code != 0:
+        raise UpgradeError(error)
+
+
+def stage_files(bot_id: str, staged: Path):
+    """Новые исходники рядом со старыми, с тем же .env."""
+    shutil.rmtree(staged, ignore_errors=True)
+    copy_template(staged)
+    shutil.copy(Path(BOTS_DIR) / bot_id / ".env", staged / ".env")
+
+
+async def _build(bot_id: str, staged: Path, version: str):
+    """Готовит новый образ, пока старый контейнер работает."""
+    await _docker("tag", f"bot_{bot_id}", f"bot_{bot_id}:rollback", error="Не найден текущий образ бота")
+    await _docker("build", "-q", "-t", f"bot_{bot_id}", "-t", f"bot_{bot_id}:{version}", str(staged),
+                  error="Не удалось собрать новый образ")
+
+
+async def _switch(tenant: dict, staged: Path):
+    bot_id = tenant["bot_id"]
+    container = f"bot_{bot_id}"
+    quota = TenantQuota(tenant["cpus"], tenant["memory_mb"], tenant["updates_per_sec"])
+
+    await _docker("stop", container, error="Не удалось остановить старый контейнер")
+    with tempfile.TemporaryDirectory() as tmp:
+        if not shared_storage():
+            # База лежит в самом контейнере — забираем её из остановленного
+            for name in CONTAINER_DB_FILES:
+                await run_docker("cp", f"{container}:/app/{name}", str(Path(tmp) / name))
+            if not (Path(tmp) / CONTAINER_DB_FILES[0]).exists():
+                raise UpgradeError("Не удалось забрать базу из старого контейнера")
+
+        await _docker("rename", container, f"{container}_rollback", error="Не удалось отложить старый контейнер")
+        await _docker("create", *docker_container_args(bot_id, staged / ".env", quota),
+                      error="Не удалось создать новый контейнер")
+        for path in Path(tmp).iterdir():
+            await _docker("cp", str(path), f"{container}:/app/{path.name}", error="Не удалось перенести базу")
+        await _docker("start", container, error="Не удалось запустить новый контейнер")
+
+    await wait_until_ready(bot_id, timeout=UPGRADE_READY_TIMEOUT)
+
+
+async def _rollback(bot_id: str):
+    """Возвращает старый контейнер, на каком бы шаге ни сорвалось переключение."""
+    container = f"bot_{bot_id}"
+    code, _ = await run_docker("inspect", f"{container}_rollback")
+    if code == 0:
+        await run_docker("rm", "-f", container)
+        await run_docker("rename", f"{container}_rollback", container)
+    await run_docker("tag", f"bot_{bot_id}:rollback", f"bot_{bot_id}")
+    await _docker("start", container, error="Не удалось запустить старый контейнер")
+    await wait_until_ready(bot_id, timeout=UPGRADE_READY_TIMEOUT)
+
+
+async def apply_upgrade(tenant: dict, staged: Path, version: str) -> Tuple[str, Optional[str]]:
+    """Собирает и переключает бота на этом хосте; возвращает итоговый upgrade_status и ошибку."""
+    bot_id = tenant["bot_id"]
+    try:
+        await _build(bot_id, staged, version)
+    except Exception as e:
+        # Старый контейнер ещё не трогали — просто убираем заготовку
+        shutil.rmtree(staged, ignore_errors=True)
+        print(f"⚠️ {bot_id}: обновление не собрано: {e}")
+        return "failed", str(e)
+
+    try:
+        await _switch(tenant, staged)
+    except Exception as e:
+        print(f"⚠️ {bot_id}: новая версия не поднялась ({e}), откатываю")
+        shutil.rmtree(staged, ignore_errors=True)
+        try:
+            await _rollback(bot_id)
+            return "rolled_back", str(e)
+        except Exception as rollback_error:
+            print(f"❌ {bot_id}: откат не удался: {rollback_error}")
+            return "rollback_failed", f"{e}; откат: {rollback_error}"
+
+    await run_docker("rm", f"bot_{bot_id}_rollback")
+    bot_path = Path(BOTS_DIR) / bot_id
+    shutil.rmtree(bot_path)
+    staged.rename(bot_path)
+    return "upgraded", None
+
+
+async def upgrade_tenant(tenant: dict, version: str) -> bool:
+    bot_id = tenant["bot_id"]
+    bot_path = Path(BOTS_DIR) / bot_id
+    staged = bot_path.with_name(f"{bot_id}.next")
+    await set_upgrade_status(bot_id, "upgrading")
+
+    # Бот на рабочем узле: тот же сценарий выполняет агент, а здесь обновляется копия исходников
+    placement = await get_placement(bot_id)
+    try:
+        stage_files(bot_id, staged)
+        if placement:
+            result = await upgrade_on_node(placement, tenant, staged, version)
+            status, error = result["status"], result["error"]
+        else:
+            status, error = await apply_upgrade(tenant, staged, version)
+    except Exception as e:
+        print(f"⚠️ {bot_id}: обновление не выполнено: {e}")
+        status, error = "failed", str(e)
+
+    if staged.exists():
+        if status == "upgraded":
+            shutil.rmtree(bot_path)
+            staged.rename(bot_path)
+        else:
+            shutil.rmtree(staged, ignore_errors=True)
+    await set_upgrade_status(bot_id, status, template_version=version if status == "upgraded" else None,
+                             error=error)
+    return status == "upgraded"
+
+
+async def rolling_upgrade(batch_size: int = UPGRADE_BATCH_SIZE, max_failures: int = UPGRADE_MAX_FAILURES,
+                          only: Optional[List[str]] = None) -> dict:
+    version = template_version()
+    tenants = [
+        t for t in await list_tenants(status="active")
+        if t["template_version"] != version and (not only or t["bot_id"] in only)
+    ]
+    print(f"🔄 Версия шаблона {version}, к обновлению: {len(tenants)}")
+
+    upgraded, failed = 0, []
+    # Сначала один бот-канарейка, дальше пачками
+    batches = [tenants[:1]] + [tenants[i:i + batch_size] for i in range(1, len(tenants), batch_size)]
+    for batch in filter(None, batches):
+        results = await asyncio.gather(*(upgrade_tenant(t, version) for t in batch))
+        upgraded += sum(results)
+        failed += [t["bot_id"] for t, ok in zip(batch, results) if not ok]
+        print(f"🔄 Обновлено {upgraded} из {len(tenants)}, ошибок: {len(failed)}")
+        if len(failed) >= max_failures:
+            print("⛔ Слишком много ошибок, обновление остановлено")
+            break
+    return {"version": version, "total": len(tenants), "upgraded": upgraded, "failed": failed}
+
+
+async def print_status():
+    version = template_version()
+    tenants = await list_tenants(status="active")
+    current = sum(1 for t in tenants if t["template_version"] == version)
+    print(f"Версия шаблона {version}: на ней {current} из {len(tenants)} ботов")
+    for status, count in Counter(t["upgrade_status"] or "—" for t in tenants).most_common():
+        print(f"  {status}: {count}")
+
+
+async def _cli():
+    parser = argparse.ArgumentParser(description="Rolling upgrade ботов на текущий шаблон")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--batch", type=int, default=UPGRADE_BATCH_SIZE)
+    parser.add_argument("--max-failures", type=int, default=UPGRADE_MAX_FAILURES)
+    parser.add_argument("--only", type=lambda s: [x for x in s.split(",") if x])
+    args = parser.parse_args()
+
+    await init_db()
+    if args.command == "run":
+        await rolling_upgrade(args.batch, args.max_failures, args.only)
+    else:
+        await print_status()
+
+
+if __name__ == "__main__":
+    asyncio.run(_cli())
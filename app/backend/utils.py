@@ -1,23 +1,210 @@
 import os
+import json
+import hashlib
+import asyncio
 import shutil
 from uuid import uuid4
 from pathlib import Path
+from typing import AsyncIterator, Callable, List, Optional
 from dotenv import set_key
+from app.backend.cluster import AgentError, place, remove_from_node, start_on_node
 from app.backend.models import BotRequest
+from app.backend.quotas import admission, get_plan_quota
 
-from aiogram import Bot
+from app.shared.bot_api import token_hash, validate_token
 from app.shared.subscription_db import set_subscription  # ✅ импортируем свою функцию
+from app.shared.tenant_registry import (
+    DuplicateTokenError, find_tenant_by_token, get_placement, register_tenant, set_placement, set_tenant_status
+)
+from app.shared.tenant_store import docker_storage_args
 
 BOTS_DIR = os.getenv("BOTS_DIR", "app/bots_storage")
 TEMPLATE_PATH = os.getenv("TEMPLATE_BOT_DIR", "app/template_bot")
+# Общие модули, которые бот импортирует как свои: кладутся рядом с main.py в контекст сборки
+SHARED_DIR = Path(__file__).resolve().parent.parent / "shared"
+SHARED_TEMPLATE_MODULES = ("migrations.py", "yookassa_api.py", "media_cache.py")
+BOT_READY_TIMEOUT = float(os.getenv("BOT_READY_TIMEOUT", "120"))
+# Сколько docker stop ждёт после SIGTERM: бот дорабатывает апдейты SHUTDOWN_TIMEOUT (10 с) и сохраняет offset
+BOT_STOP_TIMEOUT = int(os.getenv("BOT_STOP_TIMEOUT", "15"))
+BOT_READY_FILE = "/tmp/bot_ready"
+# Метрики бота (очереди апдейтов по чатам и антифлуд), бот обновляет их раз в несколько секунд
+BOT_METRICS_FILE = "/tmp/bot_metrics.json"
+EXPORT_CHUNK_SIZE = 64 * 1024
 
+# progress(stage, **data) — сообщает об этапах создания бота (см. provisioning.py)
+Progress = Callable[..., None]
+
+
+async def create_bot_instance(bot_data: BotRequest, progress: Optional[Progress] = None) -> dict:
+    progress = progress or (lambda stage, **data: None)
+    # Токен проверяем до копирования шаблона и сборки образа
+    me = await validate_token(bot_data.bot_token)
+    digest = token_hash(bot_data.bot_token)
+    if await find_tenant_by_token(digest):
+        raise DuplicateTokenError("Бот с этим токеном уже запущен")
 
-async def create_bot_instance(bot_data: BotRequest) -> str:
     bot_id = str(uuid4())[:8]
     bot_path = Path(f"{BOTS_DIR}/{bot_id}")
+    quota = get_plan_quota(bot_data.plan)
 
-    # Создаем папку для бота
+    progress("validated", bot_id=bot_id, username=me.username)
+
+    # Проверяем, что на хосте (или узлах) хватит ресурсов, до сборки образа
+    await admission.admit(bot_id, quota)
+    try:
+        # Бронируем токен: параллельный запрос с тем же токеном упрётся в уникальный индекс
+        await register_tenant(bot_id, bot_data.plan, quota.cpus, quota.memory_mb, quota.updates_per_sec,
+                              token_hash=digest, username=me.username, status="provisioning",
+                              template_version=template_version())
+        try:
+            await _provision(bot_id, bot_path, bot_data, quota, progress)
+        except Exception:
+            await set_tenant_status(bot_id, "failed")
+            await remove_bot_files(bot_id, bot_path)
+            raise
+        await set_tenant_status(bot_id, "active")
+    finally:
+        admission.release(bot_id)
+
+    return {"bot_id": bot_id, "username": me.username, "link": f"https://t.me/{me.username}"}
+
+
+async def remove_bot_files(bot_id: str, bot_path: Path):
+    """Убирает контейнер, образ и папку бота, который не удалось запустить."""
+    placement = await get_placement(bot_id)
+    if placement:
+        try:
+            await remove_from_node(placement, bot_id)
+        except AgentError as e:
+            print(f"⚠️ Не удалось убрать бота {bot_id} с узла {placement['node_id']}: {e}")
+        await set_placement(bot_id, None)
+    await remove_local(bot_id, bot_path)
+
+
+async def remove_local(bot_id: str, bot_path: Path):
+    await run_docker("rm", "-f", f"bot_{bot_id}")
+    await run_docker("rmi", "-f", f"bot_{bot_id}")
+    shutil.rmtree(bot_path, ignore_errors=True)
+
+
+async def run_docker(*args: str) -> tuple:
+    proc = await asyncio.create_subprocess_exec(
+        "docker", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    stdout, _ = await proc.communicate()
+    return proc.returncode, stdout.decode().strip()
+
+
+class ExportError(RuntimeError):
+    pass
+
+
+async def stream_export(bot_id: str, table: str, fmt: str) -> AsyncIterator[bytes]:
+    """Открывает gzip-выгрузку таблицы бота и отдаёт её кусками, пока она пишется внутри контейнера.
+
+    Остановленный контейнер и экспорт, упавший до первого байта, поднимают
+    ExportError сразу, пока ещё можно ответить кодом; сбой посреди выгрузки
+    прерывает ответ, чтобы клиент не получил обрезанный файл как целый.
+    """
+    container = f"bot_{bot_id}"
+    _, running = await run_docker("inspect", "-f", "{{.State.Running}}", container)
+    if running != "true":
+        raise ExportError(f"Контейнер {container} не запущен")
+
+    proc = await asyncio.create_subprocess_exec(
+        "docker", "exec", container, "python", "export.py", table, fmt,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+
+    async def finish() -> Optional[ExportError]:
+        # stderr дочитываем до конца раньше wait(): иначе процесс может ждать места в канале
+        stderr = (await proc.stderr.read()).decode(errors="replace").strip()
+        if await proc.wait() == 0:
+            return None
+        message = f"Выгрузка {table} бота {bot_id} завершилась с кодом {proc.returncode}: {stderr[-500:]}"
+        print(f"❌ {message}")
+        return ExportError(message)
+
+    first = await proc.stdout.read(EXPORT_CHUNK_SIZE)
+    if not first and (error := await finish()):
+        raise error
+
+    async def chunks() -> AsyncIterator[bytes]:
+        try:
+            chunk = first
+            while chunk:
+                yield chunk
+                chunk = await proc.stdout.read(EXPORT_CHUNK_SIZE)
+            if error := await finish():
+                raise error
+        finally:
+            # Клиент оборвал загрузку — не оставляем экспорт работать в контейнере
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+    return chunks()
+
+
+async def wait_until_ready(bot_id: str, timeout: float = BOT_READY_TIMEOUT) -> dict:
+    """Ждёт, пока бот в контейнере создаст файл готовности, и возвращает тайминги его запуска."""
+    container = f"bot_{bot_id}"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        code, output = await run_docker("exec", container, "cat", BOT_READY_FILE)
+        if code == 0 and output:
+            return json.loads(output)
+
+        _, running = await run_docker("inspect", "-f", "{{.State.Running}}", container)
+        if running != "true":
+            raise RuntimeError(f"Контейнер {container} остановился во время запуска")
+        if loop.time() >= deadline:
+            raise TimeoutError(f"Бот {bot_id} не запустился за {timeout:.0f} с")
+        await asyncio.sleep(0.5)
+
+
+async def read_bot_metrics(bot_id: str) -> Optional[dict]:
+    code, output = await run_docker("exec", f"bot_{bot_id}", "cat", BOT_METRICS_FILE)
+    if code != 0 or not output:
+        return None
+    return json.loads(output)
+
+
+def template_version() -> str:
+    """Хэш исходников шаблона вместе с общими модулями — по нему видно, какие боты отстали."""
+    template = Path(TEMPLATE_PATH)
+    files = {
+        str(path.relative_to(template)): path for path in template.rglob("*")
+        if path.is_file() and "__pycache__" not in path.parts and path.name != ".env"
+    }
+    files.update({module: SHARED_DIR / module for module in SHARED_TEMPLATE_MODULES})
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode())
+        digest.update(files[name].read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def copy_template(bot_path: Path):
     shutil.copytree(TEMPLATE_PATH, bot_path)
+    for module in SHARED_TEMPLATE_MODULES:
+        shutil.copy(SHARED_DIR / module, bot_path / module)
+
+
+def docker_container_args(bot_id: str, env_path: Path, quota) -> List[str]:
+    """Аргументы docker run/create после самой команды: лимиты по тарифу, хранилище, имя и образ."""
+    return [
+        "--env-file", str(env_path), *docker_storage_args(bot_id),
+        "--stop-timeout", str(BOT_STOP_TIMEOUT),
+        "--cpus", str(quota.cpus), "--memory", f"{quota.memory_mb}m", "--memory-swap", f"{quota.memory_mb}m",
+        "--name", f"bot_{bot_id}", f"bot_{bot_id}",
+    ]
+
+
+def prepare_bot_files(bot_path: Path, bot_data: BotRequest, quota):
+    # Создаем папку для бота
+    copy_template(bot_path)
 
     # Копируем .env.template как .env
     env_path = bot_path / ".env"
@@ -26,19 +213,47 @@ async def create_bot_instance(bot_data: BotRequest) -> str:
     # Подставляем данные
     set_key(str(env_path), "BOT_TOKEN", bot_data.bot_token)
     set_key(str(env_path), "ADMIN_IDS", str(bot_data.admin_id))
+    set_key(str(env_path), "MAX_UPDATES_PER_SECOND", str(quota.updates_per_sec))
+
+
+async def start_local(bot_id: str, bot_path: Path, quota, progress: Optional[Progress] = None) -> dict:
+    """Собирает образ и запускает контейнер на этом хосте; возвращает тайминги старта бота."""
+    progress = progress or (lambda stage, **data: None)
+    # Собираем Docker-образ; подпроцесс асинхронный, чтобы сборка не блокировала остальные запросы
+    code, _ = await run_docker("build", "-q", "-t", f"bot_{bot_id}", str(bot_path))
+    if code != 0:
+        raise RuntimeError("Не удалось собрать образ бота")
+    progress("image_ready")
 
-    # Собираем Docker-образ
-    os.system(f"docker build -t bot_{bot_id} {bot_path}")
+    # Запускаем контейнер с лимитами CPU и памяти по тарифу
+    code, _ = await run_docker("run", "-d", *docker_container_args(bot_id, bot_path / ".env", quota))
+    if code != 0:
+        raise RuntimeError("Не удалось запустить контейнер бота")
+    progress("container_started")
 
-    # Запускаем контейнер
-    os.system(f"docker run -d --env-file {env_path} --name bot_{bot_id} bot_{bot_id}")
+    # Ждём, пока бот реально начнёт принимать апдейты
+    return await wait_until_ready(bot_id)
 
-    # Получаем username бота
-    bot = Bot(token=bot_data.bot_token)
-    me = await bot.get_me()
-    bot_username = me.username
+
+async def stop_local(bot_id: str, remove: bool = False):
+    """Останавливает контейнер (бот успевает сохранить offset); remove — удалить и сам контейнер."""
+    await run_docker("stop", f"bot_{bot_id}")
+    if remove:
+        await run_docker("rm", f"bot_{bot_id}")
+
+
+async def _provision(bot_id: str, bot_path: Path, bot_data: BotRequest, quota, progress: Progress):
+    prepare_bot_files(bot_path, bot_data, quota)
+
+    # Есть рабочие узлы — собирает и запускает агент выбранного узла, иначе этот хост
+    node = await place(bot_id, quota)
+    if node:
+        progress("placed", node_id=node["node_id"])
+        readiness = await start_on_node(node, bot_id, bot_path, quota)
+    else:
+        readiness = await start_local(bot_id, bot_path, quota, progress)
+    print(f"Бот {bot_id} запущен, этапы старта: {readiness.get('phases')}")
+    progress("online", phases=readiness.get("phases"))
 
     # Сохраняем статус подписки: активен, не оплачен
     await set_subscription(bot_id=bot_id, active=True, paid=False)
-
-    return f"https://t.me/{bot_username}"
@@ -5,7 +5,10 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
 import asyncio
 import os
+from pathlib import Path
+import aiosqlite
 from dotenv import load_dotenv
+from app.shared.media_cache import MediaCache
 from app.shared.yookassa_api import create_payment_link
 from app.shared.subscription_db import set_subscription
 
@@ -14,14 +17,20 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBAPP_URL = os.getenv("WEBAPP_URL")
+# Кэш file_id — рабочие данные, а не исходники: держим его вне app/shared, который копируется в ботов
+MEDIA_CACHE_DB = os.getenv("MEDIA_CACHE_DB", "app/data/media_cache.db")
+# Скриншоты инструкции те же, что в веб-форме
+GUIDE_DIR = Path(__file__).resolve().parent.parent.parent / "frontend"
 
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher(storage=MemoryStorage())
+media = MediaCache()
 
 @dp.message(F.text.lower() == "/start")
 async def start(message: types.Message):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🚀 Создать бота", web_app=WebAppInfo(url=WEBAPP_URL))],
+        [InlineKeyboardButton(text="📖 Как получить токен и ID", callback_data="guide")],
         [InlineKeyboardButton(text="💰 Оплатить подписку", callback_data="pay")],
         [InlineKeyboardButton(text="🛒 Магазин", callback_data="shop")],
         [InlineKeyboardButton(text="🛠 Техподдержка", url="https://t.me/nikita_support")]
@@ -57,16 +66,31 @@ async def handle_payment(callback: types.CallbackQuery):
     url = create_payment_link(price, user_id, bot_id)
     await callback.message.answer(f"💳 Перейдите для оплаты:\n{url}")
 
+@dp.callback_query(F.data == "guide")
+async def show_guide(callback: types.CallbackQuery):
+    # Картинки загружаются в Telegram один раз, дальше уходят по file_id
+    chat_id = callback.message.chat.id
+    await media.send_photo(bot, chat_id, GUIDE_DIR / "botfather.png",
+                           caption="1. Создайте бота у @BotFather командой /newbot и скопируйте токен")
+    await media.send_photo(bot, chat_id, GUIDE_DIR / "userinfobot.png",
+                           caption="2. Узнайте свой ID у @userinfobot — он понадобится как ID администратора")
+    await callback.answer()
+
 @dp.callback_query(F.data == "shop")
 async def show_shop(callback: types.CallbackQuery):
     await callback.message.answer("🛒 Магазин скоро будет доступен!")
 
 async def main():
     print("Бот запускается...")  # Добавьте это для отладки
+    Path(MEDIA_CACHE_DB).parent.mkdir(parents=True, exist_ok=True)
+    conn = await aiosqlite.connect(MEDIA_CACHE_DB)
+    await media.attach(conn)
     try:
         await dp.start_polling(bot)
     except KeyboardInterrupt:
         print("Бот остановлен")  # Сообщение о корректном завершении
+    finally:
+        await conn.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
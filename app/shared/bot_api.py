@@ -0,0 +1,84 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError, TelegramNotFound, TelegramUnauthorizedError
+from aiogram.types import User
+from aiogram.utils.token import TokenValidationError
+
+# Свой сервер Bot API (telegram-bot-api или тестовый стенд), по умолчанию — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+TOKEN_CHECK_TIMEOUT = float(os.getenv("TOKEN_CHECK_TIMEOUT", "5"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "3600"))
+TOKEN_CACHE_SIZE = 1024
+
+_shared_session: Optional[AiohttpSession] = None
+# sha256 токена -> (время истечения, результат get_me); сам токен в памяти не храним
+_me_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+class InvalidTokenError(ValueError):
+    pass
+
+
+class TelegramUnavailableError(RuntimeError):
+    """Telegram не ответил на проверку токена (сеть, таймаут, 5xx) — токен при этом может быть верным."""
+
+
+def _new_session(**kwargs) -> AiohttpSession:
+    if TELEGRAM_API_URL:
+        kwargs["api"] = TelegramAPIServer.from_base(TELEGRAM_API_URL)
+    return AiohttpSession(**kwargs)
+
+
+def make_bot(token: str, **kwargs) -> Bot:
+    return Bot(token=token, session=_new_session(), **kwargs)
+
+
+def shared_session() -> AiohttpSession:
+    """Одна сессия (и пул соединений) на весь процесс для коротких служебных запросов."""
+    global _shared_session
+    if _shared_session is None:
+        _shared_session = _new_session(timeout=TOKEN_CHECK_TIMEOUT)
+    return _shared_session
+
+
+async def close_shared_session():
+    global _shared_session
+    if _shared_session is not None:
+        await _shared_session.close()
+        _shared_session = None
+
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def validate_token(token: str) -> User:
+    """get_me через общую сессию; удачные ответы кэшируются по хэшу токена."""
+    key = token_hash(token)
+    cached = _me_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        _me_cache.move_to_end(key)
+        return cached[1]
+
+    try:
+        me = await Bot(token=token, session=shared_session()).get_me()
+    except TokenValidationError:
+        raise InvalidTokenError("Неверный формат токена")
+    except (TelegramUnauthorizedError, TelegramNotFound):
+        raise InvalidTokenError("Telegram не принял токен бота")
+    except (TelegramAPIError, asyncio.TimeoutError) as e:
+        # Сетевые ошибки и таймауты aiogram приходят как TelegramNetworkError — тоже TelegramAPIError
+        raise TelegramUnavailableError(f"Telegram сейчас недоступен, попробуйте позже ({e})")
+
+    _me_cache[key] = (time.monotonic() + TOKEN_CACHE_TTL, me)
+    if len(_me_cache) > TOKEN_CACHE_SIZE:
+        _me_cache.popitem(last=False)
+    return me
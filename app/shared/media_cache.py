@@ -0,0 +1,142 @@
+"""Кэш file_id отправленных файлов: одни и те же картинки и документы не загружаются повторно.
+
+После первой загрузки Telegram возвращает file_id, по которому файл можно
+отправлять снова без передачи байтов. Ключ кэша — sha256 содержимого
+локального файла (для ссылок — sha256 самой ссылки) и вид медиа; file_id
+действует только для бота, который загрузил файл, поэтому записи хранятся по
+id бота. Если Telegram отверг сохранённый file_id, файл загружается заново и
+запись обновляется.
+
+Файл копируется в контекст сборки каждого бота (см. backend/utils.py), поэтому
+импортировать здесь можно только стандартную библиотеку, aiosqlite и aiogram.
+"""
+import os
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import aiosqlite
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+MEDIA_TABLE = """
+    CREATE TABLE IF NOT EXISTS media_files (
+        bot_id INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (bot_id, sha256, kind)
+    ) WITHOUT ROWID
+"""
+# вид медиа -> метод Bot, которым он отправляется
+SEND_METHODS = {
+    "photo": "send_photo",
+    "document": "send_document",
+    "video": "send_video",
+    "animation": "send_animation",
+    "audio": "send_audio",
+    "voice": "send_voice",
+}
+# Так Bot API отвечает на file_id, который больше не годится для этого бота
+STALE_ERRORS = ("file identifier", "file_id", "file reference", "file_reference")
+
+Source = Union[str, Path]
+
+
+def _is_url(source: Source) -> bool:
+    return isinstance(source, str) and source.startswith(("http://", "https://"))
+
+
+def _file_id(message: Message, kind: str) -> Optional[str]:
+    media = getattr(message, kind, None)
+    if kind == "photo" and media:
+        media = media[-1]  # самый большой размер
+    return media.file_id if media else None
+
+
+class MediaCache:
+    def __init__(self):
+        self.conn: Optional[aiosqlite.Connection] = None
+        self._file_ids: Dict[Tuple[int, str, str], str] = {}
+        # путь -> (mtime, размер, sha256): файл не перечитывается, пока не изменился
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+        self.uploads = 0
+        self.hits = 0
+
+    async def attach(self, conn: aiosqlite.Connection):
+        """Подключает базу; таблица кэша создаётся при необходимости — её потеря стоит только повторной загрузки."""
+        self.conn = conn
+        await conn.execute(MEDIA_TABLE)
+        await conn.commit()
+
+    def _digest(self, source: Source) -> str:
+        if _is_url(source):
+            return hashlib.sha256(source.encode()).hexdigest()
+        path = os.path.abspath(source)
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(chunk)
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        return self._hashes[path][2]
+
+    async def _get(self, key: Tuple[int, str, str]) -> Optional[str]:
+        if key not in self._file_ids:
+            cursor = await self.conn.execute(
+                "SELECT file_id FROM media_files WHERE bot_id = ? AND sha256 = ? AND kind = ?", key
+            )
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            self._file_ids[key] = row[0]
+        return self._file_ids[key]
+
+    async def _put(self, key: Tuple[int, str, str], file_id: Optional[str]):
+        if file_id is None:
+            self._file_ids.pop(key, None)
+            await self.conn.execute("DELETE FROM media_files WHERE bot_id = ? AND sha256 = ? AND kind = ?", key)
+        else:
+            self._file_ids[key] = file_id
+            await self.conn.execute(
+                "INSERT OR REPLACE INTO media_files (bot_id, sha256, kind, file_id, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (*key, file_id, datetime.now().isoformat(timespec="seconds"))
+            )
+        await self.conn.commit()
+
+    async def send(self, bot: Bot, kind: str, chat_id: int, source: Source, **kwargs) -> Message:
+        """Отправляет файл (путь или ссылку) по сохранённому file_id, а без него — загружает и запоминает."""
+        method = getattr(bot, SEND_METHODS[kind])
+        key = (bot.id, self._digest(source), kind)
+        file_id = await self._get(key)
+        if file_id:
+            try:
+                message = await method(chat_id, file_id, **kwargs)
+                self.hits += 1
+                return message
+            except TelegramBadRequest as e:
+                if not any(error in e.message.lower() for error in STALE_ERRORS):
+                    raise
+                await self._put(key, None)
+
+        message = await method(chat_id, source if _is_url(source) else FSInputFile(source), **kwargs)
+        self.uploads += 1
+        file_id = _file_id(message, kind)
+        if file_id:
+            await self._put(key, file_id)
+        return message
+
+    async def send_photo(self, bot: Bot, chat_id: int, source: Source, **kwargs) -> Message:
+        return await self.send(bot, "photo", chat_id, source, **kwargs)
+
+    async def send_document(self, bot: Bot, chat_id: int, source: Source, **kwargs) -> Message:
+        return await self.send(bot, "document", chat_id, source, **kwargs)
+
+    def snapshot(self) -> dict:
+        return {"uploads": self.uploads, "hits": self.hits, "cached": len(self._file_ids)}
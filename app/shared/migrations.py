@@ -0,0 +1,91 @@
+"""Миграции SQLite для backend и ботов-тенантов.
+
+Миграция — кортеж (version, name, steps), шаг — SQL-строка. Применённые версии
+записываются в таблицу schema_version. Каждая миграция выполняется в своей
+транзакции (BEGIN IMMEDIATE), так что два процесса не применят одну и ту же
+дважды, а упавшая миграция откатывается целиком.
+
+Файл копируется в контекст сборки каждого бота (см. backend/utils.py), поэтому
+импортировать здесь можно только стандартную библиотеку и aiosqlite.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, Iterable, Sequence, Tuple
+
+import aiosqlite
+
+Migration = Tuple[int, str, Sequence[str]]
+
+SCHEMA_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+"""
+
+
+async def current_version(conn: aiosqlite.Connection) -> int:
+    cursor = await conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    )
+    if not await cursor.fetchone():
+        return 0
+    cursor = await conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    (version,) = await cursor.fetchone()
+    return version
+
+
+async def migrate(conn: aiosqlite.Connection, migrations: Iterable[Migration]) -> Tuple[int, int]:
+    """Применяет недостающие миграции по порядку. Возвращает (версия до, версия после)."""
+    migrations = sorted(migrations)
+    before = await current_version(conn)
+    if not migrations or before >= migrations[-1][0]:
+        return before, before
+
+    await conn.execute(SCHEMA_TABLE)
+    await conn.commit()
+    version = before
+    for number, name, steps in migrations:
+        if number <= version:
+            continue
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Пока ждали блокировку, миграцию мог применить другой процесс
+            version = await current_version(conn)
+            if number <= version:
+                await conn.rollback()
+                continue
+            for step in steps:
+                await conn.execute(step)
+            await conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (number, name, datetime.now().isoformat(timespec="seconds"))
+            )
+            await conn.commit()
+            version = number
+        except Exception:
+            await conn.rollback()
+            raise
+    return before, version
+
+
+async def migrate_file(path, migrations: Sequence[Migration]) -> Tuple[int, int]:
+    async with aiosqlite.connect(path, timeout=30) as conn:
+        return await migrate(conn, migrations)
+
+
+async def migrate_many(paths: Dict[str, object], migrations: Sequence[Migration],
+                       concurrency: int = 16) -> Dict[str, object]:
+    """Мигрирует много баз параллельно. Результат: id -> (до, после) или текст ошибки."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(path):
+        async with semaphore:
+            try:
+                return await migrate_file(path, migrations)
+            except Exception as e:
+                return f"{type(e).__name__}: {e}"
+
+    results = await asyncio.gather(*(one(path) for path in paths.values()))
+    return dict(zip(paths.keys(), results))
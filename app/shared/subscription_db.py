@@ -1,41 +1,138 @@
+import os
 import sqlite3
+import aiosqlite
 from datetime import datetime, timedelta
 
-DB_FILE = "../backend/subscriptions.db"
+from app.shared.migrations import migrate_file
+
+SUBSCRIPTIONS_DB = os.getenv("SUBSCRIPTIONS_DB", "app/shared/subscriptions.db")
+
+# Схема общей БД backend: подписки, реестр тенантов, бэкапы
+SUBSCRIPTIONS_MIGRATIONS = [
+    (1, "subscriptions", [
+        """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            bot_id TEXT PRIMARY KEY,
+            created_at TEXT,
+            active INTEGER,
+            paid INTEGER
+        )
+        """,
+    ]),
+    (2, "tenants", [
+        """
+        CREATE TABLE IF NOT EXISTS tenants (
+            bot_id TEXT PRIMARY KEY,
+            plan TEXT NOT NULL,
+            cpus REAL NOT NULL,
+            memory_mb INTEGER NOT NULL,
+            updates_per_sec REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'active',
+            created_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tenants_status ON tenants (status)",
+    ]),
+    (3, "backups", [
+        """
+        CREATE TABLE IF NOT EXISTS backups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bot_id TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_backups_bot ON backups (bot_id, id)",
+    ]),
+    # Раньше продления писались в отдельную базу со своей таблицей subscriptions (user_id, bot_id, expires_at)
+    (4, "subscription_expiry", [
+        "ALTER TABLE subscriptions ADD COLUMN user_id INTEGER",
+        "ALTER TABLE subscriptions ADD COLUMN expires_at TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_expires ON subscriptions (expires_at)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_unpaid ON subscriptions (created_at) WHERE active = 1 AND paid = 0",
+    ]),
+    # Один токен — один работающий бот: остановленные и упавшие тенанты токен не держат
+    (5, "tenant_token", [
+        "ALTER TABLE tenants ADD COLUMN token_hash TEXT",
+        "ALTER TABLE tenants ADD COLUMN username TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_tenants_token ON tenants (token_hash) "
+        "WHERE status IN ('provisioning', 'active')",
+    ]),
+    # Версия шаблона, на которой работает бот, и ход rolling upgrade (app/backend/upgrade.py)
+    (6, "tenant_upgrades", [
+        "ALTER TABLE tenants ADD COLUMN template_version TEXT",
+        "ALTER TABLE tenants ADD COLUMN upgrade_status TEXT",
+        "ALTER TABLE tenants ADD COLUMN upgrade_error TEXT",
+        "ALTER TABLE tenants ADD COLUMN upgraded_at TEXT",
+    ]),
+    # Рабочие узлы с агентами (app/backend/agent.py) и размещение тенантов по ним (app/backend/cluster.py)
+    (7, "cluster", [
+        """
+        CREATE TABLE IF NOT EXISTS nodes (
+            node_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            cpus REAL NOT NULL,
+            memory_mb INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'active',
+            added_at TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS placements (
+            bot_id TEXT PRIMARY KEY,
+            node_id TEXT NOT NULL,
+            placed_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_placements_node ON placements (node_id)",
+    ]),
+    # Аренда для фоновых служб (один действующий экземпляр) и отметка о предупреждении за сутки
+    (8, "scheduler", [
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """,
+        "ALTER TABLE subscriptions ADD COLUMN warned_at TEXT",
+    ]),
+]
+
+
+async def init_db() -> tuple:
+    """Приводит схему к последней версии. Вызывается один раз при старте процесса."""
+    return await migrate_file(SUBSCRIPTIONS_DB, SUBSCRIPTIONS_MIGRATIONS)
+
 
 async def set_subscription(bot_id: str, active: bool, paid: bool):
-    async with aiosqlite.connect("app/shared/subscriptions.db") as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                bot_id TEXT PRIMARY KEY,
-                created_at TEXT,
-                active INTEGER,
-                paid INTEGER
-            )
-        """)
+    async with aiosqlite.connect(SUBSCRIPTIONS_DB) as db:
         await db.execute("""
             INSERT OR REPLACE INTO subscriptions (bot_id, created_at, active, paid)
             VALUES (?, ?, ?, ?)
         """, (bot_id, datetime.now().isoformat(), int(active), int(paid)))
         await db.commit()
 
-def set_subscription(user_id: int, bot_id: str, months: int):
+def extend_subscription(user_id: int, bot_id: str, months: int):
     expires = (datetime.utcnow() + timedelta(days=30 * months)).isoformat()
-    with sqlite3.connect(DB_FILE) as conn:
+    with sqlite3.connect(SUBSCRIPTIONS_DB) as conn:
         c = conn.cursor()
-        c.execute("REPLACE INTO subscriptions (user_id, bot_id, expires_at) VALUES (?, ?, ?)",
-                  (user_id, bot_id, expires))
+        c.execute("UPDATE subscriptions SET user_id = ?, expires_at = ?, active = 1, paid = 1 WHERE bot_id = ?",
+                  (user_id, expires, bot_id))
         conn.commit()
 
 def get_subscription(user_id: int):
-    with sqlite3.connect(DB_FILE) as conn:
+    with sqlite3.connect(SUBSCRIPTIONS_DB) as conn:
         c = conn.cursor()
-        c.execute("SELECT expires_at FROM subscriptions WHERE user_id = ?", (user_id,))
+        c.execute("SELECT MAX(expires_at) FROM subscriptions WHERE user_id = ?", (user_id,))
         row = c.fetchone()
         return row[0] if row else None
 
 def get_expired_bots():
-    with sqlite3.connect(DB_FILE) as conn:
+    with sqlite3.connect(SUBSCRIPTIONS_DB) as conn:
         c = conn.cursor()
         c.execute("SELECT user_id, bot_id FROM subscriptions WHERE expires_at < ?", (datetime.utcnow().isoformat(),))
         return c.fetchall()
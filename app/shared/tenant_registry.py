@@ -0,0 +1,161 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from app.shared.subscription_db import SUBSCRIPTIONS_DB
+
+# Реестр тенантов живёт в той же БД, что и подписки; таблицу создаёт миграция init_db
+REGISTRY_DB = SUBSCRIPTIONS_DB
+
+
+class DuplicateTokenError(ValueError):
+    pass
+
+
+async def register_tenant(bot_id: str, plan: str, cpus: float, memory_mb: int, updates_per_sec: float,
+                          token_hash: Optional[str] = None, username: Optional[str] = None,
+                          status: str = "active", template_version: Optional[str] = None):
+    """Регистрирует тенанта; второй работающий бот с тем же токеном отсекает уникальный индекс."""
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        try:
+            await db.execute("""
+                INSERT INTO tenants (bot_id, plan, cpus, memory_mb, updates_per_sec, status, created_at,
+                                     token_hash, username, template_version)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (bot_id, plan, cpus, memory_mb, updates_per_sec, status, datetime.now().isoformat(),
+                  token_hash, username, template_version))
+        except aiosqlite.IntegrityError:
+            raise DuplicateTokenError("Бот с этим токеном уже запущен")
+        await db.commit()
+
+
+async def set_tenant_status(bot_id: str, status: str):
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        await db.execute("UPDATE tenants SET status = ? WHERE bot_id = ?", (status, bot_id))
+        await db.commit()
+
+
+async def set_upgrade_status(bot_id: str, upgrade_status: str, template_version: Optional[str] = None,
+                             error: Optional[str] = None):
+    """Ход обновления шаблона; template_version меняется только после успешного переключения."""
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        await db.execute("""
+            UPDATE tenants
+            SET upgrade_status = ?, upgrade_error = ?, upgraded_at = ?,
+                template_version = COALESCE(?, template_version)
+            WHERE bot_id = ?
+        """, (upgrade_status, error, datetime.now().isoformat(), template_version, bot_id))
+        await db.commit()
+
+
+async def find_tenant_by_token(token_hash: str) -> Optional[dict]:
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(
+            "SELECT * FROM tenants WHERE token_hash = ? AND status IN ('provisioning', 'active')", (token_hash,)
+        )
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+
+async def get_tenant(bot_id: str) -> Optional[dict]:
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("SELECT * FROM tenants WHERE bot_id = ?", (bot_id,))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+
+async def list_tenants(status: Optional[str] = None) -> List[dict]:
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        db.row_factory = aiosqlite.Row
+        if status:
+            cursor = await db.execute("SELECT * FROM tenants WHERE status = ? ORDER BY created_at", (status,))
+        else:
+            cursor = await db.execute("SELECT * FROM tenants ORDER BY created_at")
+        return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_committed_resources(placed_only: bool = False) -> tuple:
+    """Суммарные CPU и память, выделенные активным тенантам; placed_only — только размещённым на узлах."""
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        cursor = await db.execute(
+            "SELECT COALESCE(SUM(cpus), 0), COALESCE(SUM(memory_mb), 0) FROM tenants WHERE status = 'active'"
+            + (" AND bot_id IN (SELECT bot_id FROM placements)" if placed_only else "")
+        )
+        cpus, memory_mb = await cursor.fetchone()
+        return float(cpus), int(memory_mb)
+
+
+async def register_node(node_id: str, url: str, cpus: float, memory_mb: int, weight: float):
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        await db.execute("""
+            INSERT INTO nodes (node_id, url, cpus, memory_mb, weight, status, added_at)
+            VALUES (?, ?, ?, ?, ?, 'active', ?)
+            ON CONFLICT (node_id) DO UPDATE SET
+                url = excluded.url, cpus = excluded.cpus, memory_mb = excluded.memory_mb,
+                weight = excluded.weight, status = 'active'
+        """, (node_id, url, cpus, memory_mb, weight, datetime.now().isoformat()))
+        await db.commit()
+
+
+async def set_node_status(node_id: str, status: str):
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        await db.execute("UPDATE nodes SET status = ? WHERE node_id = ?", (status, node_id))
+        await db.commit()
+
+
+async def list_nodes(status: Optional[str] = None) -> List[dict]:
+    """Узлы с выделенными на них ресурсами (тенанты в статусах provisioning и active)."""
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("""
+            SELECT n.*, COUNT(t.bot_id) AS tenants,
+                   COALESCE(SUM(t.cpus), 0) AS committed_cpus, COALESCE(SUM(t.memory_mb), 0) AS committed_memory_mb
+            FROM nodes n
+            LEFT JOIN placements p ON p.node_id = n.node_id
+            LEFT JOIN tenants t ON t.bot_id = p.bot_id AND t.status IN ('provisioning', 'active')
+            WHERE ? IS NULL OR n.status = ?
+            GROUP BY n.node_id
+            ORDER BY n.node_id
+        """, (status, status))
+        return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_cluster_capacity() -> Optional[Tuple[float, int]]:
+    """Суммарные CPU и память активных узлов; None, если узлов нет и боты живут на этом хосте."""
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        cursor = await db.execute("SELECT COUNT(*), SUM(cpus), SUM(memory_mb) FROM nodes WHERE status = 'active'")
+        count, cpus, memory_mb = await cursor.fetchone()
+        return (float(cpus), int(memory_mb)) if count else None
+
+
+async def get_placement(bot_id: str) -> Optional[dict]:
+    """Узел тенанта вместе с адресом агента; None — бот работает на этом хосте."""
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("""
+            SELECT p.bot_id, p.placed_at, n.* FROM placements p JOIN nodes n ON n.node_id = p.node_id
+            WHERE p.bot_id = ?
+        """, (bot_id,))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+
+async def list_placements() -> Dict[str, str]:
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        cursor = await db.execute("SELECT bot_id, node_id FROM placements")
+        return dict(await cursor.fetchall())
+
+
+async def set_placement(bot_id: str, node_id: Optional[str]):
+    async with aiosqlite.connect(REGISTRY_DB) as db:
+        if node_id is None:
+            await db.execute("DELETE FROM placements WHERE bot_id = ?", (bot_id,))
+        else:
+            await db.execute(
+                "INSERT OR REPLACE INTO placements (bot_id, node_id, placed_at) VALUES (?, ?, ?)",
+                (bot_id, node_id, datetime.now().isoformat())
+            )
+        await db.commit()
@@ -0,0 +1,127 @@
+"""Где лежат базы ботов-тенантов и как читать их все разом.
+
+TENANT_STORAGE=container — база живёт внутри контейнера (как раньше) и пропадает
+вместе с ним. TENANT_STORAGE=shared — базы всех ботов лежат в одном каталоге на
+хосте (TENANT_DATA_DIR/<bot_id>/bot_database.db), каждому контейнеру
+монтируется только его подкаталог. Тогда бэкапы, миграции и отчёты по всем
+тенантам делаются отсюда одной операцией, а строки помечаются tenant_id.
+
+TENANT_STORAGE=pooled — одна база на всех (TENANT_DATA_DIR/pool/tenants.db,
+схема schema.POOL_MIGRATIONS): в каждой таблице tenant_id, ключи и индексы
+начинаются с него, бот получает свой id в TENANT_ID и видит только свои
+строки. Бэкап, миграция и отчёт — один файл и один запрос с GROUP BY
+tenant_id. Запись в SQLite идёт по очереди, поэтому режим рассчитан на
+умеренный общий поток записей и на один хост: по сети (NFS) блокировки
+SQLite ненадёжны, и узлы кластера в этом режиме не используются.
+"""
+import os
+import asyncio
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+TENANT_STORAGE = os.getenv("TENANT_STORAGE", "container")
+TENANT_DATA_DIR = os.getenv("TENANT_DATA_DIR", "app/tenant_data")
+TENANT_DB_NAME = "bot_database.db"
+POOL_DIR_NAME = "pool"
+POOL_DB_NAME = "tenants.db"
+# Под этим id общая база проходит через migrate_many, бэкапы и отчёты
+POOL_ID = "_pool"
+CONTAINER_DATA_DIR = "/data"
+QUERY_CONCURRENCY = int(os.getenv("TENANT_QUERY_CONCURRENCY", "8"))
+
+
+def shared_storage() -> bool:
+    """Базы ботов лежат на хосте, а не в контейнерах (shared или pooled)."""
+    return TENANT_STORAGE in ("shared", "pooled")
+
+
+def pooled_storage() -> bool:
+    return TENANT_STORAGE == "pooled"
+
+
+def tenant_data_dir(bot_id: str) -> Path:
+    return Path(TENANT_DATA_DIR).resolve() / bot_id
+
+
+def pool_db_path() -> Path:
+    return Path(TENANT_DATA_DIR).resolve() / POOL_DIR_NAME / POOL_DB_NAME
+
+
+def tenant_db_path(bot_id: str) -> Path:
+    """Файл с данными бота; в режиме pooled — общий для всех."""
+    if pooled_storage():
+        return pool_db_path()
+    return tenant_data_dir(bot_id) / TENANT_DB_NAME
+
+
+def docker_storage_args(bot_id: str) -> List[str]:
+    """Аргументы docker run: каталог с базой монтируется в /data и туда же указывает DB_PATH."""
+    if not shared_storage():
+        return []
+    if pooled_storage():
+        # Монтируется каталог, а не файл: рядом с базой SQLite держит общие -wal и -shm
+        data_dir = pool_db_path().parent
+        data_dir.mkdir(parents=True, exist_ok=True)
+        return ["-v", f"{data_dir}:{CONTAINER_DATA_DIR}", "-e", f"DB_PATH={CONTAINER_DATA_DIR}/{POOL_DB_NAME}",
+                "-e", f"TENANT_ID={bot_id}"]
+    data_dir = tenant_data_dir(bot_id)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    return ["-v", f"{data_dir}:{CONTAINER_DATA_DIR}", "-e", f"DB_PATH={CONTAINER_DATA_DIR}/{TENANT_DB_NAME}"]
+
+
+def list_tenant_dbs(bot_ids: Optional[Iterable[str]] = None) -> Dict[str, Path]:
+    """Файлы баз по id; в режиме pooled — единственная общая база под POOL_ID."""
+    if pooled_storage():
+        path = pool_db_path()
+        return {POOL_ID: path} if path.exists() else {}
+    root = Path(TENANT_DATA_DIR).resolve()
+    if bot_ids is None:
+        paths = root.glob(f"*/{TENANT_DB_NAME}")
+    else:
+        paths = (root / bot_id / TENANT_DB_NAME for bot_id in bot_ids)
+    return {path.parent.name: path for path in paths if path.exists()}
+
+
+def _query_one(path: Path, sql: str, params: tuple) -> List[dict]:
+    conn = sqlite3.connect(path, timeout=5)
+    try:
+        conn.execute("PRAGMA query_only = 1")
+        cursor = conn.execute(sql, params)
+        keys = [column[0] for column in cursor.description]
+        return [dict(zip(keys, row)) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+async def query_tenants(sql: str, params: tuple = (), bot_ids: Optional[Iterable[str]] = None) -> List[dict]:
+    """Выполняет запрос на чтение по данным всех тенантов.
+
+    Запрос пишется с GROUP BY tenant_id (или выбирает tenant_id) и работает в
+    обоих режимах: общая база (pooled) читается одним запросом, отдельные базы
+    shared — каждая своим, в потоках, не больше QUERY_CONCURRENCY одновременно,
+    и tenant_id строк подставляется из имени базы. Ошибка одной базы не роняет отчёт.
+    """
+    if pooled_storage():
+        path = pool_db_path()
+        if not path.exists():
+            return []
+        rows = await asyncio.to_thread(_query_one, path, sql, params)
+        if bot_ids is not None:
+            bot_ids = set(bot_ids)
+            rows = [row for row in rows if row["tenant_id"] in bot_ids]
+        return rows
+
+    semaphore = asyncio.Semaphore(QUERY_CONCURRENCY)
+
+    async def one(bot_id: str, path: Path) -> List[dict]:
+        async with semaphore:
+            try:
+                rows = await asyncio.to_thread(_query_one, path, sql, params)
+            except sqlite3.Error as e:
+                print(f"⚠️ Не удалось прочитать базу {bot_id}: {e}")
+                return []
+        return [{**row, "tenant_id": bot_id} for row in rows]
+
+    results = await asyncio.gather(*(one(bot_id, path) for bot_id, path in list_tenant_dbs(bot_ids).items()))
+    return [row for rows in results for row in rows]
@@ -1,11 +1,14 @@
 from yookassa import Configuration, Payment
+from typing import Optional
 import uuid
+import os
 
-Configuration.account_id = "твой_shop_id"
-Configuration.secret_key = "твой_secret_key"
+Configuration.account_id = os.getenv("YOOKASSA_SHOP_ID") or "твой_shop_id"
+Configuration.secret_key = os.getenv("YOOKASSA_SECRET_KEY") or "твой_secret_key"
 
 
-def create_payment_link(amount: int, user_id: int, bot_id: str) -> str:
+def create_payment_link(amount: int, user_id: int, bot_id: str, description: Optional[str] = None,
+                        return_url: str = "https://t.me/your_bot", metadata: Optional[dict] = None) -> str:
     payment = Payment.create({
         "amount": {
             "value": f"{amount:.2f}",
@@ -13,13 +16,14 @@ def create_payment_link(amount: int, user_id: int, bot_id: str) -> str:
         },
         "confirmation": {
             "type": "redirect",
-            "return_url": "https://t.me/your_bot"
+            "return_url": return_url
         },
         "capture": True,
-        "description": f"Подписка на бота {bot_id}",
+        "description": description or f"Подписка на бота {bot_id}",
         "metadata": {
             "user_id": str(user_id),
-            "bot_id": bot_id
+            "bot_id": bot_id,
+            **(metadata or {})
         }
     }, uuid.uuid4())
 
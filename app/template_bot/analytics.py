@@ -0,0 +1,80 @@
+"""Воронка бота по дням из таблицы daily_stats.
+
+Счётчики ведут триггеры миграции 9 в той же транзакции, что и само событие
+(новый пользователь, приглашение, регистрация, запись, смена статуса записи), поэтому
+отчёт читает только daily_stats — строку на день и метрику, сколько бы ни
+было пользователей и записей.
+"""
+from collections import Counter
+from datetime import date, datetime, timedelta, tzinfo
+from typing import Dict
+
+import aiosqlite
+
+UTC_OFFSET_KEY = "stats_utc_offset"
+METRIC_LABELS = {
+    "started": "Открыли бота",
+    "referred": "По приглашению",
+    "registered": "Зарегистрировались",
+    "booked": "Записались",
+    "confirmed": "Подтверждено",
+    "paid": "Оплачено",
+    "cancelled": "Отменено",
+}
+# Шаги воронки для конверсии: доля от предыдущего шага
+FUNNEL = ("started", "registered", "booked", "paid")
+HISTORY_DAYS = 30
+PERIODS = {"Сегодня": 1, "7 дней": 7, f"{HISTORY_DAYS} дней": HISTORY_DAYS}
+DAILY_ROWS = 7
+
+
+async def set_utc_offset(conn: aiosqlite.Connection, tenant_id: str, tz: tzinfo):
+    """Сообщает триггерам смещение пояса бота, чтобы «день» совпадал с днём админа."""
+    minutes = int(datetime.now(tz).utcoffset().total_seconds() // 60)
+    await conn.execute(
+        "INSERT OR REPLACE INTO bot_state (tenant_id, key, value) VALUES (?, ?, ?)",
+        (tenant_id, UTC_OFFSET_KEY, f"{minutes:+d} minutes")
+    )
+    await conn.commit()
+
+
+async def daily_counts(conn: aiosqlite.Connection, tenant_id: str, since: date) -> Dict[str, Dict[str, int]]:
+    """{день: {метрика: счётчик}} начиная с since."""
+    cursor = await conn.execute(
+        "SELECT day, metric, count FROM daily_stats WHERE tenant_id = ? AND day >= ? ORDER BY day",
+        (tenant_id, since.isoformat())
+    )
+    days: Dict[str, Dict[str, int]] = {}
+    for day, metric, count in await cursor.fetchall():
+        days.setdefault(day, {})[metric] = count
+    return days
+
+
+def _totals(days: Dict[str, Dict[str, int]], since: date) -> Counter:
+    totals = Counter()
+    for day, counts in days.items():
+        if day >= since.isoformat():
+            totals.update(counts)
+    return totals
+
+
+def render_stats(days: Dict[str, Dict[str, int]], today: date) -> str:
+    periods = {title: _totals(days, today - timedelta(days=n - 1)) for title, n in PERIODS.items()}
+    lines = ["📊 Статистика", "", " / ".join(PERIODS)]
+    for metric, label in METRIC_LABELS.items():
+        lines.append(f"{label}: " + " / ".join(str(totals[metric]) for totals in periods.values()))
+
+    month = list(periods.values())[-1]
+    lines += ["", f"Конверсия за {HISTORY_DAYS} дней:"]
+    for previous, metric in zip(FUNNEL, FUNNEL[1:]):
+        share = f"{month[metric] / month[previous]:.0%}" if month[previous] else "—"
+        lines.append(f"{METRIC_LABELS[previous]} → {METRIC_LABELS[metric].lower()}: {share}")
+
+    lines += ["", "По дням (открыли / записались / оплачено):"]
+    for offset in range(DAILY_ROWS):
+        day = today - timedelta(days=offset)
+        counts = days.get(day.isoformat(), {})
+        lines.append(
+            f"{day:%d.%m} — {counts.get('started', 0)} / {counts.get('booked', 0)} / {counts.get('paid', 0)}"
+        )
+    return "\n".join(lines)
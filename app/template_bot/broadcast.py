@@ -0,0 +1,215 @@
+"""Рассылки админа по таблице users.
+
+Получатели читаются страницами по первичному ключу (keyset), сообщения уходят
+с ограничением скорости в фоновой задаче. Каждая доставка записывается вместе
+со сдвигом last_user_id одной транзакцией, и после перезапуска рассылка
+продолжается со следующего пользователя. Повторно сообщение может получить
+только тот единственный пользователь, отправка которому совпала с жёстким
+убийством процесса (сообщение ушло, запись не успела).
+"""
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster:
+    def __init__(self, bot: Bot, rate: float = 25, page_size: int = 500, progress_interval: float = 5,
+                 exclude: Iterable[int] = ()):
+        self.bot = bot
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.tenant_id = ""
+        self.interval = 1 / rate
+        self.page_size = page_size
+        # Админы рассылку не получают — ни отправивший, ни остальные
+        self.exclude = sorted(set(exclude))
+        self.progress_interval = progress_interval
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self._next_send = 0.0
+        self._stopping = False
+
+    def attach(self, conn: aiosqlite.Connection, tenant_id: str):
+        self.conn = conn
+        self.tenant_id = tenant_id
+
+    def _excluded(self, admin_id: int) -> Tuple[str, list]:
+        ids = sorted({admin_id, *self.exclude})
+        return f"id NOT IN ({', '.join('?' * len(ids))})", ids
+
+    async def start(self, admin_id: int, text: str) -> int:
+        condition, params = self._excluded(admin_id)
+        cursor = await self.conn.execute(
+            f"SELECT COUNT(*) FROM users WHERE tenant_id = ? AND {condition}", (self.tenant_id, *params)
+        )
+        (total,) = await cursor.fetchone()
+        cursor = await self.conn.execute(
+            "INSERT INTO broadcasts (tenant_id, admin_id, text, total, created_at) VALUES (?, ?, ?, ?, ?)",
+            (self.tenant_id, admin_id, text, total, datetime.now().isoformat(timespec="seconds"))
+        )
+        await self.conn.commit()
+        self._spawn(cursor.lastrowid)
+        return cursor.lastrowid
+
+    async def resume(self):
+        """Продолжает рассылки, прерванные перезапуском бота."""
+        cursor = await self.conn.execute(
+            "SELECT id FROM broadcasts WHERE tenant_id = ? AND status = 'running'", (self.tenant_id,)
+        )
+        for (broadcast_id,) in await cursor.fetchall():
+            logger.info(f"Продолжаю рассылку #{broadcast_id} с чекпоинта")
+            self._spawn(broadcast_id)
+
+    async def cancel(self, broadcast_id: int):
+        await self.conn.execute(
+            "UPDATE broadcasts SET status = 'cancelled', finished_at = ? "
+            "WHERE tenant_id = ? AND id = ? AND status = 'running'",
+            (datetime.now().isoformat(timespec="seconds"), self.tenant_id, broadcast_id)
+        )
+        await self.conn.commit()
+        task = self.tasks.get(broadcast_id)
+        if task:
+            task.cancel()
+
+    async def stop(self, timeout: float = 0):
+        """Останавливает фоновые задачи; статус остаётся running, чтобы продолжить после старта.
+
+        Рассылки сначала дожидаются ответа на уже отправленное сообщение и записывают
+        его; не успевшие за timeout отменяются.
+        """
+        self._stopping = True
+        tasks = list(self.tasks.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=max(timeout, 0))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, broadcast_id: int):
+        task = asyncio.create_task(self._run(broadcast_id))
+        self.tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast_id, None))
+
+    async def _load(self, broadcast_id: int) -> dict:
+        cursor = await self.conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+        row = await cursor.fetchone()
+        keys = [column[0] for column in cursor.description]
+        return dict(zip(keys, row))
+
+    async def _recipients(self, admin_id: int, after_user_id: int) -> List[int]:
+        condition, params = self._excluded(admin_id)
+        cursor = await self.conn.execute(
+            f"SELECT id FROM users WHERE tenant_id = ? AND id > ? AND {condition} ORDER BY id LIMIT ?",
+            (self.tenant_id, after_user_id, *params, self.page_size)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+    async def _throttle(self):
+        now = time.monotonic()
+        if self._next_send > now:
+            await asyncio.sleep(self._next_send - now)
+        self._next_send = max(now, self._next_send) + self.interval
+
+    async def _deliver(self, user_id: int, text: str) -> Tuple[str, Optional[str]]:
+        while True:
+            await self._throttle()
+            try:
+                await self.bot.send_message(user_id, text)
+                return "delivered", None
+            except TelegramRetryAfter as e:
+                # Флуд-контроль Telegram: ждём сколько сказали и повторяем этому же пользователю
+                self._next_send = time.monotonic() + e.retry_after
+            except TelegramForbiddenError as e:
+                return "blocked", e.message
+            except TelegramBadRequest as e:
+                return "failed", e.message
+            except Exception as e:
+                return "failed", str(e)
+
+    async def _record(self, broadcast_id: int, user_id: int, status: str, error: Optional[str]):
+        """Записывает доставку и сдвигает last_user_id одной транзакцией — сразу после отправки."""
+        await self.conn.execute(
+            "INSERT OR REPLACE INTO broadcast_deliveries (tenant_id, broadcast_id, user_id, status, error) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (self.tenant_id, broadcast_id, user_id, status, error)
+        )
+        await self.conn.execute(f"""
+            UPDATE broadcasts SET last_user_id = ?, {status} = {status} + 1 WHERE id = ?
+        """, (user_id, broadcast_id))
+        await self.conn.commit()
+
+    async def _report(self, broadcast_id: int):
+        row = await self._load(broadcast_id)
+        done = row["delivered"] + row["blocked"] + row["failed"]
+        title = {
+            "running": "📨 Рассылка идёт",
+            "done": "✅ Рассылка завершена",
+            "cancelled": "⏹ Рассылка остановлена",
+        }.get(row["status"], row["status"])
+        text = (
+            f"{title} #{broadcast_id}\n\n"
+            f"Обработано: {done} из {row['total']}\n"
+            f"Доставлено: {row['delivered']}\n"
+            f"Заблокировали бота: {row['blocked']}\n"
+            f"Ошибки: {row['failed']}"
+        )
+        markup = None
+        if row["status"] == "running":
+            markup = InlineKeyboardBuilder().button(
+                text="⏹ Остановить", callback_data=f"broadcast_stop_{broadcast_id}"
+            ).as_markup()
+        try:
+            if row["progress_message_id"]:
+                await self.bot.edit_message_text(
+                    text, chat_id=row["admin_id"], message_id=row["progress_message_id"], reply_markup=markup
+                )
+            else:
+                message = await self.bot.send_message(row["admin_id"], text, reply_markup=markup)
+                await self.conn.execute(
+                    "UPDATE broadcasts SET progress_message_id = ? WHERE id = ?", (message.message_id, broadcast_id)
+                )
+                await self.conn.commit()
+        except TelegramBadRequest:
+            # "message is not modified" и подобное — прогресс не критичен
+            pass
+
+    async def _run(self, broadcast_id: int):
+        row = await self._load(broadcast_id)
+        admin_id, text, last_user_id = row["admin_id"], row["text"], row["last_user_id"]
+        await self._report(broadcast_id)
+        reported_at = time.monotonic()
+        try:
+            while True:
+                page = await self._recipients(admin_id, last_user_id)
+                if not page:
+                    break
+                for user_id in page:
+                    if self._stopping:
+                        return
+                    status, error = await self._deliver(user_id, text)
+                    # Отмена здесь не прерывает запись: сообщение уже ушло, его нужно учесть
+                    await asyncio.shield(self._record(broadcast_id, user_id, status, error))
+                    last_user_id = user_id
+                    if time.monotonic() - reported_at >= self.progress_interval:
+                        await self._report(broadcast_id)
+                        reported_at = time.monotonic()
+
+            await self.conn.execute(
+                "UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ? AND status = 'running'",
+                (datetime.now().isoformat(timespec="seconds"), broadcast_id)
+            )
+            await self.conn.commit()
+            await self._report(broadcast_id)
+        except asyncio.CancelledError:
+            await self._report(broadcast_id)
+            raise
+        except Exception as e:
+            logger.exception(f"Рассылка #{broadcast_id} прервана: {e}")
@@ -0,0 +1,92 @@
+"""Каталог услуг бота из таблицы services.
+
+Каталог маленький, поэтому целиком держится в памяти: активные услуги и
+готовые inline-клавиатуры по языкам строятся один раз и сбрасываются при
+любом изменении каталога. В callback_data кнопки уходит только id услуги.
+"""
+from typing import Dict, List, Optional
+
+import aiosqlite
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+SERVICE_FIELDS = ("name_ru", "name_en", "duration_min", "price")
+
+
+def service_name(service: dict, language: str) -> str:
+    return (service["name_en"] if language == "en" else None) or service["name_ru"]
+
+
+def service_label(service: dict, language: str) -> str:
+    label = service_name(service, language)
+    if service["price"]:
+        label += f" — {service['price']}₽"
+    return label
+
+
+class ServiceCatalog:
+    def __init__(self):
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.tenant_id = ""
+        self._services: Optional[Dict[int, dict]] = None
+        self._keyboards: Dict[str, InlineKeyboardMarkup] = {}
+
+    def attach(self, conn: aiosqlite.Connection, tenant_id: str):
+        self.conn = conn
+        self.tenant_id = tenant_id
+
+    def invalidate(self):
+        self._services = None
+        self._keyboards.clear()
+
+    async def _load(self) -> Dict[int, dict]:
+        if self._services is None:
+            cursor = await self.conn.execute(
+                "SELECT id, name_ru, name_en, duration_min, price, active FROM services "
+                "WHERE tenant_id = ? ORDER BY position, id",
+                (self.tenant_id,)
+            )
+            keys = [column[0] for column in cursor.description]
+            self._services = {row[0]: dict(zip(keys, row)) for row in await cursor.fetchall()}
+        return self._services
+
+    async def all(self) -> List[dict]:
+        return list((await self._load()).values())
+
+    async def get(self, service_id: int) -> Optional[dict]:
+        return (await self._load()).get(service_id)
+
+    async def keyboard(self, language: str) -> Optional[InlineKeyboardMarkup]:
+        """Клавиатура активных услуг; None, если услуг нет."""
+        if language not in self._keyboards:
+            services = [s for s in await self.all() if s["active"]]
+            if not services:
+                return None
+            builder = InlineKeyboardBuilder()
+            for service in services:
+                builder.button(text=service_label(service, language), callback_data=f"service_{service['id']}")
+            builder.adjust(1)
+            self._keyboards[language] = builder.as_markup()
+        return self._keyboards[language]
+
+    async def add(self, name_ru: str, name_en: Optional[str], duration_min: Optional[int],
+                  price: Optional[int]) -> int:
+        cursor = await self.conn.execute(
+            "INSERT INTO services (tenant_id, name_ru, name_en, duration_min, price, position) "
+            "VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM services WHERE tenant_id = ?))",
+            (self.tenant_id, name_ru, name_en, duration_min, price, self.tenant_id)
+        )
+        await self.conn.commit()
+        self.invalidate()
+        return cursor.lastrowid
+
+    async def update(self, service_id: int, **fields) -> bool:
+        fields = {key: value for key, value in fields.items() if key in SERVICE_FIELDS + ("active",)}
+        set_clause = ", ".join(f"{key} = ?" for key in fields)
+        cursor = await self.conn.execute(
+            f"UPDATE services SET {set_clause} WHERE tenant_id = ? AND id = ?",
+            [*fields.values(), self.tenant_id, service_id]
+        )
+        await self.conn.commit()
+        self.invalidate()
+        return cursor.rowcount > 0
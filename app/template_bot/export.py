@@ -0,0 +1,123 @@
+"""Потоковая выгрузка таблиц бота в gzip CSV/JSONL.
+
+Строки читаются короткими запросами по rowid (keyset), так что ни таблица
+целиком, ни долгая читающая транзакция в памяти не держатся, а бот продолжает
+обрабатывать апдейты между порциями. Выгружаются только строки своего тенанта
+(TENANT_ID), сам столбец tenant_id в выгрузку не попадает.
+
+Из контейнера можно выгрузить напрямую в stdout (так делает backend):
+
+    python export.py users csv > users.csv.gz
+"""
+import io
+import os
+import csv
+import sys
+import gzip
+import json
+import asyncio
+import tempfile
+from typing import AsyncIterator, List, Sequence
+
+import aiosqlite
+
+EXPORT_TABLES = ("users", "slots", "bookings")
+EXPORT_FORMATS = ("csv", "jsonl")
+CHUNK_SIZE = 1000
+
+
+def _check(table: str, fmt: str):
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Таблица {table} не выгружается")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt}")
+
+
+def _query(table: str) -> str:
+    return f"SELECT rowid, * FROM {table} WHERE tenant_id = ? AND rowid > ? ORDER BY rowid LIMIT ?"
+
+
+def _split(description, rows: List[tuple]) -> tuple:
+    """(columns, rows) без rowid и tenant_id."""
+    names = [column[0] for column in description]
+    keep = [i for i, name in enumerate(names) if i > 0 and name != "tenant_id"]
+    return [names[i] for i in keep], [tuple(row[i] for i in keep) for row in rows]
+
+
+def encode_chunk(columns: Sequence[str], rows: List[tuple], fmt: str) -> bytes:
+    buffer = io.StringIO()
+    if fmt == "csv":
+        csv.writer(buffer).writerows(rows)
+    else:
+        for row in rows:
+            buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            buffer.write("\n")
+    return buffer.getvalue().encode()
+
+
+async def stream_rows(conn: aiosqlite.Connection, tenant_id: str, table: str,
+                      chunk_size: int = CHUNK_SIZE) -> AsyncIterator[tuple]:
+    """(columns, rows) порциями по chunk_size строк."""
+    last_rowid = 0
+    while True:
+        cursor = await conn.execute(_query(table), (tenant_id, last_rowid, chunk_size))
+        rows = await cursor.fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1][0]
+        yield _split(cursor.description, rows)
+
+
+async def iter_chunks(conn: aiosqlite.Connection, tenant_id: str, table: str, fmt: str,
+                      chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Несжатые куски выгрузки; заголовок CSV идёт первым и у пустой таблицы."""
+    _check(table, fmt)
+    if fmt == "csv":
+        cursor = await conn.execute(f"SELECT rowid, * FROM {table} LIMIT 0")
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(_split(cursor.description, [])[0])
+        yield buffer.getvalue().encode()
+    async for columns, rows in stream_rows(conn, tenant_id, table, chunk_size):
+        yield encode_chunk(columns, rows, fmt)
+
+
+async def export_table(conn: aiosqlite.Connection, tenant_id: str, table: str, fmt: str) -> str:
+    """Пишет выгрузку во временный .gz файл и возвращает путь к нему."""
+    _check(table, fmt)
+    fd, path = tempfile.mkstemp(prefix=f"{table}_", suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        with gzip.open(path, "wb") as gz:
+            async for chunk in iter_chunks(conn, tenant_id, table, fmt):
+                # Сжатие — работа для CPU, уводим его из event loop
+                await asyncio.to_thread(gz.write, chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+async def iter_export(db_path: str, tenant_id: str, table: str, fmt: str) -> AsyncIterator[bytes]:
+    """Вариант для CLI: своё соединение только на чтение, отдаёт уже сжатые куски gzip-потока."""
+    _check(table, fmt)
+    compressor = io.BytesIO()
+    async with aiosqlite.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        with gzip.GzipFile(fileobj=compressor, mode="wb") as gz:
+            async for chunk in iter_chunks(conn, tenant_id, table, fmt):
+                gz.write(chunk)
+                yield compressor.getvalue()
+                compressor.seek(0)
+                compressor.truncate()
+    yield compressor.getvalue()
+
+
+async def _cli(table: str, fmt: str):
+    async for piece in iter_export(os.getenv("DB_PATH", "bot_database.db"), os.getenv("TENANT_ID", ""), table, fmt):
+        sys.stdout.buffer.write(piece)
+    sys.stdout.buffer.flush()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(f"Использование: python export.py {{{'|'.join(EXPORT_TABLES)}}} {{{'|'.join(EXPORT_FORMATS)}}}")
+    asyncio.run(_cli(sys.argv[1], sys.argv[2]))
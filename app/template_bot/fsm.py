@@ -0,0 +1,92 @@
+"""Состояния FSM и данные сценариев в базе бота (таблица fsm_state).
+
+С MemoryStorage они пропадали при перезапуске: апдейт, прерванный остановкой
+и повторённый журналом (lifecycle.py), уже не попадал в свой обработчик, а
+корзина магазина обнулялась при каждом обновлении бота. Запись сразу уходит
+в базу; в памяти — только последние max_size ключей с непустым состоянием или
+данными (LRU), остальные читаются из базы.
+"""
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, max_size: int = 10_000):
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.tenant_id = ""
+        self.max_size = max_size
+        self._cache: "OrderedDict[str, Tuple[Optional[str], Dict[str, Any]]]" = OrderedDict()
+        self._writes = 0
+
+    def attach(self, conn: aiosqlite.Connection, tenant_id: str):
+        self.conn = conn
+        self.tenant_id = tenant_id
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id or "", key.business_connection_id or "", key.destiny
+        ))
+
+    def _remember(self, name: str, value: Tuple[Optional[str], Dict[str, Any]]):
+        self._cache[name] = value
+        self._cache.move_to_end(name)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: StorageKey) -> Tuple[str, Tuple[Optional[str], Dict[str, Any]]]:
+        name = self._key(key)
+        if name in self._cache:
+            self._cache.move_to_end(name)
+            return name, self._cache[name]
+        writes = self._writes
+        cursor = await self.conn.execute(
+            "SELECT state, data FROM fsm_state WHERE tenant_id = ? AND key = ?", (self.tenant_id, name)
+        )
+        row = await cursor.fetchone()
+        if not row:
+            # Пустое состояние не кэшируем: иначе в памяти осел бы каждый, кто хоть раз написал боту
+            return name, (None, {})
+        value = (row[0], json.loads(row[1]))
+        # Пока шёл запрос, могла пройти запись — тогда прочитанное уже устарело
+        if writes == self._writes:
+            self._remember(name, value)
+        return name, value
+
+    async def _save(self, name: str, state: Optional[str], data: Dict[str, Any]):
+        self._writes += 1
+        if state is None and not data:
+            self._cache.pop(name, None)
+            await self.conn.execute("DELETE FROM fsm_state WHERE tenant_id = ? AND key = ?", (self.tenant_id, name))
+        else:
+            self._remember(name, (state, data))
+            await self.conn.execute("""
+                INSERT INTO fsm_state (tenant_id, key, state, data) VALUES (?, ?, ?, ?)
+                ON CONFLICT (tenant_id, key) DO UPDATE SET state = excluded.state, data = excluded.data
+            """, (self.tenant_id, name, state, json.dumps(data, ensure_ascii=False)))
+        await self.conn.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name, (_, data) = await self._load(key)
+        await self._save(name, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, (state, _) = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name, (state, _) = await self._load(key)
+        await self._save(name, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, (_, data) = await self._load(key)
+        return data.copy()
+
+    async def close(self) -> None:
+        # Соединением владеет Database, оно закрывается в on_shutdown
+        pass
@@ -0,0 +1,140 @@
+"""Очередь отложенных задач: напоминания о записи и снятие неоплаченной брони.
+
+Задачи хранятся в SQLite (частичный индекс по due_at среди pending), а в памяти
+держится куча из ближайших `window` задач. Цикл спит ровно до срока ближайшей
+задачи и просыпается раньше, только если добавили задачу с более ранним сроком.
+"""
+import json
+import time
+import heapq
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[dict], Awaitable[None]]
+
+
+class JobQueue:
+    def __init__(self, window: int = 256):
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.tenant_id = ""
+        self.window = window
+        self.handlers: Dict[str, JobHandler] = {}
+        self._heap: List[tuple] = []
+        # Все pending-задачи со сроком <= _horizon гарантированно лежат в куче
+        self._horizon = float("-inf")
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def handler(self, kind: str):
+        def decorator(func: JobHandler) -> JobHandler:
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    async def start(self, conn: aiosqlite.Connection, tenant_id: str):
+        self.conn = conn
+        self.tenant_id = tenant_id
+        await self._reload()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 0):
+        """Даёт выполняющейся задаче завершиться за timeout, новые не берёт."""
+        if not self._task:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), max(timeout, 0))
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def schedule(self, kind: str, due_at: float, booking_id: Optional[int] = None,
+                       payload: Optional[dict] = None) -> int:
+        cursor = await self.conn.execute(
+            "INSERT INTO jobs (tenant_id, due_at, kind, booking_id, payload) VALUES (?, ?, ?, ?, ?)",
+            (self.tenant_id, due_at, kind, booking_id, json.dumps(payload) if payload else None)
+        )
+        await self.conn.commit()
+        job_id = cursor.lastrowid
+        if due_at <= self._horizon:
+            heapq.heappush(self._heap, (due_at, job_id, kind, booking_id, payload))
+            if self._heap[0][1] == job_id:
+                self._wakeup.set()
+        return job_id
+
+    async def cancel_for_booking(self, booking_id: int, kinds: Optional[Iterable[str]] = None):
+        query = "UPDATE jobs SET status = 'cancelled' WHERE tenant_id = ? AND booking_id = ? AND status = 'pending'"
+        params: list = [self.tenant_id, booking_id]
+        if kinds:
+            kinds = list(kinds)
+            query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params += kinds
+        await self.conn.execute(query, params)
+        await self.conn.commit()
+
+        before = len(self._heap)
+        self._heap = [
+            job for job in self._heap
+            if not (job[3] == booking_id and (kinds is None or job[2] in kinds))
+        ]
+        if len(self._heap) != before:
+            heapq.heapify(self._heap)
+            self._wakeup.set()
+
+    async def pending_count(self) -> int:
+        cursor = await self.conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE tenant_id = ? AND status = 'pending'", (self.tenant_id,)
+        )
+        (count,) = await cursor.fetchone()
+        return count
+
+    async def _reload(self):
+        cursor = await self.conn.execute(
+            "SELECT due_at, id, kind, booking_id, payload FROM jobs WHERE tenant_id = ? AND status = 'pending' "
+            "ORDER BY due_at LIMIT ?",
+            (self.tenant_id, self.window)
+        )
+        rows = await cursor.fetchall()
+        self._heap = [
+            (due_at, job_id, kind, booking_id, json.loads(payload) if payload else None)
+            for due_at, job_id, kind, booking_id, payload in rows
+        ]
+        heapq.heapify(self._heap)
+        # Если загрузили не всё окно — в базе больше ничего нет, новые задачи сразу идут в кучу
+        self._horizon = rows[-1][0] if len(rows) == self.window else float("inf")
+
+    async def _run(self):
+        while not self._stopping:
+            if not self._heap and self._horizon != float("inf"):
+                await self._reload()
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due_at, job_id, kind, booking_id, payload = heapq.heappop(self._heap)
+            status = "done"
+            try:
+                handler = self.handlers[kind]
+                await handler({"id": job_id, "kind": kind, "booking_id": booking_id,
+                               "payload": payload, "due_at": due_at})
+            except Exception as e:
+                status = "failed"
+                logger.exception(f"Задача {kind} #{job_id} завершилась ошибкой: {e}")
+            await self.conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+            await self.conn.commit()
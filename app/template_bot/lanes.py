@@ -0,0 +1,111 @@
+"""Планировщик апдейтов: по порядку внутри чата, параллельно между чатами.
+
+aiogram запускает каждый апдейт отдельной задачей, и два быстрых нажатия
+одного пользователя гоняются за FSM и базой. ChatLanes — внешний middleware:
+апдейты одного чата проходят через его очередь (FIFO-замок) строго по одному,
+а разные чаты обрабатываются параллельно, но не больше `concurrency` сразу.
+Медленный обработчик задерживает только свой чат.
+
+Метрики (глубина очередей, время ожидания) отдаёт snapshot().
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+WAIT_SAMPLES = 1000
+
+
+def _percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+
+class _Lane:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        # asyncio.Lock отдаёт замок ждущим в порядке очереди — это и есть FIFO чата
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class ChatLanes(BaseMiddleware):
+    def __init__(self, concurrency: int = 32):
+        self.concurrency = concurrency
+        self.slots = asyncio.Semaphore(concurrency)
+        self.lanes: Dict[int, _Lane] = {}
+        self.waiting = 0
+        self.running = 0
+        self.processed = 0
+        self.peak_waiting = 0
+        # Ожидание в очереди своего чата и ожидание свободного слота, мс
+        self.lane_wait = deque(maxlen=WAIT_SAMPLES)
+        self.slot_wait = deque(maxlen=WAIT_SAMPLES)
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        context = data.get("event_context")
+        key = context and (context.chat_id or context.user_id)
+        if key is None:
+            return await self._run(handler, event, data)
+
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = _Lane()
+        lane.depth += 1
+        try:
+            await self._wait(lane.lock, self.lane_wait)
+            try:
+                return await self._run(handler, event, data)
+            finally:
+                lane.lock.release()
+        finally:
+            lane.depth -= 1
+            if not lane.depth:
+                del self.lanes[key]
+
+    async def _run(self, handler, event: Update, data: Dict[str, Any]) -> Any:
+        await self._wait(self.slots, self.slot_wait)
+        self.running += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.running -= 1
+            self.processed += 1
+            self.slots.release()
+
+    async def _wait(self, primitive, samples: deque):
+        """Захватывает замок или семафор, учитывая ожидание в метриках."""
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        started = time.perf_counter()
+        try:
+            await primitive.acquire()
+        finally:
+            self.waiting -= 1
+        samples.append((time.perf_counter() - started) * 1000)
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "waiting": self.waiting,
+            "peak_waiting": self.peak_waiting,
+            "active_chats": len(self.lanes),
+            "deepest_lane": max((lane.depth for lane in self.lanes.values()), default=0),
+            "processed": self.processed,
+            "lane_wait_ms": {"p50": _percentile(self.lane_wait, 0.5), "p99": _percentile(self.lane_wait, 0.99),
+                             "max": round(max(self.lane_wait, default=0.0), 1)},
+            "slot_wait_ms": {"p50": _percentile(self.slot_wait, 0.5), "p99": _percentile(self.slot_wait, 0.99),
+                             "max": round(max(self.slot_wait, default=0.0), 1)},
+        }
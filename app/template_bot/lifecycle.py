@@ -0,0 +1,155 @@
+"""Мягкая остановка бота без потерь и повторов апдейтов.
+
+aiogram подтверждает пачку апдейтов следующим getUpdates сразу, не дожидаясь
+обработчиков, поэтому Telegram не пришлёт заново апдейт, прерванный остановкой,
+а пачка, полученная прямо перед остановкой, наоборот может прийти повторно.
+UpdateJournal — внешний middleware на апдейты: он знает, какие апдейты ещё
+обрабатываются, и ждёт их при остановке. Не успевшие к дедлайну сохраняются
+в bot_state целиком и запускаются снова после старта, а граница обработанных
+(offset) и обработанные выше неё позволяют пропустить повторно пришедшие.
+Состояния FSM хранятся в базе (fsm.py), так что повтор попадает в тот же
+обработчик; запись и уведомление админов он не дублирует (create_booking).
+"""
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+import aiosqlite
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = "updates"
+# После недели без апдейтов Telegram начинает нумерацию update_id заново
+UPDATE_ID_RESET_AFTER = 6 * 24 * 3600
+
+
+async def drain_tasks(tasks: Iterable[asyncio.Task], timeout: float) -> int:
+    """Ждёт задачи до таймаута, оставшиеся отменяет. Возвращает число отменённых."""
+    tasks = [task for task in tasks if not task.done()]
+    if not tasks:
+        return 0
+    _, pending = await asyncio.wait(tasks, timeout=max(timeout, 0))
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return len(pending)
+
+
+class UpdateJournal(BaseMiddleware):
+    def __init__(self):
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.tenant_id = ""
+        self.offset = 0  # все апдейты с update_id <= offset обработаны
+        self.done: Set[int] = set()  # обработанные апдейты выше offset
+        self.in_flight: Dict[int, asyncio.Task] = {}
+        self.interrupted: Dict[int, Update] = {}  # прерваны остановкой, запускаются заново после старта
+        self.last_seen = 0
+        self.updated_at = 0.0
+        self._replays: Set[asyncio.Task] = set()
+
+    async def load(self, conn: aiosqlite.Connection, tenant_id: str):
+        self.conn = conn
+        self.tenant_id = tenant_id
+        cursor = await conn.execute(
+            "SELECT value FROM bot_state WHERE tenant_id = ? AND key = ?", (tenant_id, STATE_KEY)
+        )
+        row = await cursor.fetchone()
+        if row:
+            state = json.loads(row[0])
+            self.offset, self.done, self.updated_at = state["offset"], set(state["done"]), state["updated_at"]
+            for data in state["interrupted"]:
+                update = Update.model_validate(data)
+                self.interrupted[update.update_id] = update
+
+    def replay(self, dispatcher: Dispatcher, bot: Bot):
+        """Запускает апдейты, прерванные прошлой остановкой."""
+        if self.interrupted:
+            logger.info(f"Повторяю {len(self.interrupted)} апдейтов, прерванных остановкой")
+        for update in list(self.interrupted.values()):
+            task = asyncio.create_task(self._feed(dispatcher, bot, update))
+            self._replays.add(task)
+            task.add_done_callback(self._replays.discard)
+
+    async def _feed(self, dispatcher: Dispatcher, bot: Bot, update: Update):
+        try:
+            await dispatcher.feed_update(bot, update)
+        except Exception as e:
+            logger.exception(f"Повтор апдейта {update.update_id} завершился ошибкой: {e}")
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        update_id = event.update_id
+        if time.time() - self.updated_at > UPDATE_ID_RESET_AFTER:
+            self.offset, self.done = 0, set()
+        if update_id <= self.offset or update_id in self.done or update_id in self.in_flight:
+            logger.info(f"Апдейт {update_id} уже обработан, пропускаю")
+            return None
+
+        self.last_seen = max(self.last_seen, update_id)
+        self.interrupted.pop(update_id, None)
+        self.in_flight[update_id] = asyncio.current_task()
+        processed = True
+        try:
+            return await handler(event, data)
+        except asyncio.CancelledError:
+            processed = False
+            self.interrupted[update_id] = event
+            raise
+        finally:
+            del self.in_flight[update_id]
+            if processed:
+                self.done.add(update_id)
+                self.updated_at = time.time()
+            self._compact()
+
+    def _compact(self):
+        """Сдвигает offset до первого незавершённого апдейта."""
+        unfinished = self.in_flight.keys() | self.interrupted.keys()
+        if unfinished:
+            limit = min(unfinished) - 1
+        else:
+            limit = max(self.done, default=self.offset)
+        if limit > self.offset:
+            self.offset = limit
+            self.done = {update_id for update_id in self.done if update_id > limit}
+
+    async def drain(self, timeout: float) -> int:
+        """Дожидается начатых обработчиков; возвращает число прерванных по таймауту."""
+        if self.in_flight:
+            logger.info(f"Дожидаюсь обработки {len(self.in_flight)} апдейтов")
+        return await drain_tasks([*self.in_flight.values(), *self._replays], timeout)
+
+    async def save(self):
+        self._compact()
+        state = {
+            "offset": self.offset,
+            "done": sorted(self.done),
+            "updated_at": self.updated_at,
+            "interrupted": [
+                update.model_dump(mode="json", by_alias=True, exclude_none=True)
+                for update in self.interrupted.values()
+            ],
+        }
+        await self.conn.execute(
+            "INSERT OR REPLACE INTO bot_state (tenant_id, key, value) VALUES (?, ?, ?)",
+            (self.tenant_id, STATE_KEY, json.dumps(state))
+        )
+        await self.conn.commit()
+
+    async def confirm(self, bot: Bot):
+        """Подтверждает Telegram всё полученное: прерванное повторим сами из bot_state."""
+        if not self.last_seen:
+            return
+        try:
+            await bot.get_updates(offset=self.last_seen + 1, limit=1, timeout=0)
+        except Exception as e:
+            # Не страшно: повторно пришедшие апдейты отсеет сохранённый журнал
+            logger.warning(f"Не удалось подтвердить апдейты до {self.last_seen}: {e}")
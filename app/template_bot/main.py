@@ -1,18 +1,43 @@
+import time
+
+_STARTED_AT = time.perf_counter()
+
 import os
+import re
+import json
 import asyncio
 import logging
-from datetime import datetime
-from typing import Optional, List
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Optional, List, Any, Awaitable, Callable, Dict
 
 import aiosqlite
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram import Bot, Dispatcher, BaseMiddleware, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
-from aiogram.enums import ParseMode
 from dotenv import load_dotenv
 
+from analytics import HISTORY_DAYS, daily_counts, render_stats, set_utc_offset
+from broadcast import Broadcaster
+from catalog import SERVICE_FIELDS, ServiceCatalog
+from export import EXPORT_FORMATS, EXPORT_TABLES, export_table
+from fsm import SQLiteStorage
+from jobs import JobQueue
+from lanes import ChatLanes
+from lifecycle import UpdateJournal, drain_tasks
+from media_cache import MediaCache
+from referrals import leaderboard, parse_referrer, referral_link, set_bonus
+from migrations import migrate
+from schema import MIGRATIONS, POOL_MIGRATIONS, POOL_SEED
+from shop import MAX_QUANTITY, PRODUCT_FIELDS, ProductCatalog, cart_context, product_card, render_cart
+from schedule import (
+    ScheduleError, expand_rule, format_slots, is_rule, parse_csv, parse_ics, parse_legacy_lines, parse_rule
+)
+from throttle import UserThrottle
+
 load_dotenv()
 
 logging.basicConfig(
@@ -28,15 +53,89 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_IDS = list(map(int, os.getenv('ADMIN_IDS').split(',')))
 DB_PATH = os.getenv('DB_PATH', 'bot_database.db')
+# Задан — DB_PATH общая база всех ботов (TENANT_STORAGE=pooled), строки этого бота помечены его id
+TENANT_ID = os.getenv('TENANT_ID', '')
 REVIEWS_CHAT_LINK = os.getenv('REVIEWS_CHAT_LINK', 'https://t.me/your_reviews_chat')
+MAX_UPDATES_PER_SECOND = float(os.getenv('MAX_UPDATES_PER_SECOND', '0'))
+# Темп рассылок: ниже лимита Telegram (~30 сообщений/с), чтобы оставался запас на обычные ответы
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '20'))
+# Часовой пояс, в котором админ вводит окна, — от него считаются напоминания
+TIMEZONE = ZoneInfo(os.getenv('TIMEZONE', 'Europe/Moscow'))
+# Сколько минут подтверждённая запись ждёт оплату, прежде чем окно освободится
+HOLD_MINUTES = int(os.getenv('HOLD_MINUTES', '60'))
+REMINDER_HOURS = (24, 1)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+# Файл готовности: по нему HEALTHCHECK контейнера и backend понимают, что бот начал принимать апдейты
+READY_FILE = os.getenv('READY_FILE', '/tmp/bot_ready')
+# Сколько секунд после SIGTERM даётся на доработку апдейтов, рассылок и задач (docker stop ждёт дольше)
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '10'))
+# Сколько апдейтов разных чатов обрабатывается одновременно; апдейты одного чата идут строго по очереди
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+# Метрики очередей и антифлуда: бот перезаписывает файл раз в METRICS_INTERVAL, backend читает его из контейнера
+METRICS_FILE = os.getenv('METRICS_FILE', '/tmp/bot_metrics.json')
+METRICS_INTERVAL = 5
+# Бонус пригласившему (₽) за первую оплату приглашённого; 0 — считаем только приглашения
+REFERRAL_BONUS = int(os.getenv('REFERRAL_BONUS', '0'))
+# Онлайн-оплата заказов магазина через ЮKassa; без магазина заказ принимается, а об оплате договаривается админ
+YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID')
+
+DEFAULT_SLOTS = ["21.05 12:00", "21.05 15:00", "22.05 18:30"]
+BOOKINGS_PAGE_SIZE = 10
+# Окон в клавиатуре записи за раз: Telegram не принимает клавиатуру больше чем из 100 кнопок
+SLOTS_PAGE_SIZE = 10
+SEARCH_PAGE_SIZE = 10
+
+BOOKING_STATUSES = {
+    "pending": "⏳ ждёт подтверждения",
+    "confirmed": "📝 ждёт оплаты",
+    "paid": "✅ оплачено",
+    "cancelled": "❌ отменено",
+}
+
+startup_phases: Dict[str, float] = {"imports_ms": round((time.perf_counter() - _STARTED_AT) * 1000, 1)}
 
 payment_context = {}  # user_id -> {slot, service, prepayment}
 
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+)
+# Состояния сценариев и корзина живут в базе бота и переживают перезапуск
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
 
 
+class UpdateRateLimiter(BaseMiddleware):
+    """Ограничивает темп обработки апдейтов квотой тарифа (token bucket).
+
+    Лишние апдейты не отбрасываются, а ждут своей очереди.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.burst = max(rate, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.updated = time.monotonic()
+            self.tokens -= 1
+        return await handler(event, data)
+
+
 class Form(StatesGroup):
     language = State()
     name = State()
@@ -50,40 +149,51 @@ class Form(StatesGroup):
 
 class AdminForm(StatesGroup):
     add_slots = State()
+    bookings_date = State()
+    broadcast = State()
+    search = State()
 
 
 class Database:
-    def __init__(self, path: str):
+    """База бота: своя (tenant_id пустой) или общая для всех ботов, где все запросы ограничены tenant_id."""
+
+    def __init__(self, path: str, tenant_id: str = ""):
         self.path = path
+        self.tenant_id = tenant_id
         self.conn: Optional[aiosqlite.Connection] = None
+        self.created = False
+
+    @property
+    def pooled(self) -> bool:
+        return bool(self.tenant_id)
 
     async def connect(self):
-        self.conn = await aiosqlite.connect(self.path)
-        await self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY,
-                language TEXT NOT NULL,
-                name TEXT,
-                phone TEXT,
-                gender TEXT,
-                birth_date TEXT,
-                registered INTEGER DEFAULT 0
-            )
-        """)
+        # В общей базе пишут все боты по очереди — ждём блокировку дольше стандартных 5 с
+        self.conn = await aiosqlite.connect(self.path, timeout=30 if self.pooled else 5)
+        # WAL: выгрузки и отчёты бэкенда читают базу, не блокируя запись бота
+        await self.conn.execute("PRAGMA journal_mode = WAL")
+        if self.pooled:
+            before, after = await migrate(self.conn, POOL_MIGRATIONS)
+            # Новый бот в общей базе — у него ещё нет ни одной строки состояния
+            cursor = await self.conn.execute("SELECT 1 FROM bot_state WHERE tenant_id = ? LIMIT 1", (self.tenant_id,))
+            self.created = await cursor.fetchone() is None
+            if self.created:
+                for statement in POOL_SEED:
+                    await self.conn.execute(statement, {"tenant_id": self.tenant_id})
+                await self.conn.commit()
+        else:
+            cursor = await self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'")
+            self.created = await cursor.fetchone() is None
+            before, after = await migrate(self.conn, MIGRATIONS)
+        if after != before:
+            logger.info(f"Схема БД обновлена: версия {before} -> {after}")
+
+    async def add_user(self, user_id: int, language: str, referrer: Optional[int] = None):
+        # Пригласивший записывается, только если он уже есть в базе; связь и счётчики дописывают триггеры
         await self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS slots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                datetime TEXT NOT NULL,
-                available INTEGER DEFAULT 1
-            )
-        """)
-        await self.conn.commit()
-
-    async def add_user(self, user_id: int, language: str):
-        await self.conn.execute(
-            "INSERT OR IGNORE INTO users (id, language) VALUES (?, ?)",
-            (user_id, language)
-        )
+            INSERT OR IGNORE INTO users (tenant_id, id, language, referred_by)
+            VALUES (?, ?, ?, (SELECT id FROM users WHERE tenant_id = ? AND id = ?))
+        """, (self.tenant_id, user_id, language, self.tenant_id, referrer))
         await self.conn.commit()
 
     async def update_user(self, user_id: int, **kwargs):
@@ -91,57 +201,212 @@ class Database:
         values = list(kwargs.values())
         set_clause = ", ".join([f"{k} = ?" for k in keys])
         await self.conn.execute(
-            f"UPDATE users SET {set_clause} WHERE id = ?",
-            values + [user_id]
+            f"UPDATE users SET {set_clause} WHERE tenant_id = ? AND id = ?",
+            values + [self.tenant_id, user_id]
         )
         await self.conn.commit()
 
     async def get_user(self, user_id: int) -> Optional[dict]:
-        cursor = await self.conn.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+        cursor = await self.conn.execute(
+            "SELECT * FROM users WHERE tenant_id = ? AND id = ?", (self.tenant_id, user_id)
+        )
         row = await cursor.fetchone()
         if row:
             keys = [column[0] for column in cursor.description]
             return dict(zip(keys, row))
         return None
 
-    async def add_slots(self, slots: List[str]):
-        current_year = datetime.now().year
-        formatted_slots = []
-
-        for slot in slots:
-            slot = slot.strip()
-            if not slot:
-                continue
-
-            try:
-                dt = datetime.strptime(slot, "%d.%m %H:%M")
-                dt = dt.replace(year=current_year)
-                formatted_slots.append(dt.strftime("%d.%m.%Y %H:%M"))
-            except ValueError:
-                continue
-
-        if formatted_slots:
-            for slot in formatted_slots:
-                await self.conn.execute(
-                    "INSERT INTO slots (datetime, available) VALUES (?, ?)",
-                    (slot, 1)
-                )
-            await self.conn.commit()
-            return len(formatted_slots)
-        return 0
-
-    async def get_available_slots(self) -> List[dict]:
+    async def add_slots(self, slots: List[str]) -> int:
+        return await self.insert_slots(parse_legacy_lines(slots, datetime.now().year))
+
+    async def insert_slots(self, slots: List[datetime]) -> int:
+        """Вставляет окна одной пачкой; уже существующие отсекает уникальный индекс по времени."""
+        if not slots:
+            return 0
+        before = self.conn.total_changes
+        await self.conn.executemany(
+            "INSERT OR IGNORE INTO slots (tenant_id, datetime, slot_at, available) VALUES (?, ?, ?, 1)",
+            [(self.tenant_id, text, slot.strftime("%Y-%m-%d %H:%M"))
+             for text, slot in zip(format_slots(slots), slots)]
+        )
+        await self.conn.commit()
+        return self.conn.total_changes - before
+
+    async def get_available_slots(self, limit: int, offset: int = 0) -> List[dict]:
+        """Свободные окна, ещё не наступившие по часам бота, в порядке времени."""
         cursor = await self.conn.execute(
-            "SELECT id, datetime FROM slots WHERE available = 1 ORDER BY datetime"
+            "SELECT id, datetime FROM slots WHERE tenant_id = ? AND available = 1 AND slot_at >= ? "
+            "ORDER BY slot_at, id LIMIT ? OFFSET ?",
+            (self.tenant_id, datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M"), limit, offset)
         )
         rows = await cursor.fetchall()
         return [{"id": row[0], "datetime": row[1]} for row in rows]
 
+    async def create_booking(self, user_id: int, slot_id: int, service: str, anamnesis: Optional[str] = None,
+                             update_id: Optional[int] = None) -> Optional[dict]:
+        """Занимает окно и создаёт запись одной транзакцией: {"id", "notified"}. None — окно уже занято.
+
+        Повтор апдейта update_id (после прерванной остановки) возвращает уже созданную им запись.
+        """
+        if update_id is not None:
+            cursor = await self.conn.execute("""
+                SELECT id, notified_at FROM bookings
+                WHERE tenant_id = ? AND update_id = ? AND user_id = ? AND slot_id = ?
+            """, (self.tenant_id, update_id, user_id, slot_id))
+            row = await cursor.fetchone()
+            if row:
+                return {"id": row[0], "notified": row[1] is not None}
+        cursor = await self.conn.execute(
+            "UPDATE slots SET available = 0 WHERE tenant_id = ? AND id = ? AND available = 1",
+            (self.tenant_id, slot_id)
+        )
+        if cursor.rowcount == 0:
+            await self.conn.rollback()
+            return None
+        cursor = await self.conn.execute("""
+            INSERT INTO bookings (tenant_id, user_id, slot_id, service, status, slot_at, created_at, anamnesis,
+                                  update_id)
+            SELECT tenant_id, ?, id, ?, 'pending', slot_at, ?, ?, ?
+            FROM slots WHERE tenant_id = ? AND id = ?
+        """, (user_id, service, datetime.now().isoformat(timespec="seconds"), anamnesis, update_id,
+              self.tenant_id, slot_id))
+        await self.conn.commit()
+        return {"id": cursor.lastrowid, "notified": False}
+
+    async def mark_booking_notified(self, booking_id: int):
+        await self.conn.execute(
+            "UPDATE bookings SET notified_at = ? WHERE tenant_id = ? AND id = ?",
+            (datetime.now().isoformat(timespec="seconds"), self.tenant_id, booking_id)
+        )
+        await self.conn.commit()
+
+    async def set_booking_status(self, user_id: int, status: str, from_statuses: List[str],
+                                 slot_id: Optional[int] = None) -> Optional[dict]:
+        """Переводит последнюю подходящую запись клиента в новый статус; отмена освобождает окно."""
+        query = f"""
+            SELECT id, slot_id, slot_at, service FROM bookings
+            WHERE tenant_id = ? AND user_id = ? AND status IN ({", ".join("?" * len(from_statuses))})
+        """
+        params = [self.tenant_id, user_id, *from_statuses]
+        if slot_id is not None:
+            query += " AND slot_id = ?"
+            params.append(slot_id)
+        cursor = await self.conn.execute(query + " ORDER BY id DESC LIMIT 1", params)
+        row = await cursor.fetchone()
+        if not row:
+            return None
+        booking_id, booked_slot_id, slot_at, service = row
+        await self.conn.execute("UPDATE bookings SET status = ? WHERE id = ?", (status, booking_id))
+        if status == "cancelled":
+            await self.conn.execute(
+                "UPDATE slots SET available = 1 WHERE tenant_id = ? AND id = ?", (self.tenant_id, booked_slot_id)
+            )
+        await self.conn.commit()
+        return {"id": booking_id, "user_id": user_id, "slot_id": booked_slot_id,
+                "slot_at": slot_at, "service": service, "status": status}
+
+    async def get_booking(self, booking_id: int) -> Optional[dict]:
+        cursor = await self.conn.execute(
+            "SELECT * FROM bookings WHERE tenant_id = ? AND id = ?", (self.tenant_id, booking_id)
+        )
+        row = await cursor.fetchone()
+        if row:
+            keys = [column[0] for column in cursor.description]
+            return dict(zip(keys, row))
+        return None
+
+    def _bookings_filter(self, day: Optional[str], service: Optional[str]) -> tuple:
+        clauses = ["b.tenant_id = ?", "b.status != 'cancelled'"]
+        params: list = [self.tenant_id]
+        if day:
+            next_day = (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+            clauses.append("b.slot_at >= ? AND b.slot_at < ?")
+            params += [day, next_day]
+        else:
+            clauses.append("b.slot_at >= ?")
+            params.append(datetime.now().strftime("%Y-%m-%d"))
+        if service:
+            clauses.append("b.service = ?")
+            params.append(service)
+        return " AND ".join(clauses), params
+
+    async def list_bookings(self, day: Optional[str] = None, service: Optional[str] = None,
+                            limit: int = BOOKINGS_PAGE_SIZE, offset: int = 0) -> List[dict]:
+        where, params = self._bookings_filter(day, service)
+        cursor = await self.conn.execute(f"""
+            SELECT b.id, b.slot_at, b.service, b.status, u.name, u.phone
+            FROM bookings b LEFT JOIN users u ON u.tenant_id = b.tenant_id AND u.id = b.user_id
+            WHERE {where}
+            ORDER BY b.slot_at, b.id
+            LIMIT ? OFFSET ?
+        """, params + [limit, offset])
+        keys = ["id", "slot_at", "service", "status", "name", "phone"]
+        return [dict(zip(keys, row)) for row in await cursor.fetchall()]
+
+    async def bookings_per_day(self, day: Optional[str] = None, service: Optional[str] = None,
+                               days: int = 14) -> List[tuple]:
+        """(день, всего, оплачено) по ближайшим дням с записями."""
+        where, params = self._bookings_filter(day, service)
+        cursor = await self.conn.execute(f"""
+            SELECT substr(b.slot_at, 1, 10) AS day, COUNT(*), SUM(b.status = 'paid')
+            FROM bookings b
+            WHERE {where}
+            GROUP BY day ORDER BY day
+            LIMIT ?
+        """, params + [days])
+        return await cursor.fetchall()
+
+    async def booked_services(self) -> List[str]:
+        cursor = await self.conn.execute(
+            "SELECT DISTINCT service FROM bookings WHERE tenant_id = ? AND service != '' ORDER BY service",
+            (self.tenant_id,)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+    @staticmethod
+    def _search_match(text: str) -> Optional[str]:
+        """Запрос FTS5 из строки админа: слова — по префиксу, цифры — префикс телефона."""
+        text = text.replace("ё", "е").replace("Ё", "Е")
+        terms = [f'"{word}"*' for word in re.findall(r"[^\W\d_]+", text)]
+        digits = "".join(re.findall(r"\d", text))
+        if digits:
+            terms.append(f'phone : "{digits}"*')
+        return " ".join(terms) or None
+
+    async def search_clients(self, text: str, limit: int, offset: int = 0) -> List[dict]:
+        """Клиенты по имени, телефону и анамнезам, лучшие совпадения первыми (имя весит больше заметок)."""
+        match = self._search_match(text)
+        if not match:
+            return []
+        cursor = await self.conn.execute("""
+            SELECT u.id, u.name, u.phone, snippet(clients_fts, 2, '«', '»', '…', 8) AS notes,
+                   (SELECT COUNT(*) FROM bookings b WHERE b.tenant_id = u.tenant_id AND b.user_id = u.id) AS bookings
+            FROM clients_fts JOIN users u ON u.rowid = clients_fts.rowid
+            WHERE clients_fts MATCH ? AND u.tenant_id = ?
+            ORDER BY bm25(clients_fts, 10.0, 5.0, 1.0)
+            LIMIT ? OFFSET ?
+        """, (match, self.tenant_id, limit, offset))
+        keys = [column[0] for column in cursor.description]
+        return [dict(zip(keys, row)) for row in await cursor.fetchall()]
+
     async def close(self):
+        # Фиксируем незакоммиченное и переносим WAL в основной файл, чтобы снимок базы был полным.
+        # Общую базу в это время читают и пишут другие боты — её WAL переносит сам SQLite
+        await self.conn.commit()
+        if not self.pooled:
+            await self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
         await self.conn.close()
 
 
-db = Database(DB_PATH)
+db = Database(DB_PATH, TENANT_ID)
+broadcaster = Broadcaster(bot, rate=BROADCAST_RATE, exclude=ADMIN_IDS)
+jobs = JobQueue()
+journal = UpdateJournal()
+lanes = ChatLanes(MAX_CONCURRENT_UPDATES)
+throttle = UserThrottle(exempt=ADMIN_IDS)
+catalog = ServiceCatalog()
+products = ProductCatalog()
+media = MediaCache()
 
 
 async def language_keyboard():
@@ -169,11 +434,18 @@ async def show_admin_menu(user_id: int):
     builder = ReplyKeyboardBuilder()
     builder.button(text="Добавить свободные окна")
     builder.button(text="Список записей")
+    builder.button(text="Рассылка")
+    builder.button(text="Экспорт данных")
+    builder.button(text="Услуги")
+    builder.button(text="Поиск клиентов")
+    builder.button(text="Статистика")
+    builder.button(text="Рефералы")
+    builder.button(text="Товары")
     markup = builder.as_markup(resize_keyboard=True)
     await bot.send_message(user_id, "Админ-панель:", reply_markup=markup)
 
 
-@dp.message(F.text.startswith("/start"))
+@dp.message(F.text.startswith("/start"), flags={"throttle": "start"})
 async def cmd_start(message: types.Message, state: FSMContext):
     try:
         user_id = message.from_user.id
@@ -188,7 +460,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
         if user and user.get("registered"):
             await show_main_menu(user_id, user['language'])
         else:
-            await db.add_user(user_id, language="ru")
+            await db.add_user(user_id, language="ru", referrer=parse_referrer(message.text))
             await state.set_state(Form.language)
             await message.answer("Выберите язык / Choose language:", reply_markup=await language_keyboard())
 
@@ -248,15 +520,190 @@ async def process_birth_date(message: types.Message, state: FSMContext):
                                                                               'language'] == "ru" else "Invalid date format. Try again.")
 
 
+async def user_language(user_id: int) -> str:
+    user = await db.get_user(user_id)
+    return user["language"] if user else "ru"
+
+
+async def show_screen(callback: types.CallbackQuery, text: str, markup: Optional[types.InlineKeyboardMarkup]):
+    """Меняет текст сообщения с кнопками; карточку с фото не редактируем, а отвечаем новым сообщением."""
+    if callback.message.photo:
+        await callback.message.answer(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+
 @dp.message(F.text.in_(["Магазин", "Shop"]))
-async def shop_coming_soon(message: types.Message):
-    await message.answer("Скоро тут будет магазин!" if message.text == "Магазин" else "Shop coming soon!")
+async def shop_menu(message: types.Message):
+    language = "ru" if message.text == "Магазин" else "en"
+    page = await products.page(language, 0)
+    if not page:
+        await message.answer("Товаров пока нет." if language == "ru" else "No products yet.")
+        return
+    text, markup = page
+    await message.answer(text, reply_markup=markup)
+
+
+@dp.callback_query(F.data.startswith("shop_page_"))
+async def shop_page(callback: types.CallbackQuery):
+    language = await user_language(callback.from_user.id)
+    page = await products.page(language, int(callback.data.rsplit("_", 1)[1]))
+    if not page:
+        await callback.answer("Товаров пока нет." if language == "ru" else "No products yet.")
+        return
+    await show_screen(callback, *page)
+
+
+@dp.callback_query(F.data.startswith("product_"))
+async def show_product(callback: types.CallbackQuery):
+    language = await user_language(callback.from_user.id)
+    product = await products.get(int(callback.data.split("_")[1]))
+    if not product or not product["active"]:
+        await callback.answer("Товар недоступен" if language == "ru" else "Product unavailable")
+        return
+    text, markup = product_card(product, language)
+    if product["photo"]:
+        await media.send_photo(bot, callback.message.chat.id, product["photo"], caption=text, reply_markup=markup)
+    elif product["photo_file_id"]:
+        await callback.message.answer_photo(product["photo_file_id"], caption=text, reply_markup=markup)
+    else:
+        await callback.message.answer(text, reply_markup=markup)
+    await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("cart_add_"))
+async def cart_add(callback: types.CallbackQuery, state: FSMContext):
+    language = await user_language(callback.from_user.id)
+    product = await products.get(int(callback.data.rsplit("_", 1)[1]))
+    if not product or not product["active"]:
+        await callback.answer("Товар недоступен" if language == "ru" else "Product unavailable")
+        return
+    cart = cart_context(state)
+    data = await cart.get_data()
+    key = str(product["id"])
+    data[key] = min(data.get(key, 0) + 1, MAX_QUANTITY)
+    await cart.set_data(data)
+    await callback.answer(f"В корзине: {data[key]} шт." if language == "ru" else f"In cart: {data[key]}")
+
+
+@dp.callback_query(F.data.in_({"cart", "cart_clear"}) | F.data.startswith("cart_del_"))
+async def cart_view(callback: types.CallbackQuery, state: FSMContext):
+    language = await user_language(callback.from_user.id)
+    cart = cart_context(state)
+    data = await cart.get_data()
+    if callback.data == "cart_clear":
+        data = {}
+    elif callback.data.startswith("cart_del_"):
+        key = callback.data.rsplit("_", 1)[1]
+        if data.get(key, 0) > 1:
+            data[key] -= 1
+        else:
+            data.pop(key, None)
+    if callback.data != "cart":
+        await cart.set_data(data)
+    text, markup = render_cart(*await products.cart_items(data, language), language)
+    if callback.data == "cart":
+        await callback.message.answer(text, reply_markup=markup)
+        await callback.answer()
+    else:
+        await show_screen(callback, text, markup)
+
+
+async def order_payment_link(order_id: int, total: int, user_id: int) -> Optional[str]:
+    if not YOOKASSA_SHOP_ID:
+        return None
+    # SDK ЮKassa нужен только для онлайн-оплаты — импортируем при первом заказе, а не на старте бота
+    from yookassa_api import create_payment_link
+    try:
+        url = await asyncio.to_thread(
+            create_payment_link, total, user_id, str(bot.id), f"Заказ #{order_id}",
+            f"https://t.me/{(await bot.me()).username}", {"order_id": str(order_id)}
+        )
+    except Exception as e:
+        logger.error(f"Не удалось создать платёж для заказа {order_id}: {e}")
+        return None
+    await products.set_payment_url(order_id, url)
+    return url
+
+
+@dp.callback_query(F.data == "checkout", flags={"throttle": "heavy"})
+async def checkout(callback: types.CallbackQuery, state: FSMContext):
+    user = await db.get_user(callback.from_user.id) or {"language": "ru", "name": None, "phone": None}
+    language = user["language"]
+    cart = cart_context(state)
+    items, total = await products.cart_items(await cart.get_data(), language)
+    if not items:
+        await show_screen(callback, *render_cart(items, total, language))
+        return
+    order_id = await products.create_order(callback.from_user.id, items, total)
+    await cart.set_data({})
+    url = await order_payment_link(order_id, total, callback.from_user.id)
+
+    if url:
+        text = (f"✅ Заказ #{order_id} на {total}₽ оформлен.\nОплатить: {url}" if language == "ru"
+                else f"✅ Order #{order_id} for {total}₽ placed.\nPay here: {url}")
+    else:
+        text = (f"✅ Заказ #{order_id} на {total}₽ оформлен. Администратор свяжется с вами для оплаты."
+                if language == "ru" else f"✅ Order #{order_id} for {total}₽ placed. We will contact you about payment.")
+    await show_screen(callback, text, None)
+
+    lines = "\n".join(f"• {item['name']} × {item['quantity']} = {item['price'] * item['quantity']}₽" for item in items)
+    client = ", ".join(filter(None, [user["name"], user["phone"]])) or str(callback.from_user.id)
+    payment = "ссылка на оплату отправлена" if url else "нужно договориться об оплате"
+    for admin_id in ADMIN_IDS:
+        await bot.send_message(
+            admin_id, f"🛍 Заказ #{order_id} от {client}:\n{lines}\nИтого: {total}₽ — {payment}",
+            reply_markup=InlineKeyboardBuilder()
+            .button(text="✅ Оплачен", callback_data=f"order_paid_{order_id}")
+            .button(text="❌ Отменить", callback_data=f"order_cancel_{order_id}")
+            .as_markup()
+        )
+
+
+@dp.callback_query(F.data.startswith(("order_paid_", "order_cancel_")))
+async def order_status(callback: types.CallbackQuery):
+    """Админ отмечает заказ оплаченным (онлайн или по договорённости) или отменяет его."""
+    if callback.from_user.id not in ADMIN_IDS:
+        return
+    action, order_id = callback.data.rsplit("_", 1)
+    paid = action == "order_paid"
+    order = await products.set_order_status(int(order_id), "paid" if paid else "cancelled")
+    if not order:
+        await callback.answer("Заказ уже оплачен или отменён.")
+        return
+    await callback.message.edit_text(callback.message.text + ("\n\n✅ Оплачен" if paid else "\n\n❌ Отменён"))
+    await callback.answer()
+
+    ru = await user_language(order["user_id"]) == "ru"
+    if paid:
+        text = (f"✅ Оплата заказа #{order['id']} получена, спасибо!" if ru
+                else f"✅ Payment for order #{order['id']} received, thank you!")
+    else:
+        text = f"❌ Заказ #{order['id']} отменён." if ru else f"❌ Order #{order['id']} has been cancelled."
+    try:
+        await bot.send_message(order["user_id"], text)
+    except Exception as e:
+        logger.warning(f"Не удалось уведомить клиента {order['user_id']} о заказе {order['id']}: {e}")
 
 
 @dp.message(F.text.in_(["Порекомендовать", "Recommend"]))
-async def referral_coming_soon(message: types.Message):
-    await message.answer(
-        "Скоро тут будет реферальная система!" if message.text == "Порекомендовать" else "Referral system coming soon!")
+async def referral_info(message: types.Message):
+    user = await db.get_user(message.from_user.id)
+    if not user:
+        return
+    link = referral_link((await bot.me()).username, message.from_user.id)
+    if user["language"] == "ru":
+        text = (f"Поделитесь ссылкой с друзьями:\n{link}\n\n"
+                f"Вы пригласили: {user['referral_count']}")
+        if REFERRAL_BONUS or user["referral_bonus"]:
+            text += f"\nБонусы: {user['referral_bonus']}₽ (+{REFERRAL_BONUS}₽ за первую оплату друга)"
+    else:
+        text = (f"Share this link with friends:\n{link}\n\n"
+                f"Friends invited: {user['referral_count']}")
+        if REFERRAL_BONUS or user["referral_bonus"]:
+            text += f"\nBonus: {user['referral_bonus']}₽ (+{REFERRAL_BONUS}₽ per friend's first payment)"
+    await message.answer(text)
 
 
 @dp.message(F.text.in_(["FAQ"]))
@@ -270,46 +717,76 @@ async def reviews_message(message: types.Message):
         f"Наши отзывы: {REVIEWS_CHAT_LINK}" if message.text == "Отзывы" else f"Our reviews: {REVIEWS_CHAT_LINK}")
 
 
-@dp.message(F.text.in_(["Записаться на прием", "Make an appointment"]))
+@dp.message(F.text.in_(["Записаться на прием", "Make an appointment"]), flags={"throttle": "heavy"})
 async def start_appointment(message: types.Message, state: FSMContext):
     user = await db.get_user(message.from_user.id)
+    lang = user['language'] if user else 'ru'
+    # Клавиатура строится один раз на язык и сбрасывается при изменении каталога
+    markup = await catalog.keyboard(lang)
+    if markup is None:
+        await message.answer("Запись пока недоступна." if lang == 'ru' else "Booking is not available yet.")
+        return
     await state.set_state(Form.service)
-
-    services = ["Чистка лица", "Пилинг", "Массаж лица", "Маска"]
-    builder = InlineKeyboardBuilder()
-    for s in services:
-        builder.button(text=s, callback_data=f"service_{s}")
-    builder.adjust(1)
-
-    await message.answer("Выберите услугу:" if user['language'] == 'ru' else "Choose a service:",
-                         reply_markup=builder.as_markup())
+    await message.answer("Выберите услугу:" if lang == 'ru' else "Choose a service:", reply_markup=markup)
 
 
-@dp.callback_query(F.data.startswith("service_"))
+@dp.callback_query(F.data.startswith("service_"), flags={"throttle": "heavy"})
 async def choose_service(callback: types.CallbackQuery, state: FSMContext):
-    service = callback.data.split("_", 1)[1]
-    await state.update_data(service=service)
-
     user = await db.get_user(callback.from_user.id)
     lang = user['language'] if user else 'ru'
 
-    slots = await db.get_available_slots()
-    if not slots:
+    service_id = callback.data.split("_", 1)[1]
+    service = await catalog.get(int(service_id)) if service_id.isdigit() else None
+    if not service or not service["active"]:
+        await callback.answer("Услуга больше недоступна." if lang == 'ru' else "This service is no longer available.")
+        return
+    # В записи хранится название на момент записи: отчёты не зависят от правок каталога
+    await state.update_data(service=service["name_ru"])
+
+    markup = await slots_keyboard(0)
+    if markup is None:
         await callback.message.answer("Нет доступных окон." if lang == 'ru' else "No available slots.")
         await state.clear()
         return
 
+    await state.set_state(Form.slot)
+    await callback.message.answer("Выберите время:" if lang == 'ru' else "Choose time:", reply_markup=markup)
+
+
+async def slots_keyboard(page: int) -> Optional[types.InlineKeyboardMarkup]:
+    """Страница свободных окон с листанием; None — окон нет."""
+    # Берём на одно окно больше, чтобы понять, есть ли следующая страница
+    slots = await db.get_available_slots(SLOTS_PAGE_SIZE + 1, page * SLOTS_PAGE_SIZE)
+    if not slots:
+        # Пока клиент листал, окна могли разобрать — начинаем с первой страницы
+        return await slots_keyboard(0) if page > 0 else None
+
     builder = InlineKeyboardBuilder()
-    for slot in slots:
-        builder.button(text=slot["datetime"], callback_data=f"slot_{slot['id']}")
-    builder.adjust(1)
+    for slot in slots[:SLOTS_PAGE_SIZE]:
+        builder.row(types.InlineKeyboardButton(text=slot["datetime"], callback_data=f"slot_{slot['id']}"))
+    nav = []
+    if page > 0:
+        nav.append(types.InlineKeyboardButton(text="◀️", callback_data=f"slots_page_{page - 1}"))
+    if len(slots) > SLOTS_PAGE_SIZE:
+        nav.append(types.InlineKeyboardButton(text="▶️", callback_data=f"slots_page_{page + 1}"))
+    if nav:
+        builder.row(*nav)
+    return builder.as_markup()
 
-    await state.set_state(Form.slot)
-    await callback.message.answer("Выберите время:" if lang == 'ru' else "Choose time:",
-                                  reply_markup=builder.as_markup())
+
+@dp.callback_query(F.data.startswith("slots_page_"), Form.slot)
+async def slots_page(callback: types.CallbackQuery):
+    page = callback.data.rsplit("_", 1)[1]
+    markup = await slots_keyboard(int(page)) if page.isdigit() else None
+    if markup is None:
+        lang = await user_language(callback.from_user.id)
+        await callback.answer("Нет доступных окон." if lang == 'ru' else "No available slots.")
+        return
+    await callback.message.edit_reply_markup(reply_markup=markup)
+    await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("slot_"), Form.slot)
+@dp.callback_query(F.data.startswith("slot_"), Form.slot, flags={"throttle": "heavy"})
 async def choose_slot(callback: types.CallbackQuery, state: FSMContext):
     slot_id = int(callback.data.split("_", 1)[1])
     await state.update_data(slot_id=slot_id)
@@ -325,28 +802,37 @@ async def choose_slot(callback: types.CallbackQuery, state: FSMContext):
     )
 
 
-@dp.message(Form.anamnesis)
-async def submit_anamnesis(message: types.Message, state: FSMContext):
+@dp.message(Form.anamnesis, flags={"throttle": "heavy"})
+async def submit_anamnesis(message: types.Message, state: FSMContext, event_update: types.Update):
     data = await state.get_data()
     user = await db.get_user(message.from_user.id)
     slot_id = data["slot_id"]
-    await db.conn.execute("UPDATE slots SET available = 0 WHERE id = ?", (slot_id,))
-    await db.conn.commit()
     service = data["service"]
     anamnesis = message.text
 
-    await state.clear()
+    # Состояние чистим в конце: прерванный остановкой апдейт повторится в том же состоянии,
+    # а запись и уведомление, уже сделанные им, не продублируются
+    booking = await db.create_booking(message.from_user.id, slot_id, service, anamnesis, event_update.update_id)
+    if booking is None:
+        await state.clear()
+        await message.answer("Это время уже заняли, выберите другое." if user['language'] == 'ru'
+                             else "This time has just been taken, please choose another one.")
+        return
 
-    for admin_id in ADMIN_IDS:
-        await bot.send_message(
-            admin_id,
-            f"📋 Новая заявка:\n\nПользователь: {user['name']}\nУслуга: {service}\nАнамнез: {anamnesis}\nСлот ID: {slot_id}",
-            reply_markup=InlineKeyboardBuilder()
-            .button(text="✅ Подтвердить", callback_data=f"confirm_{message.from_user.id}_{slot_id}_{service}")
-            .button(text="❌ Отменить", callback_data=f"cancel_{message.from_user.id}")
-            .as_markup()
-        )
+    if not booking["notified"]:
+        for admin_id in ADMIN_IDS:
+            await bot.send_message(
+                admin_id,
+                f"📋 Новая заявка:\n\nПользователь: {user['name']}\nУслуга: {service}\nАнамнез: {anamnesis}\n"
+                f"Слот ID: {slot_id}",
+                reply_markup=InlineKeyboardBuilder()
+                .button(text="✅ Подтвердить", callback_data=f"confirm_{message.from_user.id}_{slot_id}")
+                .button(text="❌ Отменить", callback_data=f"cancel_{message.from_user.id}")
+                .as_markup()
+            )
+        await db.mark_booking_notified(booking["id"])
 
+    await state.clear()
     await message.answer("Ваша заявка отправлена администратору. Ожидайте подтверждения.")
 
 
@@ -356,6 +842,9 @@ async def admin_cancel(callback: types.CallbackQuery):
         _, user_id = callback.data.split("_")
         user_id = int(user_id)
 
+        booking = await db.set_booking_status(user_id, "cancelled", ["pending", "confirmed"])
+        if booking:
+            await jobs.cancel_for_booking(booking["id"])
         await callback.message.edit_reply_markup()
         await bot.send_message(user_id, "❌ Ваша запись была отменена администратором.")
         await callback.message.answer("Запись отменена.")
@@ -367,19 +856,25 @@ async def admin_cancel(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("confirm_"))
 async def admin_confirm(callback: types.CallbackQuery):
     try:
-        _, user_id, slot_id, service = callback.data.split("_", 3)
+        # Старые кнопки несут ещё и название услуги после slot_id — оно берётся из записи
+        _, user_id, slot_id = callback.data.split("_", 3)[:3]
         user_id, slot_id = int(user_id), int(slot_id)
 
-        cursor = await db.conn.execute("SELECT datetime FROM slots WHERE id = ?", (slot_id,))
+        cursor = await db.conn.execute(
+            "SELECT datetime FROM slots WHERE tenant_id = ? AND id = ?", (db.tenant_id, slot_id)
+        )
         row = await cursor.fetchone()
         if not row:
             await callback.message.answer("Слот не найден.")
             return
         slot_time = row[0]
+        booking = await db.set_booking_status(user_id, "confirmed", ["pending"], slot_id=slot_id)
+        if booking:
+            await schedule_booking_jobs(booking)
 
         payment_context[user_id] = {
             "slot": slot_time,
-            "service": service
+            "service": booking["service"] if booking else ""
         }
 
         await callback.message.answer(
@@ -389,33 +884,6 @@ async def admin_confirm(callback: types.CallbackQuery):
         logging.exception(e)
 
 
-@dp.message()
-async def receive_payment_info(message: types.Message):
-    if message.from_user.id in ADMIN_IDS:
-        for user_id, ctx in payment_context.items():
-            slot_time = ctx["slot"]
-            service = ctx["service"]
-            text = f"""
-✅ Ваша запись подтверждена!
-
-🧴 Услуга: {service}
-🕒 Дата и время: {slot_time}
-
-💰 Предоплата: {message.text}
-
-Пожалуйста, подтвердите оплату:
-"""
-            await bot.send_message(
-                user_id,
-                text,
-                reply_markup=InlineKeyboardBuilder()
-                .button(text="✅ Оплатил", callback_data=f"paid_{user_id}")
-                .button(text="❌ Отменить", callback_data=f"decline_{user_id}")
-                .as_markup()
-            )
-        payment_context.clear()
-
-
 @dp.callback_query(F.data.startswith(("paid_", "decline_")))
 async def payment_response(callback: types.CallbackQuery):
     action, user_id = callback.data.split("_", 1)
@@ -423,71 +891,714 @@ async def payment_response(callback: types.CallbackQuery):
 
     user = await db.get_user(user_id)
     if action == "paid":
+        booking = await db.set_booking_status(user_id, "paid", ["confirmed"])
+        if booking:
+            await jobs.cancel_for_booking(booking["id"], ["release_hold"])
         await callback.message.answer("✅ Оплата получена! До встречи!")
         for admin_id in ADMIN_IDS:
             await bot.send_message(admin_id, f"👤 Пользователь {user['name']} оплатил запись.")
     else:
+        booking = await db.set_booking_status(user_id, "cancelled", ["confirmed"])
+        if booking:
+            await jobs.cancel_for_booking(booking["id"])
         await callback.message.answer("❌ Запись отменена.")
         for admin_id in ADMIN_IDS:
             await bot.send_message(admin_id, f"⚠️ Пользователь {user['name']} отменил запись.")
 
 
+def slot_timestamp(slot_at: str) -> float:
+    return datetime.strptime(slot_at, "%Y-%m-%d %H:%M").replace(tzinfo=TIMEZONE).timestamp()
+
+
+async def schedule_booking_jobs(booking: dict):
+    """После подтверждения: снять бронь без оплаты через HOLD_MINUTES и напомнить за 24 ч и 1 ч."""
+    now = time.time()
+    await jobs.schedule("release_hold", now + HOLD_MINUTES * 60, booking["id"])
+    starts_at = slot_timestamp(booking["slot_at"])
+    for hours in REMINDER_HOURS:
+        due_at = starts_at - hours * 3600
+        if due_at > now:
+            await jobs.schedule("reminder", due_at, booking["id"], {"hours": hours})
+
+
+@jobs.handler("reminder")
+async def send_reminder(job: dict):
+    booking = await db.get_booking(job["booking_id"])
+    if not booking or booking["status"] not in ("confirmed", "paid"):
+        return
+    user = await db.get_user(booking["user_id"])
+    lang = user['language'] if user else 'ru'
+    when = _format_slot_at(booking["slot_at"])
+    if lang == 'ru':
+        text = f"⏰ Напоминаем о записи {'завтра' if job['payload']['hours'] >= 24 else 'через час'}: {booking['service']}, {when}"
+    else:
+        text = f"⏰ Reminder: your appointment {'is tomorrow' if job['payload']['hours'] >= 24 else 'starts in an hour'}: {booking['service']}, {when}"
+    await bot.send_message(booking["user_id"], text)
+
+
+@jobs.handler("release_hold")
+async def release_unpaid_hold(job: dict):
+    booking = await db.get_booking(job["booking_id"])
+    if not booking or booking["status"] != "confirmed":
+        return
+    await db.set_booking_status(booking["user_id"], "cancelled", ["confirmed"], slot_id=booking["slot_id"])
+    await jobs.cancel_for_booking(booking["id"])
+    await bot.send_message(booking["user_id"], "⌛ Запись отменена: предоплата не поступила вовремя.")
+    for admin_id in ADMIN_IDS:
+        await bot.send_message(
+            admin_id, f"⌛ Окно {_format_slot_at(booking['slot_at'])} освобождено: клиент не оплатил запись."
+        )
+
+
+SLOTS_HELP = (
+    "Отправьте окна одним из способов:\n\n"
+    "1) Списком через Enter:\n16.03 17:00\n17.03 14:30\n\n"
+    "2) Правилом расписания:\n"
+    "дни: пн-пт\nчасы: 10:00-19:00\nдлительность: 60\nперерыв: 13:00-14:00\nс: 01.06\nпо: 30.06\n\n"
+    "3) Файлом .csv (дата и время в строке) или .ics из календаря."
+)
+
+
 @dp.message(F.text == "Добавить свободные окна")
 async def handle_add_slots(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMIN_IDS:
         return
-        await state.set_state(AdminForm.add_slots)
-        await message.answer(
-            "Введите даты и время через Enter (например:\n16.03 17:00\n17.03 14:30):"
-        )
+    await state.set_state(AdminForm.add_slots)
+    await message.answer(SLOTS_HELP)
+
+
+@dp.message(AdminForm.add_slots, F.document)
+async def add_slots_file(message: types.Message, state: FSMContext):
+    filename = (message.document.file_name or "").lower()
+    if not filename.endswith((".csv", ".ics")):
+        await message.answer("⚠️ Поддерживаются только файлы .csv и .ics.")
+        return
+
+    data = (await bot.download(message.document)).read()
+    try:
+        slots = parse_ics(data) if filename.endswith(".ics") else parse_csv(data, datetime.now().year)
+    except ScheduleError as e:
+        await message.answer(f"⚠️ {e}")
+        return
+
+    await report_added_slots(message, len(slots), await db.insert_slots(slots))
+    await state.clear()
 
 
 @dp.message(AdminForm.add_slots)
 async def add_slots_process(message: types.Message, state: FSMContext):
-    raw_slots = message.text.strip().splitlines()
-    added = await db.add_slots(raw_slots)
+    text = message.text or ""
+    if is_rule(text):
+        try:
+            slots = expand_rule(parse_rule(text))
+        except ScheduleError as e:
+            await message.answer(f"⚠️ {e}")
+            return
+        await report_added_slots(message, len(slots), await db.insert_slots(slots))
+    else:
+        raw_slots = text.strip().splitlines()
+        added = await db.add_slots(raw_slots)
+        if added > 0:
+            await message.answer(f"✅ Добавлено {added} свободных окон.")
+        else:
+            await message.answer("⚠️ Не удалось добавить ни одного окна. Проверьте формат даты (дд.мм чч:мм).")
 
-    if added > 0:
+    await state.clear()
+
+
+async def report_added_slots(message: types.Message, total: int, added: int):
+    if total == 0:
+        await message.answer("⚠️ Не найдено ни одного окна. Проверьте формат.")
+    elif added == total:
         await message.answer(f"✅ Добавлено {added} свободных окон.")
     else:
-        await message.answer("⚠️ Не удалось добавить ни одного окна. Проверьте формат даты (дд.мм чч:мм).")
+        await message.answer(f"✅ Добавлено {added} свободных окон, {total - added} уже были в расписании.")
 
-    await state.clear()
+
+def _format_slot_at(slot_at: str) -> str:
+    return datetime.strptime(slot_at, "%Y-%m-%d %H:%M").strftime("%d.%m %H:%M")
 
 
+async def render_bookings(state: FSMContext) -> tuple:
+    """Текст и клавиатура страницы записей по фильтрам из FSM."""
+    data = await state.get_data()
+    page, day, service = data.get("bookings_page", 0), data.get("bookings_day"), data.get("bookings_service")
+
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+    rows = await db.list_bookings(day, service, BOOKINGS_PAGE_SIZE + 1, page * BOOKINGS_PAGE_SIZE)
+    has_next = len(rows) > BOOKINGS_PAGE_SIZE
+    rows = rows[:BOOKINGS_PAGE_SIZE]
+
+    title = f"📋 Записи {'на ' + datetime.strptime(day, '%Y-%m-%d').strftime('%d.%m.%Y') if day else 'с сегодняшнего дня'}"
+    if service:
+        title += f", услуга: {service}"
+    lines = [f"{title} — стр. {page + 1}", ""]
+    if not rows:
+        lines.append("Записей нет.")
+    for row in rows:
+        client = row["name"] or "—"
+        if row["phone"]:
+            client += f", {row['phone']}"
+        lines.append(
+            f"{_format_slot_at(row['slot_at'])} — {client}"
+            f"{', ' + row['service'] if row['service'] else ''} — {BOOKING_STATUSES.get(row['status'], row['status'])}"
+        )
+
+    per_day = await db.bookings_per_day(day, service)
+    if per_day:
+        lines += ["", "По дням:"]
+        lines += [
+            f"{datetime.strptime(d, '%Y-%m-%d').strftime('%d.%m')} — {total} (оплачено {paid or 0})"
+            for d, total, paid in per_day
+        ]
+
+    builder = InlineKeyboardBuilder()
+    nav = []
+    if page > 0:
+        nav.append(types.InlineKeyboardButton(text="◀️", callback_data="bookings_page_prev"))
+    if has_next:
+        nav.append(types.InlineKeyboardButton(text="▶️", callback_data="bookings_page_next"))
+    if nav:
+        builder.row(*nav)
+    builder.row(
+        types.InlineKeyboardButton(text="📅 Дата", callback_data="bookings_date"),
+        types.InlineKeyboardButton(text="🧴 Услуга", callback_data="bookings_services"),
+        types.InlineKeyboardButton(text="♻️ Сбросить", callback_data="bookings_reset"),
+    )
+    return "\n".join(lines), builder.as_markup()
 
 
 @dp.message(F.text == "Список записей")
-async def handle_list_appointments(message: types.Message):
+async def handle_list_appointments(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMIN_IDS:
         return
-        cursor = await db.conn.execute("SELECT datetime FROM slots WHERE available = 0 ORDER BY datetime")
-        rows = await cursor.fetchall()
-        if not rows:
-            await message.answer("Нет занятых слотов.")
+    await state.update_data(bookings_page=0, bookings_day=None, bookings_service=None)
+    text, markup = await render_bookings(state)
+    await message.answer(text, reply_markup=markup)
+
+
+@dp.callback_query(F.data.startswith("bookings_"))
+async def bookings_navigation(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in ADMIN_IDS:
+        return
+    action = callback.data[len("bookings_"):]
+    data = await state.get_data()
+
+    if action == "date":
+        await state.set_state(AdminForm.bookings_date)
+        await callback.message.answer("Введите дату в формате дд.мм или дд.мм.гггг:")
+        await callback.answer()
+        return
+    if action == "services":
+        services = await db.booked_services()
+        await state.update_data(bookings_services=services)
+        builder = InlineKeyboardBuilder()
+        for i, name in enumerate(services):
+            builder.button(text=name, callback_data=f"bookings_service_{i}")
+        builder.button(text="Все услуги", callback_data="bookings_service_all")
+        builder.adjust(1)
+        await callback.message.edit_reply_markup(reply_markup=builder.as_markup())
+        await callback.answer()
+        return
+
+    if action == "page_next":
+        await state.update_data(bookings_page=data.get("bookings_page", 0) + 1)
+    elif action == "page_prev":
+        await state.update_data(bookings_page=max(data.get("bookings_page", 0) - 1, 0))
+    elif action == "reset":
+        await state.update_data(bookings_page=0, bookings_day=None, bookings_service=None)
+    elif action.startswith("service_"):
+        index = action[len("service_"):]
+        services = data.get("bookings_services", [])
+        service = services[int(index)] if index.isdigit() and int(index) < len(services) else None
+        await state.update_data(bookings_page=0, bookings_service=service)
+
+    text, markup = await render_bookings(state)
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+
+@dp.message(AdminForm.bookings_date)
+async def bookings_date_filter(message: types.Message, state: FSMContext):
+    value = (message.text or "").strip()
+    for fmt in ("%d.%m.%Y", "%d.%m"):
+        try:
+            day = datetime.strptime(value, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        await message.answer("Неверный формат даты. Пример: 16.03")
+        return
+    if fmt == "%d.%m":
+        day = day.replace(year=datetime.now().year)
+
+    await state.set_state(None)
+    await state.update_data(bookings_page=0, bookings_day=day.strftime("%Y-%m-%d"))
+    text, markup = await render_bookings(state)
+    await message.answer(text, reply_markup=markup)
+
+
+async def render_client_search(state: FSMContext) -> tuple:
+    data = await state.get_data()
+    query, page = data.get("search_query", ""), data.get("search_page", 0)
+    rows = await db.search_clients(query, SEARCH_PAGE_SIZE + 1, page * SEARCH_PAGE_SIZE)
+    has_next = len(rows) > SEARCH_PAGE_SIZE
+    rows = rows[:SEARCH_PAGE_SIZE]
+
+    lines = [f"🔎 Клиенты по запросу «{query}» — стр. {page + 1}", ""]
+    if not rows:
+        lines.append("Никого не нашли.")
+    for i, row in enumerate(rows, start=page * SEARCH_PAGE_SIZE + 1):
+        client = row["name"] or "—"
+        if row["phone"]:
+            client += f", {row['phone']}"
+        lines.append(f"{i}. {client} — записей: {row['bookings']}")
+        if row["notes"]:
+            lines.append(f"    {row['notes']}")
+
+    builder = InlineKeyboardBuilder()
+    if page > 0:
+        builder.button(text="◀️", callback_data="search_prev")
+    if has_next:
+        builder.button(text="▶️", callback_data="search_next")
+    markup = builder.as_markup() if page > 0 or has_next else None
+    return "\n".join(lines), markup
+
+
+async def show_client_search(message: types.Message, state: FSMContext, query: str):
+    query = query.strip()
+    if not query:
+        await state.set_state(AdminForm.search)
+        await message.answer("Введите имя, телефон или слово из анамнеза:")
+        return
+    await state.set_state(None)
+    await state.update_data(search_query=query, search_page=0)
+    text, markup = await render_client_search(state)
+    await message.answer(text, reply_markup=markup)
+
+
+@dp.message(F.text == "Поиск клиентов")
+async def handle_client_search(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await show_client_search(message, state, "")
+
+
+@dp.message(F.text.startswith("/find"))
+async def find_command(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await show_client_search(message, state, message.text.partition(" ")[2])
+
+
+@dp.message(AdminForm.search)
+async def client_search_text(message: types.Message, state: FSMContext):
+    await show_client_search(message, state, message.text or "")
+
+
+@dp.callback_query(F.data.in_({"search_prev", "search_next"}))
+async def client_search_navigation(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in ADMIN_IDS:
+        return
+    page = (await state.get_data()).get("search_page", 0)
+    await state.update_data(search_page=page + 1 if callback.data == "search_next" else max(page - 1, 0))
+    text, markup = await render_client_search(state)
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+
+@dp.message(F.text == "Статистика")
+async def handle_stats(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    today = datetime.now(TIMEZONE).date()
+    days = await daily_counts(db.conn, db.tenant_id, today - timedelta(days=HISTORY_DAYS - 1))
+    await message.answer(render_stats(days, today))
+
+
+@dp.message(F.text == "Рефералы")
+async def handle_referrals(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    lines = [
+        f"{i}. {row['name'] or row['id']} — приглашено: {row['referral_count']}, бонусы: {row['referral_bonus']}₽"
+        for i, row in enumerate(await leaderboard(db.conn, db.tenant_id), start=1)
+    ]
+    await message.answer("🤝 Лучшие рекомендатели:\n\n" + ("\n".join(lines) or "пока никого"))
+
+
+@dp.message(F.text == "Рассылка")
+async def handle_broadcast(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await state.set_state(AdminForm.broadcast)
+    await message.answer("Отправьте текст рассылки. Его получат все пользователи бота.")
+
+
+@dp.message(AdminForm.broadcast)
+async def broadcast_text(message: types.Message, state: FSMContext):
+    await state.clear()
+    if not message.text:
+        await message.answer("⚠️ Рассылка поддерживает только текст.")
+        return
+    await broadcaster.start(message.from_user.id, message.text)
+
+
+@dp.callback_query(F.data.startswith("broadcast_stop_"))
+async def broadcast_stop(callback: types.CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        return
+    await broadcaster.cancel(int(callback.data.rsplit("_", 1)[1]))
+    await callback.answer("Рассылка остановлена")
+
+
+EXPORT_TITLES = {"users": "Клиенты", "slots": "Окна", "bookings": "Записи"}
+export_tasks = set()
+
+
+@dp.message(F.text == "Экспорт данных")
+async def handle_export(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    builder = InlineKeyboardBuilder()
+    for table in EXPORT_TABLES:
+        for fmt in EXPORT_FORMATS:
+            builder.button(text=f"{EXPORT_TITLES[table]} · {fmt.upper()}", callback_data=f"export_{table}_{fmt}")
+    builder.adjust(len(EXPORT_FORMATS))
+    await message.answer("Что выгрузить? Файл придёт сжатым (.gz).", reply_markup=builder.as_markup())
+
+
+@dp.callback_query(F.data.startswith("export_"))
+async def export_request(callback: types.CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        return
+    _, table, fmt = callback.data.split("_", 2)
+    if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS:
+        await callback.answer()
+        return
+    await callback.answer("Готовлю файл...")
+    # Выгрузка идёт в фоне, чтобы бот не переставал отвечать остальным
+    task = asyncio.create_task(send_export(callback.from_user.id, table, fmt))
+    export_tasks.add(task)
+    task.add_done_callback(export_tasks.discard)
+
+
+async def send_export(admin_id: int, table: str, fmt: str):
+    path = None
+    try:
+        path = await export_table(db.conn, db.tenant_id, table, fmt)
+        filename = f"{table}_{datetime.now():%Y%m%d_%H%M}.{fmt}.gz"
+        await bot.send_document(admin_id, types.FSInputFile(path, filename=filename))
+    except Exception as e:
+        logger.exception(f"Ошибка выгрузки {table}: {e}")
+        await bot.send_message(admin_id, "⚠️ Не удалось выгрузить данные.")
+    finally:
+        if path:
+            os.remove(path)
+
+
+SERVICES_HELP = (
+    "Команды каталога услуг:\n\n"
+    "/service_add Название | Name in English | минут | цена\n"
+    "/service_edit id Название | Name in English | минут | цена\n"
+    "/service_hide id — убрать из записи\n"
+    "/service_show id — вернуть в запись\n\n"
+    "Английское название, длительность и цену можно не указывать. При редактировании пустое поле "
+    "не меняется, «-» его очищает: /service_edit 3 | | | 1500 меняет только цену."
+)
+
+
+def parse_service(text: str, partial: bool = False) -> dict:
+    """Поля услуги из строки команды; partial — для правки: только указанные поля, «-» — очистить."""
+    parts = [part.strip() for part in text.split("|")]
+    given = {key: parts[index] for index, key in enumerate(SERVICE_FIELDS) if index < len(parts) and parts[index]}
+    if given.get("name_ru", "-") == "-" and (not partial or "name_ru" in given):
+        raise ValueError("Укажите название услуги.")
+
+    fields = {}
+    for key, value in given.items():
+        if value == "-":
+            fields[key] = None
+        elif key in ("duration_min", "price"):
+            if not value.isdigit():
+                raise ValueError(f"Длительность и цена указываются числом: «{value}».")
+            fields[key] = int(value)
+        else:
+            fields[key] = value
+    if partial:
+        return fields
+    return {key: fields.get(key) for key in SERVICE_FIELDS}
+
+
+def parse_service_id(text: str) -> int:
+    if not text.strip().isdigit():
+        raise ValueError("Укажите id услуги числом.")
+    return int(text)
+
+
+async def render_services() -> str:
+    lines = []
+    for service in await catalog.all():
+        line = f"{service['id']}. {service['name_ru']}"
+        if service["name_en"]:
+            line += f" / {service['name_en']}"
+        if service["duration_min"]:
+            line += f", {service['duration_min']} мин"
+        if service["price"]:
+            line += f", {service['price']}₽"
+        if not service["active"]:
+            line += " (скрыта)"
+        lines.append(line)
+    return "🧴 Услуги:\n\n" + ("\n".join(lines) or "пока нет") + "\n\n" + SERVICES_HELP
+
+
+@dp.message(F.text == "Услуги")
+async def handle_services(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await message.answer(await render_services())
+
+
+@dp.message(F.text.startswith("/service_"))
+async def service_command(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    command, _, args = message.text.partition(" ")
+    try:
+        if command == "/service_add":
+            await catalog.add(**parse_service(args))
+            found = True
+        elif command == "/service_edit":
+            service_id, _, rest = args.strip().partition(" ")
+            fields = parse_service(rest, partial=True)
+            if not fields:
+                raise ValueError("Укажите поля, которые нужно изменить.")
+            found = await catalog.update(parse_service_id(service_id), **fields)
+        elif command in ("/service_hide", "/service_show"):
+            found = await catalog.update(parse_service_id(args), active=int(command == "/service_show"))
+        else:
+            await message.answer(SERVICES_HELP)
+            return
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}")
+        return
+    if not found:
+        await message.answer("⚠️ Услуга не найдена.")
+        return
+    await message.answer(await render_services())
+
+
+PRODUCTS_HELP = (
+    "Команды магазина:\n\n"
+    "/product_add Название | Name in English | цена | описание | ссылка на фото\n"
+    "/product_edit id Название | Name in English | цена | описание | ссылка на фото\n"
+    "/product_hide id — снять с продажи\n"
+    "/product_show id — вернуть в продажу\n\n"
+    "Английское название, описание и фото можно не указывать. Вместо ссылки можно "
+    "прислать фото с командой в подписи. При редактировании пустое поле не меняется, «-» его очищает: "
+    "/product_edit 2 | | 1200 меняет только цену."
+)
+
+
+def parse_product(text: str, partial: bool = False) -> dict:
+    """Поля товара из строки команды; partial — для правки: только указанные поля, «-» — очистить."""
+    parts = [part.strip() for part in text.split("|")]
+    given = {key: parts[index] for index, key in enumerate(PRODUCT_FIELDS[:5]) if index < len(parts) and parts[index]}
+    if given.get("name_ru", "-") == "-" and (not partial or "name_ru" in given):
+        raise ValueError("Укажите название товара.")
+    if not given.get("price", "").isdigit() and (not partial or "price" in given):
+        raise ValueError("Укажите цену товара числом.")
+
+    fields = {key: None if value == "-" else value for key, value in given.items()}
+    if "price" in fields:
+        fields["price"] = int(fields["price"])
+    if partial:
+        return fields
+    return {key: fields.get(key) for key in PRODUCT_FIELDS[:5]}
+
+
+def parse_product_id(text: str) -> int:
+    if not text.strip().isdigit():
+        raise ValueError("Укажите id товара числом.")
+    return int(text)
+
+
+async def render_products() -> str:
+    lines = []
+    for product in await products.all():
+        line = f"{product['id']}. {product['name_ru']}"
+        if product["name_en"]:
+            line += f" / {product['name_en']}"
+        line += f", {product['price']}₽"
+        if product["photo"] or product["photo_file_id"]:
+            line += " 📷"
+        if not product["active"]:
+            line += " (снят с продажи)"
+        lines.append(line)
+    return "🛍 Товары:\n\n" + ("\n".join(lines) or "пока нет") + "\n\n" + PRODUCTS_HELP
+
+
+@dp.message(F.text == "Товары")
+async def handle_products(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await message.answer(await render_products())
+
+
+@dp.message(F.text.startswith("/product_"))
+@dp.message(F.caption.startswith("/product_"))
+async def product_command(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    command, _, args = (message.text or message.caption).partition(" ")
+    try:
+        if command in ("/product_add", "/product_edit"):
+            product_id = None
+            if command == "/product_edit":
+                product_id, _, args = args.strip().partition(" ")
+                product_id = parse_product_id(product_id)
+            fields = parse_product(args, partial=product_id is not None)
+            if message.photo:
+                # Фото от админа уже загружено в Telegram этим ботом — храним сразу file_id
+                fields.update(photo=None, photo_file_id=message.photo[-1].file_id)
+            if not fields:
+                raise ValueError("Укажите поля, которые нужно изменить.")
+            if product_id is None:
+                await products.add(**fields)
+                found = True
+            else:
+                found = await products.update(product_id, **fields)
+        elif command in ("/product_hide", "/product_show"):
+            found = await products.update(parse_product_id(args), active=int(command == "/product_show"))
         else:
-            text = "Занятые слоты:\n" + "\n".join([row[0] for row in rows])
-            await message.answer(text)
+            await message.answer(PRODUCTS_HELP)
+            return
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}")
+        return
+    if not found:
+        await message.answer("⚠️ Товар не найден.")
+        return
+    await message.answer(await render_products())
+
+
+# Должен регистрироваться последним: перехватывает любые сообщения админа
+@dp.message()
+async def receive_payment_info(message: types.Message):
+    if message.from_user.id in ADMIN_IDS:
+        for user_id, ctx in payment_context.items():
+            slot_time = ctx["slot"]
+            service = ctx["service"]
+            text = f"""
+✅ Ваша запись подтверждена!
+
+🧴 Услуга: {service}
+🕒 Дата и время: {slot_time}
+
+💰 Предоплата: {message.text}
+
+Пожалуйста, подтвердите оплату:
+"""
+            await bot.send_message(
+                user_id,
+                text,
+                reply_markup=InlineKeyboardBuilder()
+                .button(text="✅ Оплатил", callback_data=f"paid_{user_id}")
+                .button(text="❌ Отменить", callback_data=f"decline_{user_id}")
+                .as_markup()
+            )
+        payment_context.clear()
+
+
+async def timed(phase: str, coro):
+    started = time.perf_counter()
+    result = await coro
+    startup_phases[f"{phase}_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def signal_ready():
+    startup_phases["total_ms"] = round((time.perf_counter() - _STARTED_AT) * 1000, 1)
+    with open(READY_FILE, "w") as f:
+        json.dump({"ready": True, "phases": startup_phases}, f)
+    logger.info(f"Бот готов к работе, этапы запуска: {startup_phases}")
+
+
+def write_metrics():
+    # Метрики — вспомогательный файл: ошибка записи не должна останавливать отчёты и остановку бота
+    try:
+        with open(METRICS_FILE, "w") as f:
+            json.dump({"updated_at": time.time(), "lanes": lanes.snapshot(), "throttle": throttle.snapshot(),
+                       "media": media.snapshot()}, f)
+    except OSError as e:
+        logger.warning(f"Не удалось записать метрики в {METRICS_FILE}: {e}")
+
+
+async def report_metrics():
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        write_metrics()
+
+
+metrics_task: Optional[asyncio.Task] = None
 
 
 async def on_startup():
-    await db.connect()
+    if os.path.exists(READY_FILE):
+        os.remove(READY_FILE)
+    # get_me (нужен polling'у) идёт по сети параллельно с открытием БД
+    await asyncio.gather(timed("db_connect", db.connect()), timed("get_me", bot.me()))
     logger.info("Бот запущен и подключен к базе данных")
-    default_slots = ["21.05 12:00", "21.05 15:00", "22.05 18:30"]
-    existing = await db.get_available_slots()
-    if not existing:
-        await db.add_slots(default_slots)
+    if db.created:
+        await timed("seed_slots", db.add_slots(DEFAULT_SLOTS))
         logger.info("Добавлены тестовые окна по умолчанию")
+    await journal.load(db.conn, db.tenant_id)
+    storage.attach(db.conn, db.tenant_id)
+    await set_utc_offset(db.conn, db.tenant_id, TIMEZONE)
+    await set_bonus(db.conn, db.tenant_id, REFERRAL_BONUS)
+    catalog.attach(db.conn, db.tenant_id)
+    products.attach(db.conn, db.tenant_id)
+    await media.attach(db.conn)
+    broadcaster.attach(db.conn, db.tenant_id)
+    await broadcaster.resume()
+    await jobs.start(db.conn, db.tenant_id)
+    journal.replay(dp, bot)
+    global metrics_task
+    metrics_task = asyncio.create_task(report_metrics())
+    signal_ready()
 
 
 async def on_shutdown():
+    if os.path.exists(READY_FILE):
+        os.remove(READY_FILE)
+    # Polling уже остановлен; начатое дорабатываем до общего дедлайна
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SHUTDOWN_TIMEOUT
+    interrupted = await journal.drain(deadline - loop.time())
+    if interrupted:
+        logger.warning(f"Не дождались {interrupted} апдейтов, они будут повторены после перезапуска")
+    await broadcaster.stop(deadline - loop.time())
+    await drain_tasks(export_tasks, deadline - loop.time())
+    await jobs.stop(deadline - loop.time())
+    await journal.save()
+    metrics_task.cancel()
+    await journal.confirm(bot)
     await db.close()
+    write_metrics()
     logger.info("Бот остановлен, соединение с базой данных закрыто")
 
 
 async def main():
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
+    dp.update.outer_middleware(journal)
+    if MAX_UPDATES_PER_SECOND > 0:
+        dp.update.outer_middleware(UpdateRateLimiter(MAX_UPDATES_PER_SECOND))
+    dp.update.outer_middleware(lanes)
+    # Внутренние: после фильтров, когда известен флаг throttle обработчика
+    dp.message.middleware(throttle)
+    dp.callback_query.middleware(throttle)
     await dp.start_polling(bot)
 
 
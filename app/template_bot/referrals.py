@@ -0,0 +1,45 @@
+"""Реферальная программа: ссылки-приглашения, разбор /start <payload>, таблица лидеров.
+
+Пригласивший передаётся в том же INSERT, которым /start создаёт пользователя,
+а связь в referrals, счётчик приглашений и бонус пригласившего ведут триггеры
+миграции 10 — лишних записей на /start нет даже при волне новых пользователей.
+Приглашение засчитывается только новому пользователю и только от существующего.
+"""
+import re
+from typing import List, Optional
+
+import aiosqlite
+
+PAYLOAD_PREFIX = "ref_"
+BONUS_KEY = "referral_bonus"
+_PAYLOAD_RE = re.compile(rf"^/start(?:@\w+)?\s+{PAYLOAD_PREFIX}(\d+)\s*$")
+
+
+def referral_link(bot_username: str, user_id: int) -> str:
+    return f"https://t.me/{bot_username}?start={PAYLOAD_PREFIX}{user_id}"
+
+
+def parse_referrer(text: Optional[str]) -> Optional[int]:
+    """id пригласившего из `/start ref_<id>`; None для обычного /start и чужих payload."""
+    match = _PAYLOAD_RE.match(text or "")
+    return int(match.group(1)) if match else None
+
+
+async def set_bonus(conn: aiosqlite.Connection, tenant_id: str, amount: int):
+    """Сообщает триггеру размер бонуса за первую оплату приглашённого."""
+    await conn.execute(
+        "INSERT OR REPLACE INTO bot_state (tenant_id, key, value) VALUES (?, ?, ?)",
+        (tenant_id, BONUS_KEY, str(amount))
+    )
+    await conn.commit()
+
+
+async def leaderboard(conn: aiosqlite.Connection, tenant_id: str, limit: int = 10) -> List[dict]:
+    cursor = await conn.execute("""
+        SELECT id, name, referral_count, referral_bonus FROM users
+        WHERE tenant_id = ? AND referral_count > 0
+        ORDER BY referral_count DESC
+        LIMIT ?
+    """, (tenant_id, limit))
+    keys = [column[0] for column in cursor.description]
+    return [dict(zip(keys, row)) for row in await cursor.fetchall()]
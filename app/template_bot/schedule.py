@@ -0,0 +1,245 @@
+"""Генерация окон записи: повторяющиеся правила, CSV и ICS.
+
+Всё здесь — чистые функции над datetime, запись в БД делает Database.insert_slots.
+"""
+import csv
+import io
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+SLOT_FORMAT = "%d.%m.%Y %H:%M"
+MAX_SLOTS_PER_IMPORT = 50_000
+
+WEEKDAYS = {
+    "пн": 0, "вт": 1, "ср": 2, "чт": 3, "пт": 4, "сб": 5, "вс": 6,
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+}
+
+RULE_KEYS = {
+    "дни": "days", "days": "days",
+    "часы": "hours", "hours": "hours",
+    "длительность": "length", "length": "length",
+    "перерыв": "breaks", "breaks": "breaks",
+    "с": "start", "from": "start",
+    "по": "end", "to": "end",
+}
+
+
+class ScheduleError(ValueError):
+    pass
+
+
+@dataclass
+class ScheduleRule:
+    weekdays: List[int]
+    day_start: time
+    day_end: time
+    slot_minutes: int
+    start: date
+    end: date
+    breaks: List[Tuple[time, time]] = field(default_factory=list)
+
+
+def _parse_time(value: str) -> time:
+    try:
+        return datetime.strptime(value.strip(), "%H:%M").time()
+    except ValueError:
+        raise ScheduleError(f"Неверное время: {value}")
+
+
+def _parse_time_range(value: str) -> Tuple[time, time]:
+    start, sep, end = value.partition("-")
+    if not sep:
+        raise ScheduleError(f"Ожидался интервал ЧЧ:ММ-ЧЧ:ММ: {value}")
+    start, end = _parse_time(start), _parse_time(end)
+    if end <= start:
+        raise ScheduleError(f"Конец интервала раньше начала: {value}")
+    return start, end
+
+
+def _parse_date(value: str, today: date) -> date:
+    value = value.strip()
+    for fmt in ("%d.%m.%Y", "%d.%m"):
+        try:
+            parsed = datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+        return parsed if fmt == "%d.%m.%Y" else parsed.replace(year=today.year)
+    raise ScheduleError(f"Неверная дата: {value}")
+
+
+def _parse_weekdays(value: str) -> List[int]:
+    days = set()
+    for part in value.lower().replace(" ", "").split(","):
+        first, sep, last = part.partition("-")
+        if first not in WEEKDAYS or (sep and last not in WEEKDAYS):
+            raise ScheduleError(f"Неизвестный день недели: {part}")
+        if sep:
+            a, b = WEEKDAYS[first], WEEKDAYS[last]
+            days.update(range(a, b + 1) if a <= b else list(range(a, 7)) + list(range(0, b + 1)))
+        else:
+            days.add(WEEKDAYS[first])
+    return sorted(days)
+
+
+def parse_rule(text: str, today: Optional[date] = None) -> ScheduleRule:
+    """Разбирает правило вида
+
+        дни: пн-пт
+        часы: 10:00-19:00
+        длительность: 60
+        перерыв: 13:00-14:00
+        с: 01.06
+        по: 30.06
+    """
+    today = today or date.today()
+    values = {}
+    for line in text.strip().splitlines():
+        key, sep, value = line.partition(":")
+        key = RULE_KEYS.get(key.strip().lower())
+        if not sep or not key:
+            raise ScheduleError(f"Непонятная строка правила: {line}")
+        values[key] = value.strip()
+
+    if {"days", "hours", "length"} - values.keys():
+        raise ScheduleError("В правиле не хватает: дни, часы и длительность обязательны")
+
+    day_start, day_end = _parse_time_range(values["hours"])
+    try:
+        slot_minutes = int(values["length"])
+    except ValueError:
+        raise ScheduleError(f"Длительность должна быть числом минут: {values['length']}")
+    if slot_minutes <= 0:
+        raise ScheduleError("Длительность должна быть больше нуля")
+
+    start = _parse_date(values["start"], today) if "start" in values else today
+    end = _parse_date(values["end"], today) if "end" in values else start + timedelta(days=30)
+    if end < start:
+        raise ScheduleError("Дата окончания раньше даты начала")
+
+    breaks = [_parse_time_range(b) for b in values.get("breaks", "").split(",") if b.strip()]
+    return ScheduleRule(
+        weekdays=_parse_weekdays(values["days"]),
+        day_start=day_start,
+        day_end=day_end,
+        slot_minutes=slot_minutes,
+        start=start,
+        end=end,
+        breaks=breaks,
+    )
+
+
+def is_rule(text: str) -> bool:
+    first_line = text.strip().splitlines()[0] if text.strip() else ""
+    return first_line.partition(":")[0].strip().lower() in RULE_KEYS
+
+
+def expand_rule(rule: ScheduleRule) -> List[datetime]:
+    """Все окна правила в порядке возрастания; окно не должно задевать перерыв."""
+    step = timedelta(minutes=rule.slot_minutes)
+    base = datetime.combine(date.min, time())
+    # Смещения окон внутри дня считаются один раз и переиспользуются для всех дней
+    offsets = []
+    cursor = datetime.combine(date.min, rule.day_start)
+    day_end = datetime.combine(date.min, rule.day_end)
+    breaks = [(datetime.combine(date.min, a), datetime.combine(date.min, b)) for a, b in rule.breaks]
+    while cursor + step <= day_end:
+        if not any(cursor < b_end and cursor + step > b_start for b_start, b_end in breaks):
+            offsets.append(cursor - base)
+        cursor += step
+
+    weekdays = set(rule.weekdays)
+    slots = []
+    day = rule.start
+    while day <= rule.end:
+        if day.weekday() in weekdays:
+            midnight = datetime.combine(day, time())
+            slots.extend(midnight + offset for offset in offsets)
+            if len(slots) > MAX_SLOTS_PER_IMPORT:
+                raise ScheduleError(f"Слишком много окон, максимум {MAX_SLOTS_PER_IMPORT} за раз")
+        day += timedelta(days=1)
+    return slots
+
+
+def parse_legacy_lines(lines: Iterable[str], year: int) -> List[datetime]:
+    """Старый формат из чата: по окну "дд.мм ЧЧ:ММ" на строку, ошибочные строки пропускаются."""
+    slots = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            # Год разбираем вместе с датой: без него strptime берёт 1900 год и не знает 29 февраля
+            slots.append(datetime.strptime(f"{line} {year}", "%d.%m %H:%M %Y"))
+        except ValueError:
+            continue
+    return slots
+
+
+_CSV_FORMATS = ("%d.%m.%Y %H:%M", "%d.%m %H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S")
+
+
+def parse_csv(data: bytes, year: int) -> List[datetime]:
+    """CSV с датой и временем в одной колонке или в двух соседних; заголовок и мусорные строки пропускаются."""
+    text = data.decode("utf-8-sig", errors="replace")
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    slots = []
+    for row in csv.reader(io.StringIO(text), dialect):
+        cells = [c.strip() for c in row if c.strip()]
+        candidates = [" ".join(cells[:2])] + cells[:1] if cells else []
+        for value in candidates:
+            parsed = _parse_any(value, year)
+            if parsed:
+                slots.append(parsed)
+                break
+        if len(slots) > MAX_SLOTS_PER_IMPORT:
+            raise ScheduleError(f"Слишком много окон, максимум {MAX_SLOTS_PER_IMPORT} за раз")
+    return slots
+
+
+def _parse_any(value: str, year: int) -> Optional[datetime]:
+    for fmt in _CSV_FORMATS:
+        try:
+            if "%Y" in fmt:
+                return datetime.strptime(value, fmt)
+            return datetime.strptime(f"{value} {year}", f"{fmt} %Y")
+        except ValueError:
+            continue
+    return None
+
+
+def parse_ics(data: bytes) -> List[datetime]:
+    """Начала событий VEVENT из календаря (.ics) — каждое событие становится окном.
+
+    Часовые пояса не пересчитываются: время берётся так, как записано в файле.
+    """
+    text = data.decode("utf-8", errors="replace")
+    # Разворачиваем перенесённые строки (RFC 5545, 3.1)
+    text = re.sub(r"\r?\n[ \t]", "", text)
+    slots = []
+    in_event = False
+    for line in text.splitlines():
+        if line == "BEGIN:VEVENT":
+            in_event = True
+        elif line == "END:VEVENT":
+            in_event = False
+        elif in_event and line.startswith("DTSTART"):
+            value = line.rsplit(":", 1)[1].strip().rstrip("Z")
+            for fmt in ("%Y%m%dT%H%M%S", "%Y%m%dT%H%M"):
+                try:
+                    slots.append(datetime.strptime(value, fmt))
+                    break
+                except ValueError:
+                    continue
+            if len(slots) > MAX_SLOTS_PER_IMPORT:
+                raise ScheduleError(f"Слишком много окон, максимум {MAX_SLOTS_PER_IMPORT} за раз")
+    return slots
+
+
+def format_slots(slots: Iterable[datetime]) -> List[str]:
+    return [slot.strftime(SLOT_FORMAT) for slot in slots]
@@ -0,0 +1,605 @@
+"""Миграции базы бота, применяются по порядку движком migrations.py.
+
+Только данные, без импортов: этот же список backend применяет сразу ко всем
+базам тенантов (python -m app.backend.migrate tenants). Новая миграция —
+новый кортеж в конце списка; уже выпущенные не редактируются.
+
+MIGRATIONS — своя база у каждого бота, POOL_MIGRATIONS — одна общая база всех
+ботов (TENANT_STORAGE=pooled): те же таблицы с tenant_id первым столбцом
+ключей и индексов, триггеры считают всё в пределах своего тенанта. Запросы
+бота одинаковы для обеих схем — в своей базе tenant_id у всех строк пустой
+(миграция 12). Новая таблица или столбец добавляется в оба списка.
+"""
+
+# Нормализация для поиска клиентов (миграция 8): «ё» ищется как «е», в телефоне только цифры
+_FOLD_YO = "replace(replace({}, 'ё', 'е'), 'Ё', 'Е')"
+_DIGITS = "replace(replace(replace(replace(replace(replace({}, ' ', ''), '-', ''), '(', ''), ')', ''), '+', ''), '.', '')"
+# Телефон индексируется целиком и последними 10 цифрами — находится и без кода страны
+_PHONE = _DIGITS + " || ' ' || substr(" + _DIGITS + ", -10)"
+_CLIENT_NOTES = (
+    "(SELECT COALESCE(group_concat(" + _FOLD_YO.format("anamnesis") + ", ' '), '') "
+    "FROM bookings WHERE user_id = {} AND anamnesis IS NOT NULL)"
+)
+# Счётчики по дням (миграция 9): день считается в поясе бота, смещение от UTC бот кладёт в bot_state при старте
+_STATS_DAY = "date('now', COALESCE((SELECT value FROM bot_state WHERE key = 'stats_utc_offset'), '+0 minutes'))"
+_STATS_BUMP = (
+    "INSERT INTO daily_stats (day, metric, count) VALUES (" + _STATS_DAY + ", {}, 1) "
+    "ON CONFLICT (day, metric) DO UPDATE SET count = count + 1;"
+)
+
+# Состояния FSM (миграция 13) и отметки повторов записи: одинаковы для своей и общей базы
+_FSM_STATE = [
+    """
+    CREATE TABLE IF NOT EXISTS fsm_state (
+        tenant_id TEXT NOT NULL DEFAULT '',
+        key TEXT NOT NULL,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        PRIMARY KEY (tenant_id, key)
+    ) WITHOUT ROWID
+    """,
+    # Апдейт, создавший запись, и время уведомления админов: повтор прерванного апдейта их не дублирует.
+    # Индекс не уникальный — после недели простоя Telegram нумерует апдейты заново
+    "ALTER TABLE bookings ADD COLUMN update_id INTEGER",
+    "ALTER TABLE bookings ADD COLUMN notified_at TEXT",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_update ON bookings (tenant_id, update_id) WHERE update_id IS NOT NULL",
+]
+
+# Время окна в сортируемом виде, как bookings.slot_at (миграция 14): по нему выбираются и
+# сортируются свободные окна от текущего момента
+_SLOT_AT = [
+    "ALTER TABLE slots ADD COLUMN slot_at TEXT NOT NULL DEFAULT ''",
+    """
+    UPDATE slots SET slot_at = substr(datetime, 7, 4) || '-' || substr(datetime, 4, 2) || '-'
+                               || substr(datetime, 1, 2) || ' ' || substr(datetime, 12, 5)
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_slots_free ON slots (tenant_id, available, slot_at)",
+]
+
+MIGRATIONS = [
+    (1, "users_slots", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            language TEXT NOT NULL,
+            name TEXT,
+            phone TEXT,
+            gender TEXT,
+            birth_date TEXT,
+            registered INTEGER DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            datetime TEXT NOT NULL,
+            available INTEGER DEFAULT 1
+        )
+        """,
+    ]),
+    (2, "unique_slots", [
+        # Дубли окон, накопившиеся до уникального индекса: оставляем занятое или самое раннее
+        """
+        DELETE FROM slots WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY datetime ORDER BY available, id) AS rn
+                FROM slots
+            ) WHERE rn > 1
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_slots_datetime ON slots (datetime)",
+    ]),
+    (3, "bookings", [
+        # slot_at дублирует время окна в сортируемом виде (ГГГГ-ММ-ДД ЧЧ:ММ) для индексов и фильтров
+        """
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            slot_id INTEGER NOT NULL,
+            service TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            slot_at TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_bookings_slot_at ON bookings (slot_at)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_service_slot_at ON bookings (service, slot_at)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings (user_id, status)",
+        # Окна, занятые до появления таблицы записей, переносим без привязки к клиенту
+        """
+        INSERT INTO bookings (user_id, slot_id, service, status, slot_at, created_at)
+        SELECT 0, id, '', 'confirmed',
+               substr(datetime, 7, 4) || '-' || substr(datetime, 4, 2) || '-' || substr(datetime, 1, 2)
+               || ' ' || substr(datetime, 12, 5),
+               datetime('now')
+        FROM slots
+        WHERE available = 0 AND id NOT IN (SELECT slot_id FROM bookings)
+        """,
+    ]),
+    (4, "broadcasts", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            progress_message_id INTEGER,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)",
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (5, "jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            due_at REAL NOT NULL,
+            kind TEXT NOT NULL,
+            booking_id INTEGER,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending'
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_pending_due ON jobs (due_at) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_pending_booking ON jobs (booking_id) WHERE status = 'pending'",
+    ]),
+    (6, "bot_state", [
+        """
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (7, "services", [
+        """
+        CREATE TABLE IF NOT EXISTS services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name_ru TEXT NOT NULL,
+            name_en TEXT,
+            duration_min INTEGER,
+            price INTEGER,
+            active INTEGER NOT NULL DEFAULT 1,
+            position INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        # Услуги, которые раньше были зашиты в код
+        """
+        INSERT INTO services (name_ru, name_en, duration_min, position) VALUES
+            ('Чистка лица', 'Facial cleansing', 60, 1),
+            ('Пилинг', 'Peeling', 45, 2),
+            ('Массаж лица', 'Facial massage', 45, 3),
+            ('Маска', 'Face mask', 30, 4)
+        """,
+    ]),
+    (8, "client_search", [
+        "ALTER TABLE bookings ADD COLUMN anamnesis TEXT",
+        # rowid строки индекса = id клиента; notes — все его анамнезы
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS clients_fts USING fts5(
+            name, phone, notes, tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        INSERT INTO clients_fts (rowid, name, phone, notes)
+        SELECT id, {_FOLD_YO.format("name")}, {_PHONE.format("phone", "phone")}, '' FROM users
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO clients_fts (rowid, name, phone, notes)
+            VALUES (new.id, {_FOLD_YO.format("new.name")}, {_PHONE.format("new.phone", "new.phone")}, '');
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_update AFTER UPDATE OF name, phone ON users BEGIN
+            UPDATE clients_fts SET name = {_FOLD_YO.format("new.name")}, phone = {_PHONE.format("new.phone", "new.phone")}
+            WHERE rowid = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS clients_fts_delete AFTER DELETE ON users BEGIN
+            DELETE FROM clients_fts WHERE rowid = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_notes AFTER INSERT ON bookings
+        WHEN new.anamnesis IS NOT NULL BEGIN
+            UPDATE clients_fts SET notes = {_CLIENT_NOTES.format("new.user_id")} WHERE rowid = new.user_id;
+        END
+        """,
+    ]),
+    (9, "daily_stats", [
+        # Воронка по дням: started, registered, booked и статусы записей (confirmed, paid, cancelled).
+        # Счётчики увеличивают триггеры в той же транзакции, что и само событие
+        """
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, metric)
+        ) WITHOUT ROWID
+        """,
+        # Из старых данных дату знаем только у создания записи; пользователи и статусы считаются с этой версии
+        """
+        INSERT INTO daily_stats (day, metric, count)
+        SELECT substr(created_at, 1, 10), 'booked', COUNT(*) FROM bookings GROUP BY substr(created_at, 1, 10)
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_stats_started AFTER INSERT ON users BEGIN
+            {_STATS_BUMP.format("'started'")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_stats_registered AFTER UPDATE OF registered ON users
+        WHEN new.registered = 1 AND COALESCE(old.registered, 0) != 1 BEGIN
+            {_STATS_BUMP.format("'registered'")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_stats_booked AFTER INSERT ON bookings BEGIN
+            {_STATS_BUMP.format("'booked'")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_stats_status AFTER UPDATE OF status ON bookings
+        WHEN new.status != old.status BEGIN
+            {_STATS_BUMP.format("new.status")}
+        END
+        """,
+    ]),
+    (10, "referrals", [
+        # referred_by ставится только при создании пользователя; счётчик и бонус денормализованы для таблицы лидеров
+        "ALTER TABLE users ADD COLUMN referred_by INTEGER",
+        "ALTER TABLE users ADD COLUMN referral_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE users ADD COLUMN referral_bonus INTEGER NOT NULL DEFAULT 0",
+        """
+        CREATE TABLE IF NOT EXISTS referrals (
+            referee_id INTEGER PRIMARY KEY,
+            referrer_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            rewarded_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals (referrer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_referral_count ON users (referral_count DESC) WHERE referral_count > 0",
+        # Связь и счётчики пишутся в транзакции самого INSERT пользователя: /start остаётся одной записью
+        f"""
+        CREATE TRIGGER IF NOT EXISTS referrals_edge AFTER INSERT ON users
+        WHEN new.referred_by IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO referrals (referee_id, referrer_id, created_at)
+            VALUES (new.id, new.referred_by, datetime('now'));
+            UPDATE users SET referral_count = referral_count + 1 WHERE id = new.referred_by;
+            {_STATS_BUMP.format("'referred'")}
+        END
+        """,
+        # Бонус пригласившему — за первую оплату приглашённого; размер бот кладёт в bot_state при старте
+        """
+        CREATE TRIGGER IF NOT EXISTS referrals_reward AFTER UPDATE OF status ON bookings
+        WHEN new.status = 'paid' BEGIN
+            UPDATE users
+            SET referral_bonus = referral_bonus
+                + COALESCE((SELECT CAST(value AS INTEGER) FROM bot_state WHERE key = 'referral_bonus'), 0)
+            WHERE id = (SELECT referrer_id FROM referrals WHERE referee_id = new.user_id AND rewarded_at IS NULL);
+            UPDATE referrals SET rewarded_at = datetime('now') WHERE referee_id = new.user_id AND rewarded_at IS NULL;
+        END
+        """,
+    ]),
+    (11, "shop", [
+        # photo — ссылка на фото товара; photo_file_id — то же фото, уже загруженное в Telegram этим ботом
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name_ru TEXT NOT NULL,
+            name_en TEXT,
+            price INTEGER NOT NULL,
+            description TEXT,
+            photo TEXT,
+            photo_file_id TEXT,
+            active INTEGER NOT NULL DEFAULT 1,
+            position INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        # items — снимок корзины на момент заказа (JSON: id, название, цена, количество)
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            items TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            payment_url TEXT,
+            created_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, status)",
+    ]),
+    (12, "tenant_id", [
+        # Запросы бота всегда фильтруют по tenant_id; в своей базе он пустой у всех строк
+        *(
+            f"ALTER TABLE {table} ADD COLUMN tenant_id TEXT NOT NULL DEFAULT ''"
+            for table in ("users", "slots", "bookings", "broadcasts", "broadcast_deliveries", "jobs", "bot_state",
+                          "services", "daily_stats", "referrals", "products", "orders")
+        ),
+    ]),
+    (13, "fsm_state", _FSM_STATE),
+    (14, "slot_at", _SLOT_AT),
+]
+
+# Общая база (TENANT_STORAGE=pooled): всё то же, но в пределах тенанта
+_POOL_STATS_DAY = (
+    "date('now', COALESCE((SELECT value FROM bot_state WHERE tenant_id = new.tenant_id "
+    "AND key = 'stats_utc_offset'), '+0 minutes'))"
+)
+_POOL_STATS_BUMP = (
+    "INSERT INTO daily_stats (tenant_id, day, metric, count) VALUES (new.tenant_id, " + _POOL_STATS_DAY + ", {}, 1) "
+    "ON CONFLICT (tenant_id, day, metric) DO UPDATE SET count = count + 1;"
+)
+_POOL_CLIENT_NOTES = (
+    "(SELECT COALESCE(group_concat(" + _FOLD_YO.format("anamnesis") + ", ' '), '') "
+    "FROM bookings WHERE tenant_id = new.tenant_id AND user_id = new.user_id AND anamnesis IS NOT NULL)"
+)
+
+# Услуги, с которыми начинает новый бот (в своей базе их добавляет миграция 7)
+POOL_SEED = [
+    """
+    INSERT INTO services (tenant_id, name_ru, name_en, duration_min, position) VALUES
+        (:tenant_id, 'Чистка лица', 'Facial cleansing', 60, 1),
+        (:tenant_id, 'Пилинг', 'Peeling', 45, 2),
+        (:tenant_id, 'Массаж лица', 'Facial massage', 45, 3),
+        (:tenant_id, 'Маска', 'Face mask', 30, 4)
+    """,
+]
+
+POOL_MIGRATIONS = [
+    (1, "pool", [
+        # Ключ клиента — (tenant_id, id): один человек может быть клиентом многих ботов.
+        # Таблица с rowid — он связывает строку клиента с clients_fts
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            tenant_id TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            language TEXT NOT NULL,
+            name TEXT,
+            phone TEXT,
+            gender TEXT,
+            birth_date TEXT,
+            registered INTEGER DEFAULT 0,
+            referred_by INTEGER,
+            referral_count INTEGER NOT NULL DEFAULT 0,
+            referral_bonus INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_users_referral_count ON users (tenant_id, referral_count DESC) "
+        "WHERE referral_count > 0",
+        """
+        CREATE TABLE IF NOT EXISTS slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL,
+            datetime TEXT NOT NULL,
+            available INTEGER DEFAULT 1
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_slots_datetime ON slots (tenant_id, datetime)",
+        """
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            slot_id INTEGER NOT NULL,
+            service TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            slot_at TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            anamnesis TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_bookings_slot_at ON bookings (tenant_id, slot_at)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_service_slot_at ON bookings (tenant_id, service, slot_at)",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings (tenant_id, user_id, status)",
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL,
+            admin_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            progress_message_id INTEGER,
+            created_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (tenant_id, status)",
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            tenant_id TEXT NOT NULL,
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            PRIMARY KEY (tenant_id, broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL,
+            due_at REAL NOT NULL,
+            kind TEXT NOT NULL,
+            booking_id INTEGER,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending'
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_pending_due ON jobs (tenant_id, due_at) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_pending_booking ON jobs (tenant_id, booking_id) WHERE status = 'pending'",
+        """
+        CREATE TABLE IF NOT EXISTS bot_state (
+            tenant_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (tenant_id, key)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL,
+            name_ru TEXT NOT NULL,
+            name_en TEXT,
+            duration_min INTEGER,
+            price INTEGER,
+            active INTEGER NOT NULL DEFAULT 1,
+            position INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_services_position ON services (tenant_id, position)",
+        # rowid строки индекса = rowid клиента в users (id клиента уникален только внутри тенанта)
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS clients_fts USING fts5(
+            name, phone, notes, tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO clients_fts (rowid, name, phone, notes)
+            VALUES (new.rowid, {_FOLD_YO.format("new.name")}, {_PHONE.format("new.phone", "new.phone")}, '');
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_update AFTER UPDATE OF name, phone ON users BEGIN
+            UPDATE clients_fts SET name = {_FOLD_YO.format("new.name")}, phone = {_PHONE.format("new.phone", "new.phone")}
+            WHERE rowid = new.rowid;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS clients_fts_delete AFTER DELETE ON users BEGIN
+            DELETE FROM clients_fts WHERE rowid = old.rowid;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_notes AFTER INSERT ON bookings
+        WHEN new.anamnesis IS NOT NULL BEGIN
+            UPDATE clients_fts SET notes = {_POOL_CLIENT_NOTES}
+            WHERE rowid = (SELECT rowid FROM users WHERE tenant_id = new.tenant_id AND id = new.user_id);
+        END
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            tenant_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, day, metric)
+        ) WITHOUT ROWID
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_stats_started AFTER INSERT ON users BEGIN
+            {_POOL_STATS_BUMP.format("'started'")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_stats_registered AFTER UPDATE OF registered ON users
+        WHEN new.registered = 1 AND COALESCE(old.registered, 0) != 1 BEGIN
+            {_POOL_STATS_BUMP.format("'registered'")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_stats_booked AFTER INSERT ON bookings BEGIN
+            {_POOL_STATS_BUMP.format("'booked'")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS daily_stats_status AFTER UPDATE OF status ON bookings
+        WHEN new.status != old.status BEGIN
+            {_POOL_STATS_BUMP.format("new.status")}
+        END
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS referrals (
+            tenant_id TEXT NOT NULL,
+            referee_id INTEGER NOT NULL,
+            referrer_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            rewarded_at TEXT,
+            PRIMARY KEY (tenant_id, referee_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals (tenant_id, referrer_id)",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS referrals_edge AFTER INSERT ON users
+        WHEN new.referred_by IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO referrals (tenant_id, referee_id, referrer_id, created_at)
+            VALUES (new.tenant_id, new.id, new.referred_by, datetime('now'));
+            UPDATE users SET referral_count = referral_count + 1
+            WHERE tenant_id = new.tenant_id AND id = new.referred_by;
+            {_POOL_STATS_BUMP.format("'referred'")}
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS referrals_reward AFTER UPDATE OF status ON bookings
+        WHEN new.status = 'paid' BEGIN
+            UPDATE users
+            SET referral_bonus = referral_bonus + COALESCE((
+                SELECT CAST(value AS INTEGER) FROM bot_state WHERE tenant_id = new.tenant_id AND key = 'referral_bonus'
+            ), 0)
+            WHERE tenant_id = new.tenant_id AND id = (
+                SELECT referrer_id FROM referrals
+                WHERE tenant_id = new.tenant_id AND referee_id = new.user_id AND rewarded_at IS NULL
+            );
+            UPDATE referrals SET rewarded_at = datetime('now')
+            WHERE tenant_id = new.tenant_id AND referee_id = new.user_id AND rewarded_at IS NULL;
+        END
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL,
+            name_ru TEXT NOT NULL,
+            name_en TEXT,
+            price INTEGER NOT NULL,
+            description TEXT,
+            photo TEXT,
+            photo_file_id TEXT,
+            active INTEGER NOT NULL DEFAULT 1,
+            position INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_products_position ON products (tenant_id, position)",
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            items TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            payment_url TEXT,
+            created_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (tenant_id, user_id, status)",
+    ]),
+    (2, "fsm_state", _FSM_STATE),
+    (3, "slot_at", _SLOT_AT),
+]
@@ -0,0 +1,190 @@
+"""Магазин: товары из таблицы products, корзина и заказы.
+
+Страницы каталога (текст и клавиатура) строятся один раз на язык и страницу
+и сбрасываются при изменении товаров. Фото по ссылке отправляется через общий
+кэш file_id (media_cache.py) и загружается в Telegram один раз; фото, которое
+админ прислал сам, уже лежит в Telegram и хранится как photo_file_id.
+Корзина — отдельный слот FSM (destiny "cart") вида {id товара: кол-во}:
+сценарии записи и регистрации чистят своё состояние, не задевая корзину.
+Заказ ждёт оплаты (pending), пока админ не отметит его оплаченным или
+отменённым кнопкой в уведомлении о заказе.
+"""
+import json
+from dataclasses import replace
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+from aiogram.fsm.context import FSMContext
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+PRODUCT_FIELDS = ("name_ru", "name_en", "price", "description", "photo", "photo_file_id")
+PAGE_SIZE = 6
+MAX_QUANTITY = 99
+
+
+def product_name(product: dict, language: str) -> str:
+    return (product["name_en"] if language == "en" else None) or product["name_ru"]
+
+
+def cart_context(state: FSMContext) -> FSMContext:
+    return FSMContext(state.storage, replace(state.key, destiny="cart"))
+
+
+class ProductCatalog:
+    def __init__(self):
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.tenant_id = ""
+        self._products: Optional[Dict[int, dict]] = None
+        self._pages: Dict[Tuple[str, int], Tuple[str, InlineKeyboardMarkup]] = {}
+
+    def attach(self, conn: aiosqlite.Connection, tenant_id: str):
+        self.conn = conn
+        self.tenant_id = tenant_id
+
+    def invalidate(self):
+        self._products = None
+        self._pages.clear()
+
+    async def _load(self) -> Dict[int, dict]:
+        if self._products is None:
+            cursor = await self.conn.execute(
+                "SELECT id, name_ru, name_en, price, description, photo, photo_file_id, active "
+                "FROM products WHERE tenant_id = ? ORDER BY position, id",
+                (self.tenant_id,)
+            )
+            keys = [column[0] for column in cursor.description]
+            self._products = {row[0]: dict(zip(keys, row)) for row in await cursor.fetchall()}
+        return self._products
+
+    async def all(self) -> List[dict]:
+        return list((await self._load()).values())
+
+    async def get(self, product_id: int) -> Optional[dict]:
+        return (await self._load()).get(product_id)
+
+    async def page(self, language: str, page: int) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+        """Текст и клавиатура страницы каталога; None, если товаров нет."""
+        products = [p for p in await self.all() if p["active"]]
+        if not products:
+            return None
+        pages = (len(products) + PAGE_SIZE - 1) // PAGE_SIZE
+        page = min(max(page, 0), pages - 1)
+        if (language, page) not in self._pages:
+            ru = language == "ru"
+            builder = InlineKeyboardBuilder()
+            for product in products[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]:
+                builder.button(text=f"{product_name(product, language)} — {product['price']}₽",
+                               callback_data=f"product_{product['id']}")
+            builder.adjust(1)
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"shop_page_{page - 1}"))
+            if page < pages - 1:
+                navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"shop_page_{page + 1}"))
+            if navigation:
+                builder.row(*navigation)
+            builder.row(InlineKeyboardButton(text="🛒 Корзина" if ru else "🛒 Cart", callback_data="cart"))
+            title = "🛍 Магазин" if ru else "🛍 Shop"
+            if pages > 1:
+                title += f" — {page + 1}/{pages}"
+            self._pages[(language, page)] = (title, builder.as_markup())
+        return self._pages[(language, page)]
+
+    async def add(self, name_ru: str, name_en: Optional[str], price: int, description: Optional[str] = None,
+                  photo: Optional[str] = None, photo_file_id: Optional[str] = None) -> int:
+        cursor = await self.conn.execute(
+            "INSERT INTO products (tenant_id, name_ru, name_en, price, description, photo, photo_file_id, position) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM products WHERE tenant_id = ?))",
+            (self.tenant_id, name_ru, name_en, price, description, photo, photo_file_id, self.tenant_id)
+        )
+        await self.conn.commit()
+        self.invalidate()
+        return cursor.lastrowid
+
+    async def update(self, product_id: int, **fields) -> bool:
+        fields = {key: value for key, value in fields.items() if key in PRODUCT_FIELDS + ("active",)}
+        if "photo" in fields and "photo_file_id" not in fields:
+            fields["photo_file_id"] = None  # новое фото загрузится при следующем показе
+        set_clause = ", ".join(f"{key} = ?" for key in fields)
+        cursor = await self.conn.execute(
+            f"UPDATE products SET {set_clause} WHERE tenant_id = ? AND id = ?",
+            [*fields.values(), self.tenant_id, product_id]
+        )
+        await self.conn.commit()
+        self.invalidate()
+        return cursor.rowcount > 0
+
+    async def create_order(self, user_id: int, items: List[dict], total: int) -> int:
+        cursor = await self.conn.execute(
+            "INSERT INTO orders (tenant_id, user_id, items, total, status, created_at) "
+            "VALUES (?, ?, ?, ?, 'pending', ?)",
+            (self.tenant_id, user_id, json.dumps(items, ensure_ascii=False), total,
+             datetime.now().isoformat(timespec="seconds"))
+        )
+        await self.conn.commit()
+        return cursor.lastrowid
+
+    async def set_order_status(self, order_id: int, status: str) -> Optional[dict]:
+        """Закрывает ожидающий заказ (paid / cancelled); None — заказа нет или он уже закрыт."""
+        cursor = await self.conn.execute(
+            "UPDATE orders SET status = ? WHERE tenant_id = ? AND id = ? AND status = 'pending'",
+            (status, self.tenant_id, order_id)
+        )
+        await self.conn.commit()
+        if cursor.rowcount == 0:
+            return None
+        cursor = await self.conn.execute(
+            "SELECT user_id, total FROM orders WHERE tenant_id = ? AND id = ?", (self.tenant_id, order_id)
+        )
+        user_id, total = await cursor.fetchone()
+        return {"id": order_id, "user_id": user_id, "total": total, "status": status}
+
+    async def set_payment_url(self, order_id: int, url: str):
+        await self.conn.execute(
+            "UPDATE orders SET payment_url = ? WHERE tenant_id = ? AND id = ?", (url, self.tenant_id, order_id)
+        )
+        await self.conn.commit()
+
+    async def cart_items(self, cart: Dict[str, int], language: str) -> Tuple[List[dict], int]:
+        """Позиции корзины по текущим ценам; снятые с продажи товары пропускаются."""
+        items = []
+        for product_id, quantity in cart.items():
+            product = await self.get(int(product_id))
+            if product and product["active"]:
+                items.append({"id": product["id"], "name": product_name(product, language),
+                              "price": product["price"], "quantity": quantity})
+        return items, sum(item["price"] * item["quantity"] for item in items)
+
+
+def render_cart(items: List[dict], total: int, language: str) -> Tuple[str, InlineKeyboardMarkup]:
+    ru = language == "ru"
+    builder = InlineKeyboardBuilder()
+    if not items:
+        builder.button(text="⬅️ Каталог" if ru else "⬅️ Catalog", callback_data="shop_page_0")
+        return ("🛒 Корзина пуста" if ru else "🛒 Your cart is empty"), builder.as_markup()
+
+    lines = ["🛒 Корзина:" if ru else "🛒 Cart:", ""]
+    for item in items:
+        lines.append(f"{item['name']} × {item['quantity']} = {item['price'] * item['quantity']}₽")
+        builder.button(text=f"➖ {item['name']}", callback_data=f"cart_del_{item['id']}")
+    lines += ["", f"{'Итого' if ru else 'Total'}: {total}₽"]
+    builder.button(text="✅ Оформить заказ" if ru else "✅ Checkout", callback_data="checkout")
+    builder.button(text="🗑 Очистить" if ru else "🗑 Clear", callback_data="cart_clear")
+    builder.button(text="⬅️ Каталог" if ru else "⬅️ Catalog", callback_data="shop_page_0")
+    builder.adjust(1)
+    return "\n".join(lines), builder.as_markup()
+
+
+def product_card(product: dict, language: str) -> Tuple[str, InlineKeyboardMarkup]:
+    ru = language == "ru"
+    text = f"{product_name(product, language)} — {product['price']}₽"
+    if product["description"]:
+        text += f"\n\n{product['description']}"
+    builder = InlineKeyboardBuilder()
+    builder.button(text="➕ В корзину" if ru else "➕ Add to cart", callback_data=f"cart_add_{product['id']}")
+    builder.button(text="🛒 Корзина" if ru else "🛒 Cart", callback_data="cart")
+    builder.button(text="⬅️ Каталог" if ru else "⬅️ Catalog", callback_data="shop_page_0")
+    builder.adjust(1, 2)
+    return text, builder.as_markup()
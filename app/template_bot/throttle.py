@@ -0,0 +1,117 @@
+"""Антифлуд: token bucket на пользователя и класс обработчика.
+
+Класс задаётся флагом обработчика: `@dp.message(..., flags={"throttle": "heavy"})`,
+без флага действует класс "default". Middleware подключается внутренним
+(dp.message.middleware / dp.callback_query.middleware), то есть после фильтров
+и до самого обработчика — отсеянное нажатие не трогает базу и не строит
+клавиатуры. Повторное нажатие той же inline-кнопки в пределах coalesce_window
+схлопывается: отвечаем на callback и ничего не выполняем.
+"""
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+from aiogram import BaseMiddleware, types
+from aiogram.dispatcher.flags import get_flag
+
+# класс -> (пополнение токенов в секунду, ёмкость ведра)
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "start": (1 / 3, 3),
+    "heavy": (0.5, 5),
+    "default": (2, 10),
+}
+THROTTLED_TEXT = "⏳ Слишком много запросов, подождите немного"
+# Вёдра и недавние callback'и чистятся (не чаще раза в секунду), когда их становится больше
+PRUNE_AT = 10_000
+
+
+class UserThrottle(BaseMiddleware):
+    def __init__(self, limits: Dict[str, Tuple[float, float]] = DEFAULT_LIMITS,
+                 exempt: Iterable[int] = (), coalesce_window: float = 1.0):
+        self.limits = limits
+        self.exempt = set(exempt)
+        self.coalesce_window = coalesce_window
+        # (user_id, класс) -> (токены, время обновления, предупреждён ли)
+        self.buckets: Dict[Tuple[int, str], Tuple[float, float, bool]] = {}
+        # (user_id, message_id, data) -> время последнего нажатия
+        self.recent_callbacks: Dict[Tuple[int, int, str], float] = {}
+        self.allowed = 0
+        self.throttled: Counter = Counter()
+        self.coalesced = 0
+        self._pruned_at = 0.0
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+        now = time.monotonic()
+
+        if isinstance(event, types.CallbackQuery) and event.message:
+            key = (user.id, event.message.message_id, event.data or "")
+            pressed_at = self.recent_callbacks.get(key)
+            self.recent_callbacks[key] = now
+            if pressed_at is not None and now - pressed_at < self.coalesce_window:
+                self.coalesced += 1
+                await event.answer()
+                return None
+
+        cls = get_flag(data, "throttle", default="default")
+        if not self._take(user.id, cls, now):
+            self.throttled[cls] += 1
+            await self._reject(event, user.id, cls)
+            return None
+
+        self.allowed += 1
+        if len(self.buckets) + len(self.recent_callbacks) > PRUNE_AT and now - self._pruned_at > 1:
+            self._prune(now)
+        return await handler(event, data)
+
+    def _refill(self, cls: str, tokens: float, updated: float, now: float) -> float:
+        rate, burst = self.limits.get(cls, self.limits["default"])
+        return min(burst, tokens + (now - updated) * rate)
+
+    def _take(self, user_id: int, cls: str, now: float) -> bool:
+        burst = self.limits.get(cls, self.limits["default"])[1]
+        tokens, updated, warned = self.buckets.get((user_id, cls), (burst, now, False))
+        tokens = self._refill(cls, tokens, updated, now)
+        if tokens < 1:
+            self.buckets[(user_id, cls)] = (tokens, now, warned)
+            return False
+        self.buckets[(user_id, cls)] = (tokens - 1, now, False)
+        return True
+
+    async def _reject(self, event: types.TelegramObject, user_id: int, cls: str):
+        if isinstance(event, types.CallbackQuery):
+            await event.answer(THROTTLED_TEXT)
+            return
+        # На сообщения предупреждаем один раз за серию, дальше молчим — иначе флуд тратит лимиты Bot API
+        tokens, updated, warned = self.buckets[(user_id, cls)]
+        if not warned and isinstance(event, types.Message):
+            self.buckets[(user_id, cls)] = (tokens, updated, True)
+            await event.answer(THROTTLED_TEXT)
+
+    def _prune(self, now: float):
+        """Убирает полные вёдра и устаревшие нажатия: их состояние совпадает с отсутствием записи."""
+        self._pruned_at = now
+        self.buckets = {
+            (user_id, cls): (tokens, updated, warned)
+            for (user_id, cls), (tokens, updated, warned) in self.buckets.items()
+            if self._refill(cls, tokens, updated, now) < self.limits.get(cls, self.limits["default"])[1]
+        }
+        self.recent_callbacks = {
+            key: pressed_at for key, pressed_at in self.recent_callbacks.items()
+            if now - pressed_at < self.coalesce_window
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "throttled": dict(self.throttled),
+            "coalesced": self.coalesced,
+            "tracked_buckets": len(self.buckets),
+        }
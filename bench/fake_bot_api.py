@@ -0,0 +1,152 @@
+"""Локальный фейковый Bot API для нагрузочных тестов без обращения к Telegram.
+
+Понимает getMe, getUpdates (long polling), sendMessage, setWebhook/deleteWebhook,
+на остальные методы отвечает `true`. Все отправленные ботом сообщения
+запоминаются по чатам, чтобы сценарии могли нажимать кнопки из ответов.
+"""
+import json
+import time
+import asyncio
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.updates: List[dict] = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.sent: Dict[int, List[dict]] = defaultdict(list)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.polled = asyncio.Event()
+        self._new_updates = asyncio.Condition()
+        self._new_messages = asyncio.Condition()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        async with self._new_updates:
+            self._new_updates.notify_all()
+        if self._runner:
+            await self._runner.cleanup()
+
+    # --- Входящие апдейты для бота ---
+
+    async def push_update(self, payload: dict) -> int:
+        async with self._new_updates:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+            self.updates.append({"update_id": update_id, **payload})
+            self._new_updates.notify_all()
+        return update_id
+
+    async def wait_message(self, chat_id: int, after: int, timeout: float = 10,
+                           match: Optional[Callable[[dict], bool]] = None) -> dict:
+        """Ждёт сообщение бота в чат с порядковым номером не меньше `after`.
+
+        С `match` возвращает первое подходящее сообщение — нужно для чата админа,
+        куда параллельно пишут разные сценарии.
+        """
+        def found() -> Optional[dict]:
+            for message in self.sent[chat_id][after:]:
+                if match is None or match(message):
+                    return message
+            return None
+
+        async with self._new_messages:
+            await asyncio.wait_for(self._new_messages.wait_for(lambda: found() is not None), timeout)
+            return found()
+
+    # --- Bot API ---
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+        handler = getattr(self, f"_method_{method.lower()}", None)
+        result = await handler(request.match_info["token"], params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _method_getme(self, token: str, params: dict) -> dict:
+        bot_id = int(token.split(":", 1)[0])
+        return {"id": bot_id, "is_bot": True, "first_name": "Bench", "username": f"bench_{bot_id}_bot"}
+
+    async def _method_getupdates(self, token: str, params: dict) -> List[dict]:
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        timeout = float(params.get("timeout", 0))
+        self.polled.set()
+        async with self._new_updates:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self.updates[:limit]
+
+    async def _method_sendmessage(self, token: str, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": (await self._method_getme(token, params)),
+            "text": params.get("text", ""),
+        }
+        self.next_message_id += 1
+        recorded = dict(message)
+        if "reply_markup" in params:
+            recorded["reply_markup"] = json.loads(params["reply_markup"])
+            # В ответе Bot API у Message бывает только inline-клавиатура
+            if "inline_keyboard" in recorded["reply_markup"]:
+                message["reply_markup"] = recorded["reply_markup"]
+        async with self._new_messages:
+            self.sent[chat_id].append(recorded)
+            self._new_messages.notify_all()
+        return message
+
+    async def _method_editmessagereplymarkup(self, token: str, params: dict) -> bool:
+        """Новая клавиатура сообщения (листание) записывается как очередное сообщение чата."""
+        if "reply_markup" in params:
+            chat_id = int(params["chat_id"])
+            recorded = {
+                "message_id": int(params["message_id"]),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "",
+                "reply_markup": json.loads(params["reply_markup"]),
+            }
+            async with self._new_messages:
+                self.sent[chat_id].append(recorded)
+                self._new_messages.notify_all()
+        return True
+
+    async def _method_setwebhook(self, token: str, params: dict) -> bool:
+        return True
+
+
+def callback_buttons(message: dict, text: Optional[str] = None) -> List[str]:
+    """callback_data inline-кнопок сообщения (только с указанным текстом, если он задан)."""
+    markup = message.get("reply_markup") or {}
+    return [
+        button["callback_data"]
+        for row in markup.get("inline_keyboard", [])
+        for button in row
+        if "callback_data" in button and (text is None or button["text"] == text)
+    ]
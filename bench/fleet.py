@@ -0,0 +1,129 @@
+"""Нагрузка на backend: создание ботов через create_bot_instance и проходы subscription_checker.
+
+docker подменяется скриптом-заглушкой в PATH, Bot API — фейковым сервером,
+так что измеряется только собственная работа backend (копирование шаблона,
+.env, реестр, подписки).
+"""
+import os
+import stat
+import time
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from bench.metrics import LatencyRecorder
+
+
+def install_fake_docker(workdir: Path):
+    bin_dir = workdir / "bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    docker = bin_dir / "docker"
+    docker.write_text(
+        "#!/bin/sh\n"
+        "case \"$1\" in\n"
+        "  inspect) echo true ;;\n"
+        "  exec) echo '{\"ready\": true, \"phases\": {}}' ;;\n"
+        "  cp) touch \"$3\" ;;\n"
+        "esac\n"
+        "exit 0\n"
+    )
+    docker.chmod(docker.stat().st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+
+
+def configure_backend(workdir: Path, api_url: str):
+    """Переменные окружения читаются модулями backend при импорте."""
+    os.environ.update({
+        "BOTS_DIR": str(workdir / "bots_storage"),
+        "TEMPLATE_BOT_DIR": str(Path(__file__).resolve().parent.parent / "app" / "template_bot"),
+        "SUBSCRIPTIONS_DB": str(workdir / "subscriptions.db"),
+        "BACKUP_DIR": str(workdir / "backups"),
+        "TELEGRAM_API_URL": api_url,
+        "HOST_CPUS": "100000",
+        "HOST_MEMORY_MB": "100000000",
+    })
+
+
+async def _reset_state(workdir: Path):
+    from app.shared.subscription_db import init_db
+
+    shutil.rmtree(workdir / "bots_storage", ignore_errors=True)
+    (workdir / "bots_storage").mkdir(parents=True)
+    db_path = workdir / "subscriptions.db"
+    if db_path.exists():
+        db_path.unlink()
+    await init_db()
+
+
+async def bench_provisioning(workdir: Path, tenants: int) -> dict:
+    from app.backend.models import BotRequest
+    from app.backend.utils import create_bot_instance
+
+    await _reset_state(workdir)
+    latency = LatencyRecorder()
+    started = time.perf_counter()
+    for i in range(tenants):
+        request = BotRequest(bot_token=f"{200_000 + i}:BENCH-tenant", admin_id=1000)
+        t0 = time.perf_counter()
+        await create_bot_instance(request)
+        latency.add(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return {
+        "tenants": tenants,
+        "seconds": round(elapsed, 3),
+        "tenants_per_sec": round(tenants / elapsed, 1) if elapsed else 0,
+        "latency_ms": latency.summary(),
+    }
+
+
+def _seed_expired_subscriptions(workdir: Path, tenants: int):
+    created_at = (datetime.now() - timedelta(days=4)).isoformat()
+    # Предупреждение за сутки уже ушло — проход останавливает ботов
+    warned_at = (datetime.now() - timedelta(days=2)).isoformat()
+    with sqlite3.connect(workdir / "subscriptions.db") as conn:
+        rows = []
+        for i in range(tenants):
+            bot_id = f"sweep{i:04d}"
+            bot_dir = workdir / "bots_storage" / bot_id
+            bot_dir.mkdir(parents=True)
+            (bot_dir / ".env").write_text(f"BOT_TOKEN={300_000 + i}:BENCH-sweep\nADMIN_IDS=1000\n")
+            rows.append((bot_id, created_at, 1, 0, warned_at))
+        conn.executemany(
+            "INSERT INTO subscriptions (bot_id, created_at, active, paid, warned_at) VALUES (?, ?, ?, ?, ?)", rows
+        )
+
+
+async def bench_subscription_sweep(workdir: Path, api, tenants: int) -> dict:
+    from app.backend import subscription_checker
+
+    await _reset_state(workdir)
+    _seed_expired_subscriptions(workdir, tenants)
+    sent_before = api.calls["sendMessage"]
+
+    started = time.perf_counter()
+    await subscription_checker.check_subscriptions()
+    elapsed = time.perf_counter() - started
+
+    with sqlite3.connect(workdir / "subscriptions.db") as conn:
+        still_active = conn.execute("SELECT COUNT(*) FROM subscriptions WHERE active = 1").fetchone()[0]
+    return {
+        "tenants": tenants,
+        "seconds": round(elapsed, 3),
+        "tenants_per_sec": round(tenants / elapsed, 1) if elapsed else 0,
+        "notified": api.calls["sendMessage"] - sent_before,
+        "still_active": still_active,
+    }
+
+
+async def run_fleet(workdir: Path, api, sizes) -> dict:
+    install_fake_docker(workdir)
+    configure_backend(workdir, api.base_url)
+    results = {"provisioning": [], "subscription_sweep": []}
+    for size in sizes:
+        results["provisioning"].append(await bench_provisioning(workdir, size))
+        results["subscription_sweep"].append(await bench_subscription_sweep(workdir, api, size))
+
+    from app.shared.bot_api import close_shared_session
+    await close_shared_session()
+    return results
@@ -0,0 +1,216 @@
+"""Синтетические пользовательские сценарии против template_bot/main.py.
+
+Бот запускается в этом же процессе с настоящим `dp.start_polling`, но ходит
+в фейковый Bot API. Каждый пользователь проходит регистрацию, запись на приём,
+подтверждение админом и оплату.
+"""
+import os
+import sys
+import time
+import asyncio
+import importlib
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from bench.fake_bot_api import FakeBotAPI, callback_buttons
+from bench.metrics import LatencyRecorder, rss_mb
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "app" / "template_bot"
+# В контейнере общие модули лежат рядом с main.py (см. backend/utils.copy_template)
+SHARED_DIR = TEMPLATE_DIR.parent / "shared"
+BOT_TOKEN = "100000:BENCH-template-bot"
+ADMIN_ID = 1000
+FIRST_USER_ID = 10_000
+
+
+def load_template_bot(workdir: Path, api_url: str):
+    """Импортирует шаблонного бота так, как он запускается в контейнере."""
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "ADMIN_IDS": str(ADMIN_ID),
+        "DB_PATH": str(workdir / "bot_database.db"),
+        "TELEGRAM_API_URL": api_url,
+        "READY_FILE": str(workdir / "bot_ready"),
+        "METRICS_FILE": str(workdir / "bot_metrics.json"),
+    })
+    os.chdir(workdir)  # bot.log пишется в текущую папку
+    sys.path[:0] = [str(TEMPLATE_DIR), str(SHARED_DIR)]
+    return importlib.import_module("main")
+
+
+class JourneyRunner:
+    def __init__(self, api: FakeBotAPI, template, step_timeout: float = 10):
+        self.api = api
+        self.template = template
+        self.step_timeout = step_timeout
+        self.handler_latency = LatencyRecorder()
+        self.updates = 0
+        self.sql_ops = 0
+        self._admin_lock = asyncio.Lock()
+        self._message_id = 0
+        self.slots: List[str] = []
+
+    # --- Построение апдейтов ---
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        self._message_id += 1
+        return {"message": {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }}
+
+    def _callback(self, user_id: int, data: str, message: dict) -> dict:
+        self._message_id += 1
+        return {"callback_query": {
+            "id": str(self._message_id),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message,
+        }}
+
+    async def _send(self, chat_id: int, update: dict, reply_chat: Optional[int] = None,
+                    match: Optional[Callable[[dict], bool]] = None) -> dict:
+        """Отправляет апдейт и ждёт ответ бота (первый или первый подходящий под `match`)."""
+        reply_chat = reply_chat or chat_id
+        seen = len(self.api.sent[reply_chat])
+        await self.api.push_update(update)
+        return await self.api.wait_message(reply_chat, seen, self.step_timeout, match)
+
+    async def say(self, user_id: int, text: str, **kwargs) -> dict:
+        return await self._send(user_id, self._message(user_id, text), **kwargs)
+
+    async def press(self, user_id: int, message: dict, prefix: str, text: Optional[str] = None, **kwargs) -> dict:
+        data = next((d for d in callback_buttons(message, text) if d.startswith(prefix)), None)
+        if data is None:
+            raise LookupError(f"нет кнопки {prefix!r} в ответе {message.get('text')!r}")
+        return await self._send(user_id, self._callback(user_id, data, message), **kwargs)
+
+    # --- Сценарии ---
+
+    async def registration(self, user_id: int):
+        reply = await self.say(user_id, "/start")
+        await self.press(user_id, reply, "lang_ru")
+        await self.say(user_id, f"User {user_id}")
+        await self.say(user_id, "+70000000000")
+        await self.say(user_id, "ж")
+        await self.say(user_id, "01.01.1990", match=_has_keyboard)
+
+    async def booking(self, user_id: int):
+        services = await self.say(user_id, "Записаться на прием")
+        slots = await self.press(user_id, services, "service_")
+        # У каждого пользователя своё окно, чтобы параллельные сценарии не занимали одно и то же;
+        # окна показываются страницами — листаем до своего
+        slot = self.slots[user_id - FIRST_USER_ID]
+        while not callback_buttons(slots, slot):
+            slots = await self.press(user_id, slots, "slots_page_", text="▶️")
+        await self.press(user_id, slots, "slot_", text=slot)
+        return await self.say(user_id, "Аллергий нет", reply_chat=ADMIN_ID,
+                              match=lambda m: _has_button(m, f"confirm_{user_id}_"))
+
+    async def admin_confirm_and_payment(self, user_id: int, request: dict):
+        # payment_context в шаблоне общий на всех админов, поэтому подтверждения идут по одному
+        async with self._admin_lock:
+            await self.press(ADMIN_ID, request, f"confirm_{user_id}_",
+                             match=lambda m: m["text"].startswith("Введите сумму"))
+            invoice = await self.say(ADMIN_ID, "900₽ на карту 0000", reply_chat=user_id,
+                                     match=lambda m: _has_button(m, "paid_"))
+        await self.press(user_id, invoice, "paid_")
+
+    async def journey(self, user_id: int):
+        await self.registration(user_id)
+        request = await self.booking(user_id)
+        await self.admin_confirm_and_payment(user_id, request)
+
+    # --- Запуск ---
+
+    def install_probes(self):
+        runner = self
+
+        async def timing_middleware(handler, event, data):
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                runner.handler_latency.add(time.perf_counter() - started)
+                runner.updates += 1
+
+        self.template.dp.update.outer_middleware(timing_middleware)
+
+    def _count_sql(self, statement: str):
+        self.sql_ops += 1
+
+    async def run(self, users: int, concurrency: int) -> dict:
+        self.install_probes()
+        bot_task = asyncio.create_task(self.template.main())
+        await asyncio.wait_for(self.api.polled.wait(), 30)
+
+        # Окна под все записи, плюс трассировка запросов к SQLite
+        # Окна в следующем году: клиенту показываются только ещё не наступившие
+        year = datetime.now().year + 1
+        slots = [datetime.strptime(f"{line} {year}", "%d.%m %H:%M %Y") for line in _slot_lines(users)]
+        self.slots = [slot.strftime("%d.%m.%Y %H:%M") for slot in slots]
+        await self.template.db.insert_slots(slots)
+        await self.template.db.conn.set_trace_callback(self._count_sql)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        errors: List[str] = []
+
+        async def one(user_id: int):
+            async with semaphore:
+                try:
+                    await self.journey(user_id)
+                except Exception as e:
+                    errors.append(f"{user_id}: {type(e).__name__} {e}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(FIRST_USER_ID + i) for i in range(users)))
+        elapsed = time.perf_counter() - started
+
+        await self.template.dp.stop_polling()
+        await bot_task
+
+        return {
+            "users": users,
+            "concurrency": concurrency,
+            "errors": len(errors),
+            "error_samples": errors[:5],
+            "updates": self.updates,
+            "seconds": round(elapsed, 3),
+            "updates_per_sec": round(self.updates / elapsed, 1) if elapsed else 0,
+            "handler_latency_ms": self.handler_latency.summary(),
+            "sqlite_ops_per_update": round(self.sql_ops / self.updates, 2) if self.updates else 0,
+            "rss_mb": rss_mb(),
+            "startup_phases": dict(self.template.startup_phases),
+            "lanes": self.template.lanes.snapshot(),
+            "throttle": self.template.throttle.snapshot(),
+            "api_calls": dict(self.api.calls),
+        }
+
+
+def _has_keyboard(message: dict) -> bool:
+    return "reply_markup" in message
+
+
+def _has_button(message: dict, prefix: str) -> bool:
+    return any(d.startswith(prefix) for d in callback_buttons(message))
+
+
+def _slot_lines(count: int) -> List[str]:
+    """Уникальные окна "дд.мм ЧЧ:ММ" по 10 минут с 08:00 до 20:00."""
+    lines = []
+    day, minute = 0, 0
+    while len(lines) < count:
+        hour, mins = divmod(8 * 60 + minute, 60)
+        lines.append(f"{day % 28 + 1:02d}.{day // 28 % 12 + 1:02d} {hour:02d}:{mins:02d}")
+        minute += 10
+        if minute >= 12 * 60:
+            day, minute = day + 1, 0
+    return lines
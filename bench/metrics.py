@@ -0,0 +1,39 @@
+import resource
+from typing import List
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples: List[float] = []
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index]
+
+    def summary(self) -> dict:
+        return {
+            "count": len(self.samples),
+            "p50": round(self.percentile(50) * 1000, 3),
+            "p99": round(self.percentile(99) * 1000, 3),
+            "max": round(max(self.samples, default=0) * 1000, 3),
+        }
+
+
+def rss_mb() -> dict:
+    """Текущий и пиковый RSS процесса в мегабайтах."""
+    current = 0.0
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"current": round(current, 1), "peak": round(peak, 1)}
@@ -0,0 +1,84 @@
+"""Нагрузочный и soak-бенчмарк без реального Telegram.
+
+    python -m bench.run --users 200 --concurrency 20 --tenants 10,100,1000 \
+        --output bench_results.json --compare previous.json
+
+Результаты пишутся в JSON; с --compare печатается разница с прошлым прогоном.
+"""
+import sys
+import json
+import asyncio
+import shutil
+import argparse
+import tempfile
+import platform
+from datetime import datetime
+from pathlib import Path
+
+from bench.fake_bot_api import FakeBotAPI
+from bench.fleet import run_fleet
+from bench.journeys import JourneyRunner, load_template_bot
+
+
+async def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="bot-bench-"))
+    api = FakeBotAPI()
+    await api.start()
+    try:
+        results = {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+        }
+        if args.users:
+            template = load_template_bot(workdir, api.base_url)
+            runner = JourneyRunner(api, template, step_timeout=args.step_timeout)
+            results["template_bot"] = await runner.run(args.users, args.concurrency)
+        if args.tenants:
+            results["fleet"] = await run_fleet(workdir, api, args.tenants)
+        return results
+    finally:
+        await api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _flatten(data, prefix=""):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from _flatten(value, f"{prefix}{key}.")
+    elif isinstance(data, list):
+        for i, value in enumerate(data):
+            yield from _flatten(value, f"{prefix}{i}.")
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix.rstrip("."), data
+
+
+def compare(current: dict, previous: dict):
+    old = dict(_flatten(previous))
+    for key, value in _flatten(current):
+        if key in old and old[key]:
+            change = (value - old[key]) / old[key] * 100
+            print(f"{key:60} {old[key]:>12} -> {value:>12} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="пользователей в сценариях шаблонного бота (0 — пропустить)")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--step-timeout", type=float, default=10)
+    parser.add_argument("--tenants", type=lambda s: [int(x) for x in s.split(",") if x], default=[10, 100, 1000],
+                        help="размеры флота через запятую (пусто — пропустить)")
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("--compare", type=Path, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+    args.output = args.output.resolve()
+
+    results = asyncio.run(run(args))
+    args.output.write_text(json.dumps(results, ensure_ascii=False, indent=2))
+    json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,13 @@
+const API_URL = "http://77.233.221.220/api";
+
+const STAGES = {
+  validated: "Токен проверен, собираем образ бота...",
+  placed: "Сервер выбран, собираем и запускаем бота...",
+  image_ready: "Образ собран, запускаем контейнер...",
+  container_started: "Контейнер запущен, бот подключается к Telegram...",
+  online: "Бот в сети, завершаем настройку..."
+};
+
 document.getElementById("bot-form").addEventListener("submit", async (e) => {
   e.preventDefault();
 
@@ -8,7 +18,7 @@ document.getElementById("bot-form").addEventListener("submit", async (e) => {
   result.textContent = "Создание бота...";
 
   try {
-    const response = await fetch("http://77.233.221.220/api/create_bot/", {
+    const response = await fetch(`${API_URL}/create_bot/`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({
@@ -19,18 +29,42 @@ document.getElementById("bot-form").addEventListener("submit", async (e) => {
 
     const data = await response.json();
 
-    if (response.ok) {
-      result.textContent = `✅ Бот создан! Вот ссылка: https://t.me/${getUsernameFromToken(botToken)}`;
-    } else {
+    if (!response.ok) {
       result.textContent = `❌ Ошибка: ${data.detail}`;
+      return;
     }
+
+    result.textContent = `Токен принят, бот @${data.username}. Создание...`;
+    followProgress(data.job_id, result);
   } catch (err) {
     result.textContent = "❌ Не удалось подключиться к серверу.";
   }
 });
 
-// Быстрое извлечение username (не точное, временное)
-function getUsernameFromToken(token) {
-  const parts = token.split(":");
-  return "your_bot"; // Можно позже заменить на запрос к Telegram API
+// Этапы создания приходят с сервера через Server-Sent Events
+function followProgress(jobId, result) {
+  const events = new EventSource(`${API_URL}/create_bot/${jobId}/events`);
+
+  events.addEventListener("progress", (e) => {
+    const event = JSON.parse(e.data);
+
+    if (event.stage === "done") {
+      result.textContent = `✅ Бот @${event.username} создан! Вот ссылка: ${event.link}`;
+      events.close();
+    } else if (event.stage === "failed") {
+      result.textContent = `❌ Ошибка: ${event.detail}`;
+      events.close();
+    } else {
+      result.textContent = STAGES[event.stage] || event.stage;
+    }
+  });
+  // При обрыве EventSource переподключается сам и продолжает с Last-Event-ID.
+  // Если сервер ответил ошибкой (задача устарела или backend перезапущен), соединение закрыто насовсем
+  events.onerror = () => {
+    if (events.readyState === EventSource.CLOSED) {
+      result.textContent = "❌ Потеряна связь с сервером, статус создания неизвестен. "
+        + "Проверьте бота в Telegram или попробуйте ещё раз.";
+      events.close();
+    }
+  };
 }